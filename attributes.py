@@ -1,5 +1,11 @@
-from typing import List, Dict, Tuple
+import copy
+from typing import List, Dict, FrozenSet, Tuple, Union
+
+import pandas as pd
+
+import sql_expr_evaluator
 import sql_expr_parser
+import window_functions
 
 
 class Attribute:
@@ -10,21 +16,41 @@ class Attribute:
     def get_dependencies(self) -> List[str]:
         raise NotImplementedError("Subclasses should implement this method.")
 
+    def get_input_columns(self, preceding_filters: List = None) -> List[str]:
+        """
+        Returns columns read by get_values
+        """
+        return self.get_dependencies()
+
     def get_sql_expression(self, preceding_filters: List = None) -> str:
         raise NotImplementedError("Subclasses should implement this method.")
 
+    def get_values(self, df: pd.DataFrame, preceding_filters: List = None,
+                   partitions: window_functions.Partitions = None) -> pd.Series:
+        """
+        Computes attribute natively, equivalent to get_sql_expression evaluated over df
+        """
+        raise NotImplementedError("Subclasses should implement this method.")
+
+
+def _get_partition_by(partition_by: Union[str, List[str]] = None) -> List[str]:
+    if not partition_by:
+        return []
+    return [partition_by] if isinstance(partition_by, str) else list(partition_by)
+
+
+def _get_partition_by_sql(partition_by: List[str]) -> str:
+    return f"partition by {', '.join(partition_by)}" if partition_by else ''
+
 
 class AttributeRank(Attribute):
-    def __init__(self, code: str, data_type: str, rank_attrs: List[str], partition_by: str = None):
+    def __init__(self, code: str, data_type: str, rank_attrs: List[str], partition_by: Union[str, List[str]] = None):
         super().__init__(code, data_type)
         self.rank_attrs = rank_attrs
-        self.partition_by = partition_by
+        self.partition_by = _get_partition_by(partition_by)
 
     def get_dependencies(self) -> List[str]:
-        r = [a['attr_code'] for a in self.rank_attrs]
-        if self.partition_by:
-            r.append(self.partition_by)
-        return r
+        return [a['attr_code'] for a in self.rank_attrs] + self.partition_by
 
     def _get_rank_attrs(self, preceding_filters: List = None) -> List[Tuple]:
         # apply preceding filters first. it ranks DESC to give rows passed filters more priority
@@ -33,27 +59,53 @@ class AttributeRank(Attribute):
                           for a in sorted(self.rank_attrs, key=lambda x: x['order']))
         return rank_attrs
 
+    def get_input_columns(self, preceding_filters: List = None) -> List[str]:
+        return self.get_dependencies() + list(preceding_filters or [])
+
     def get_sql_expression(self, preceding_filters: List = None) -> str:
         rank_attrs = ','.join(f"{attr_code} {direction}"
                               for attr_code, direction in self._get_rank_attrs(preceding_filters))
-        partition_by_string = f'partition by {self.partition_by}' if self.partition_by else ''
+        partition_by_string = _get_partition_by_sql(self.partition_by)
         return f"rank() over({partition_by_string} order by {rank_attrs} nulls last) as {self.code}"
 
+    def _get_keys(self, df: pd.DataFrame, preceding_filters: List = None) -> List:
+        rank_attrs = self._get_rank_attrs(preceding_filters or [])
+        # 'nulls last' of the generated sql applies to the last order by term only
+        return [window_functions.sort_key(df[attr_code], direction, True if i == len(rank_attrs) - 1 else None)
+                for i, (attr_code, direction) in enumerate(rank_attrs)]
+
+    def get_values(self, df: pd.DataFrame, preceding_filters: List = None,
+                   partitions: window_functions.Partitions = None) -> pd.Series:
+        partitions = partitions or window_functions.Partitions()
+        codes, _ = partitions.get_codes(df, self.partition_by)
+        return pd.Series(window_functions.rank(codes, self._get_keys(df, preceding_filters)),
+                         index=df.index, name=self.code)
+
+    def get_top_values(self, df: pd.DataFrame, limit: int, preceding_filters: List = None,
+                       partitions: window_functions.Partitions = None) -> pd.Series:
+        """
+        Same as get_values for rows ranked within limit, the other rows get limit + 1
+        """
+        partitions = partitions or window_functions.Partitions()
+        codes, n_groups = partitions.get_codes(df, self.partition_by)
+        return pd.Series(window_functions.top_rank(codes, n_groups, self._get_keys(df, preceding_filters), limit),
+                         index=df.index, name=self.code)
+
 
 class AttributeAggregate(Attribute):
     def __init__(self, code: str, data_type: str, aggregate_attr_code: str, aggregate_function: str,
-                 aggregate_direction: str, partition_by: str = None):
+                 aggregate_direction: str, partition_by: Union[str, List[str]] = None):
         super().__init__(code, data_type)
         self.aggregate_attr_code = aggregate_attr_code
         self.aggregate_function = aggregate_function
         self.aggregate_direction = aggregate_direction
-        self.partition_by = partition_by
+        self.partition_by = _get_partition_by(partition_by)
 
     def get_dependencies(self) -> List[str]:
-        r = [self.aggregate_attr_code]
-        if self.partition_by:
-            r.append(self.partition_by)
-        return r
+        return [self.aggregate_attr_code] + self.partition_by
+
+    def get_input_columns(self, preceding_filters: List = None) -> List[str]:
+        return self.get_dependencies() + list(preceding_filters or [])
 
     def get_sql_expression(self, preceding_filters: List = None) -> str:
         if preceding_filters:
@@ -61,10 +113,24 @@ class AttributeAggregate(Attribute):
             aggregate_expression = f'(case when {aux_string} then {self.aggregate_attr_code} end)'
         else:
             aggregate_expression = self.aggregate_attr_code
-        sql_expression = f'{self.aggregate_function}({aggregate_expression}) over ({self.partition_by})'
+        window = _get_partition_by_sql(self.partition_by)
+        if self.aggregate_direction:
+            window += f' order by {self.aggregate_attr_code} {self.aggregate_direction}'
+        return f"{self.aggregate_function}({aggregate_expression}) over ({window.strip()}) as {self.code}"
+
+    def get_values(self, df: pd.DataFrame, preceding_filters: List = None,
+                   partitions: window_functions.Partitions = None) -> pd.Series:
+        partitions = partitions or window_functions.Partitions()
+        codes, _ = partitions.get_codes(df, self.partition_by)
+        # preceding filters are applied as a mask instead of the case when column of the sql expression
+        mask = window_functions.get_mask(df, preceding_filters or [])
+        values = df[self.aggregate_attr_code]
+        function = self.aggregate_function.upper()
         if self.aggregate_direction:
-            sql_expression += f'order by {self.aggregate_attr_code} {self.aggregate_direction}'
-        return f"{sql_expression} as {self.code}"
+            result = window_functions.running_aggregate(values, mask, codes, function, self.aggregate_direction)
+        else:
+            result = window_functions.aggregate(values, mask, codes, function)
+        return pd.Series(result, index=df.index, name=self.code)
 
 
 class AttributeExpression(Attribute):
@@ -78,6 +144,10 @@ class AttributeExpression(Attribute):
     def get_sql_expression(self, preceding_filters: List = None) -> str:
         return f"{self.expression} as {self.code}"
 
+    def get_values(self, df: pd.DataFrame, preceding_filters: List = None,
+                   partitions: window_functions.Partitions = None) -> pd.Series:
+        return sql_expr_evaluator.evaluate_expression(self.expression, df).rename(self.code)
+
 
 class AttributeInput(Attribute):
     def get_dependencies(self) -> List[str]:
@@ -86,6 +156,10 @@ class AttributeInput(Attribute):
     def get_sql_expression(self, preceding_filters: List = None) -> str:
         return self.code
 
+    def get_values(self, df: pd.DataFrame, preceding_filters: List = None,
+                   partitions: window_functions.Partitions = None) -> pd.Series:
+        return df[self.code]
+
 
 def get_universe_attributes(universe: List[Dict]) -> List[Attribute]:
     universe_attributes = list()
@@ -114,6 +188,33 @@ def get_universe_attributes(universe: List[Dict]) -> List[Attribute]:
     return universe_attributes
 
 
+def partition_by_as_of(universe_attributes: List[Attribute], as_of_column: str) -> List[Attribute]:
+    """
+    Returns universe of stacked input data of several dates in as_of_column: rank and aggregate attributes
+    are partitioned by date first, as if each date were run on its own. Attributes of universe_attributes
+    are left as they are (callers cache them), partitioned ones are copies
+    """
+    partitioned = []
+    for attr in universe_attributes:
+        if isinstance(attr, (AttributeRank, AttributeAggregate)) and as_of_column not in attr.partition_by:
+            attr = copy.copy(attr)
+            attr.partition_by = [as_of_column] + attr.partition_by
+        partitioned.append(attr)
+    if not any(attr.code == as_of_column for attr in partitioned):
+        partitioned.append(AttributeInput(as_of_column, 'D'))
+    return partitioned
+
+
+def get_numeric_attributes(universe_attributes: List[Attribute]) -> FrozenSet[str]:
+    """
+    Returns codes of attributes holding numbers whatever the input data: ranks and counts, sums and averages.
+    Types of input columns depend on the data
+    """
+    return frozenset(attr.code for attr in universe_attributes
+                     if isinstance(attr, AttributeRank) or isinstance(attr, AttributeAggregate) and
+                     attr.aggregate_function.upper() in ('COUNT', 'SUM', 'AVG'))
+
+
 def get_attribute(attr_code: str, universe_attributes: List[Attribute]) -> Attribute:
     """
     Returns Attribute type by attr_code from universe_attributes
@@ -0,0 +1,175 @@
+import argparse
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Callable, List, NamedTuple, Tuple
+
+import general
+import plans
+import predicate_cache
+import selection
+import selectivity
+
+# Runs many client folders in one pool of processes. Each process keeps the inputs it has loaded by content
+# hash of their files, so sessions sharing universe and selections files compile their plans once per process
+# and sessions sharing an input data file load it once and reuse its selectivity statistics and evaluated
+# predicates. Parsed expressions are shared by the cache of sql_expr_parser.parse. The least recently used
+# inputs are dropped above max_input_bytes of loaded input data (their statistics and predicates go with them)
+# or max_plans compiled plans, so a batch over many different inputs doesn't grow without limit.
+
+max_input_bytes = int(os.environ.get('SLCT_BATCH_INPUT_BYTES', 1 << 30))
+max_plans = int(os.environ.get('SLCT_BATCH_PLANS', 256))
+
+
+class Session(NamedTuple):
+    client_input_folder: str
+    client_output_folder: str
+
+
+class SessionResult(NamedTuple):
+    client_input_folder: str
+    selections: int
+    seconds: float
+    error: str
+
+
+class InputsCache:
+    """
+    Parsed inputs of the current process by content hash of their files, least recently used first
+    """
+
+    def __init__(self, input_bytes: int = None, plan_count: int = None):
+        self.input_bytes = max_input_bytes if input_bytes is None else input_bytes
+        self.plan_count = max_plans if plan_count is None else plan_count
+        # key -> (value, size)
+        self._input_data: 'OrderedDict[str, Tuple[tuple, int]]' = OrderedDict()
+        self._plans: 'OrderedDict[str, Tuple[plans.Plans, int]]' = OrderedDict()
+
+    @staticmethod
+    def _get_hash(file_name: str) -> str:
+        try:
+            return general.get_file_hash(file_name)
+        except FileNotFoundError:
+            # the reader raises the error of the missing input
+            return file_name
+
+    @staticmethod
+    def _get(cache: OrderedDict, key: str, read: Callable, size: Callable, limit: int):
+        """
+        Returns cached value of key, read if missing. Least recently used values are dropped while sizes
+        of the values exceed limit, the returned one is kept
+        """
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key][0]
+        value = read()
+        cache[key] = (value, size(value))
+        total = sum(value_size for _, value_size in cache.values())
+        while total > limit and len(cache) > 1:
+            _, (_, value_size) = cache.popitem(last=False)
+            total -= value_size
+        return value
+
+    def get_inputs(self, client_input_folder: str, cache_folder: str = None):
+        """
+        Same as selection.get_inputs, also returns shared selectivity stats and predicates cache of the input data
+        """
+        input_data_file = os.path.join(client_input_folder, selection.INPUT_DATA_FILE_NAME)
+        df, stats, atoms = self._get(self._input_data, self._get_hash(input_data_file),
+                                     partial(self._read_input_data, input_data_file, cache_folder),
+                                     lambda inputs: int(inputs[0].memory_usage(deep=True).sum()), self.input_bytes)
+        try:
+            key = plans.get_key(os.path.join(client_input_folder, selection.UNIVERSE_FILE_NAME),
+                                os.path.join(client_input_folder, selection.SELECTIONS_FILE_NAME))
+        except FileNotFoundError:
+            # selection.get_plans raises the error of the missing input
+            key = client_input_folder
+        compiled = self._get(self._plans, key, partial(selection.get_plans, client_input_folder, cache_folder),
+                             lambda _: 1, self.plan_count)
+        return df, compiled, stats, atoms
+
+    @staticmethod
+    def _read_input_data(file_name: str, cache_folder: str = None) -> tuple:
+        df = selection.read_input_data(file_name, cache_folder)
+        return df, selectivity.SelectivityStats(df), predicate_cache.AtomCache(df)
+
+
+_inputs_cache = InputsCache()
+
+
+def run_session(session: Session, engine: str, cache_folder: str = None) -> SessionResult:
+    """
+    Runs one client folder with inputs cached by the current process, errors are returned in the result
+    """
+    started = time.perf_counter()
+    try:
+        df, compiled, stats, atoms = _inputs_cache.get_inputs(session.client_input_folder, cache_folder)
+        os.makedirs(session.client_output_folder, exist_ok=True)
+        selection.run_selections(df, compiled, session.client_output_folder, engine, stats=stats, atoms=atoms)
+    except Exception as e:
+        return SessionResult(session.client_input_folder, 0, time.perf_counter() - started, f"{type(e).__name__}: {e}")
+    return SessionResult(session.client_input_folder, len(compiled.selections), time.perf_counter() - started, '')
+
+
+def read_manifest(manifest_file: str) -> List[Session]:
+    """
+    Manifest is a json list of {"client_input_folder": ..., "client_output_folder": ...} sessions
+    """
+    with open(manifest_file, 'r') as file:
+        return [Session(s['client_input_folder'], s['client_output_folder']) for s in json.load(file)]
+
+
+def get_sessions(client_input_folders: List[str], output_root: str) -> List[Session]:
+    """
+    Output of each input folder goes to the folder of the same name in output_root
+    """
+    return [Session(folder, os.path.join(output_root, os.path.basename(os.path.normpath(folder))))
+            for folder in client_input_folders]
+
+
+def run_batch(sessions: List[Session], engine: str = 'native', processes: int = None,
+              cache_folder: str = None) -> Tuple[List[SessionResult], float]:
+    """
+    Runs sessions on a pool of processes (processes=1 runs them in this process), returns their results in
+    sessions order and the elapsed time. With cache_folder processes memory-map input data from its column cache
+    """
+    started = time.perf_counter()
+    run = partial(run_session, engine=engine, cache_folder=cache_folder)
+    if processes == 1:
+        results = [run(session) for session in sessions]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(run, sessions))
+    return results, time.perf_counter() - started
+
+
+def main(args: List[str] = None):
+    parser = argparse.ArgumentParser(description='Runs selections of many client folders')
+    parser.add_argument('client_input_folders', nargs='*', help='client input folders')
+    parser.add_argument('--manifest', help='json list of client_input_folder/client_output_folder sessions')
+    parser.add_argument('--output-root', default='output', help='parent of output folders of client_input_folders')
+    parser.add_argument('--engine', choices=selection.ENGINES, default='native')
+    parser.add_argument('--processes', type=int, help='number of processes, all cores by default')
+    parser.add_argument('--cache-folder', help='column cache of input data shared by processes and runs')
+    options = parser.parse_args(args)
+    sessions = get_sessions(options.client_input_folders, options.output_root)
+    if options.manifest:
+        sessions.extend(read_manifest(options.manifest))
+    if not sessions:
+        parser.error('no client folders given')
+    results, elapsed = run_batch(sessions, options.engine, options.processes, options.cache_folder)
+    for result in results:
+        if result.error:
+            print(f"{result.client_input_folder}: {result.error}")
+    failed = sum(1 for result in results if result.error)
+    print(f"{len(results)} sessions ({failed} failed, {sum(r.selections for r in results)} selections) "
+          f"in {elapsed:.2f}s: {len(results) / elapsed:.1f} sessions/s")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
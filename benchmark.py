@@ -0,0 +1,60 @@
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Start up benchmark. Every measurement runs in a fresh interpreter, as short batch jobs and
+# newly started server workers do, and reports the median of repeat runs in seconds.
+
+IMPORT_SCRIPT = """
+import time
+started = time.perf_counter()
+import {module}
+print(time.perf_counter() - started)
+"""
+
+FIRST_RESULT_SCRIPT = """
+import time
+started = time.perf_counter()
+import selection
+selection.run({client_input_folder!r}, {client_output_folder!r}, engine={engine!r})
+print(time.perf_counter() - started)
+"""
+
+
+def _measure(script: str, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-c', script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True)
+        timings.append(float(result.stdout.split()[-1]))
+    return statistics.median(timings)
+
+
+def import_time(module: str = 'selection', repeat: int = 5) -> float:
+    """
+    Returns time to import module
+    """
+    return _measure(IMPORT_SCRIPT.format(module=module), repeat)
+
+
+def time_to_first_result(client_input_folder: str = 'source_data', engine: str = 'native', repeat: int = 5) -> float:
+    """
+    Returns time from interpreter start to outputs of all selections of client_input_folder, imports included
+    """
+    with tempfile.TemporaryDirectory() as client_output_folder:
+        script = FIRST_RESULT_SCRIPT.format(client_input_folder=os.path.abspath(client_input_folder),
+                                            client_output_folder=client_output_folder, engine=engine)
+        return _measure(script, repeat)
+
+
+def main():
+    for module in ('selection', 'server'):
+        print(f"import {module}: {import_time(module):.3f}s")
+    for engine in ('native', 'sql'):
+        print(f"first result, {engine} engine: {time_to_first_result(engine=engine):.3f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+import argparse
+import itertools
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+from typing import Dict, List, NamedTuple
+
+import numpy as np
+import pandas as pd
+
+import selection
+
+# Equivalence check of the engines: runs the selections of client folders with every engine and native
+# option and compares their outputs with the sql engine's. Outputs match if they have the same files with the
+# same rows in any order (the sql engines don't order rows) and equal values, numbers up to float rounding
+# and -0.0 equal to 0.0 (SQLite stores -0.0 as 0.0). By default it checks source_data and a synthetic folder
+# of multi-level selections with every combination of output settings over ranks, grouped and running
+# aggregates of numbers and text, chained attributes, NULLs, a parameter sweep and a deep show_all=0 selection.
+
+# name and selection.run options of each checked run, the first one is the reference
+RUNS = {
+    'sql': dict(engine='sql'),
+    'duckdb': dict(engine='duckdb'),
+    'native': dict(engine='native'),
+    'native_no_short_circuit': dict(engine='native', short_circuit=False),
+    'native_memory_budget': dict(engine='native', memory_budget=1 << 16),
+    'native_shards': dict(engine='native', shard_processes=2),
+}
+# files some runs write in addition to outputs
+EXTRA_FILE_NAMES = ('memory.csv',)
+SYNTHETIC_ROWS = 3000
+
+SYNTHETIC_ATTRIBUTES = [
+    {"attr_code": "K", "attr_type": "INPUT", "attr_data_type": "BIGINT"},
+    {"attr_code": "P", "attr_type": "INPUT", "attr_data_type": "VARCHAR(255)"},
+    {"attr_code": "G", "attr_type": "INPUT", "attr_data_type": "BIGINT"},
+    {"attr_code": "I", "attr_type": "INPUT", "attr_data_type": "BIGINT"},
+    {"attr_code": "X", "attr_type": "INPUT", "attr_data_type": "NUMBER"},
+    {"attr_code": "Y", "attr_type": "INPUT", "attr_data_type": "NUMBER"},
+    {"attr_code": "S", "attr_type": "INPUT", "attr_data_type": "VARCHAR(255)"},
+    {"attr_code": "A_SUM_X_P", "attr_type": "AGGREGATE", "attr_data_type": "NUMBER", "aggregate_attr_code": "X",
+     "aggregate_function": "SUM", "aggregate_direction": None, "partition_by": "P"},
+    {"attr_code": "A_AVG_X", "attr_type": "AGGREGATE", "attr_data_type": "NUMBER", "aggregate_attr_code": "X",
+     "aggregate_function": "AVG", "aggregate_direction": None},
+    {"attr_code": "A_MAX_X_ASC_P", "attr_type": "AGGREGATE", "attr_data_type": "NUMBER", "aggregate_attr_code": "X",
+     "aggregate_function": "MAX", "aggregate_direction": "ASC", "partition_by": "P"},
+    {"attr_code": "A_COUNT_X_DESC", "attr_type": "AGGREGATE", "attr_data_type": "NUMBER", "aggregate_attr_code": "X",
+     "aggregate_function": "COUNT", "aggregate_direction": "DESC"},
+    {"attr_code": "A_COUNT_S_P", "attr_type": "AGGREGATE", "attr_data_type": "NUMBER", "aggregate_attr_code": "S",
+     "aggregate_function": "COUNT", "aggregate_direction": None, "partition_by": "P"},
+    {"attr_code": "A_MIN_S_G", "attr_type": "AGGREGATE", "attr_data_type": "VARCHAR(255)", "aggregate_attr_code": "S",
+     "aggregate_function": "MIN", "aggregate_direction": None, "partition_by": "G"},
+    {"attr_code": "A_MAX_S_DESC_G", "attr_type": "AGGREGATE", "attr_data_type": "VARCHAR(255)",
+     "aggregate_attr_code": "S", "aggregate_function": "MAX", "aggregate_direction": "DESC", "partition_by": "G"},
+    {"attr_code": "R_X", "attr_type": "RANK", "attr_data_type": "NUMBER",
+     "rank_attrs": [{"attr_code": "X", "order": 1, "direction": "DESC"}]},
+    {"attr_code": "R_X_P", "attr_type": "RANK", "attr_data_type": "NUMBER", "partition_by": "P",
+     "rank_attrs": [{"attr_code": "X", "order": 1, "direction": "ASC"}]},
+    {"attr_code": "R_Y_I_G", "attr_type": "RANK", "attr_data_type": "NUMBER", "partition_by": "G",
+     "rank_attrs": [{"attr_code": "Y", "order": 1, "direction": "DESC"}, {"attr_code": "I", "order": 2,
+                                                                         "direction": "ASC"}]},
+    {"attr_code": "E_SCORE", "attr_type": "EXPRESSION", "attr_data_type": "NUMBER",
+     "expression": "case when X is null then 0 else X * 2 + I % 3 end"},
+    {"attr_code": "R_SCORE", "attr_type": "RANK", "attr_data_type": "NUMBER",
+     "rank_attrs": [{"attr_code": "E_SCORE", "order": 1, "direction": "DESC"}]},
+    {"attr_code": "E_TOP", "attr_type": "EXPRESSION", "attr_data_type": "NUMBER", "expression": "R_SCORE * 2 + G"},
+    {"attr_code": "R_TOP_P", "attr_type": "RANK", "attr_data_type": "NUMBER", "partition_by": "P",
+     "rank_attrs": [{"attr_code": "E_TOP", "order": 1, "direction": "ASC"}]},
+    {"attr_code": "A_SUM_SCORE_G", "attr_type": "AGGREGATE", "attr_data_type": "NUMBER",
+     "aggregate_attr_code": "E_SCORE", "aggregate_function": "SUM", "aggregate_direction": None,
+     "partition_by": "G"},
+]
+
+SYNTHETIC_FILTERS = [
+    {"filter_id": 1, "expression": "S in ('a', 'b', 'c') or S is null", "application_level": 1},
+    {"filter_id": 2, "expression": "Y > -1.5 and A_COUNT_S_P > 10", "application_level": 1},
+    {"filter_id": 3, "expression": "R_X_P <= 300", "application_level": 2},
+    {"filter_id": 4, "expression": "A_SUM_X_P > 0 and X * 2 + I % 3 between 0 and 30 or A_MAX_S_DESC_G >= 'c'",
+     "application_level": 2},
+    {"filter_id": 5, "expression": "R_SCORE < 1200", "application_level": 3},
+    {"filter_id": 6, "expression": "A_SUM_SCORE_G > 1900 or I % 2 = 0", "application_level": 3},
+]
+
+SYNTHETIC_OUTPUT_ATTRS = [
+    {"attr_code": "A_AVG_X", "application_level": 1},
+    {"attr_code": "A_MIN_S_G", "application_level": 1},
+    {"attr_code": "A_MAX_X_ASC_P", "application_level": 2},
+    {"attr_code": "A_COUNT_X_DESC", "application_level": 2},
+    {"attr_code": "R_X", "application_level": 2},
+    {"attr_code": "R_Y_I_G", "application_level": 3},
+]
+
+
+class Difference(NamedTuple):
+    run: str
+    file_name: str
+    message: str
+
+
+def get_synthetic_selections() -> List[Dict]:
+    """
+    Returns the synthetic multi-level selection with each combination of output settings, a parameter sweep
+    and a selection of deeply chained attributes
+    """
+    settings = ('show_all', 'add_attributes', 'add_filters', 'add_failed_filters')
+    selections = [{"selection_id": selection_id, "filters": SYNTHETIC_FILTERS, "output_attrs": SYNTHETIC_OUTPUT_ATTRS,
+                   "output_settings": dict(zip(settings, values))}
+                  for selection_id, values in enumerate(itertools.product((0, 1), repeat=len(settings)), 1)]
+    selections.append({"selection_id": len(selections) + 1,
+                       "filters": [dict(f, expression="R_X_P <= {n}") if f['filter_id'] == 3 else f
+                                   for f in SYNTHETIC_FILTERS],
+                       "output_attrs": SYNTHETIC_OUTPUT_ATTRS, "parameters": {"n": [50, 300]},
+                       "output_settings": dict(zip(settings, (0, 1, 1, 0)))})
+    # dropping failed rows of 3 levels with a chain of 4 attributes at the last one nests as deep as SQLite parses
+    selections.append({"selection_id": len(selections) + 1,
+                       "filters": [dict(f, expression="R_TOP_P < 60") if f['filter_id'] == 5 else f
+                                   for f in SYNTHETIC_FILTERS],
+                       "output_attrs": SYNTHETIC_OUTPUT_ATTRS,
+                       "output_settings": dict(zip(settings, (0, 0, 1, 1)))})
+    return selections
+
+
+def write_synthetic_folder(client_input_folder: str, rows: int = SYNTHETIC_ROWS, seed: int = 0):
+    """
+    Writes input data, universe and selections of the synthetic client folder
+    """
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'K': np.arange(rows),
+        'P': rng.choice(list('abcde'), rows),
+        'G': rng.integers(0, 8, rows),
+        'I': rng.integers(-5, 20, rows),
+        # ties and NULLs
+        'X': np.where(rng.random(rows) < 0.15, np.nan, rng.normal(5, 4, rows).round(1)),
+        'Y': np.where(rng.random(rows) < 0.1, np.nan, rng.normal(0, 1, rows).round(2)),
+        'S': rng.choice(np.array(['a', 'b', 'c', 'd', 'ab', None], dtype=object), rows),
+    })
+    os.makedirs(client_input_folder, exist_ok=True)
+    df.to_csv(os.path.join(client_input_folder, selection.INPUT_DATA_FILE_NAME), index=False)
+    with open(os.path.join(client_input_folder, selection.UNIVERSE_FILE_NAME), 'w') as file:
+        json.dump({"key": "K", "attributes": SYNTHETIC_ATTRIBUTES}, file, indent=1)
+    with open(os.path.join(client_input_folder, selection.SELECTIONS_FILE_NAME), 'w') as file:
+        json.dump({"selections": get_synthetic_selections()}, file, indent=1)
+
+
+def _equal_values(value: str, expected: str) -> bool:
+    if value == expected:
+        return True
+    try:
+        return math.isclose(float(value), float(expected), rel_tol=1e-9, abs_tol=1e-12)
+    except ValueError:
+        return False
+
+
+def compare_outputs(output_file: str, expected_file: str) -> str:
+    """
+    Returns how output_file differs from expected_file, empty if they have the same rows in any order
+    """
+    output, expected = (pd.read_csv(f, dtype=str, keep_default_na=False) for f in (output_file, expected_file))
+    if list(output.columns) != list(expected.columns):
+        return f"columns {list(output.columns)} instead of {list(expected.columns)}"
+    if len(output) != len(expected):
+        return f"{len(output)} rows instead of {len(expected)}"
+    rows = [sorted(df.itertuples(index=False, name=None), key=lambda row: [_sort_key(v) for v in row])
+            for df in (output, expected)]
+    for row, expected_row in zip(*rows):
+        for column, value, expected_value in zip(expected.columns, row, expected_row):
+            if not _equal_values(value, expected_value):
+                return f"{column} is {value!r} instead of {expected_value!r} in row {row[:3]}..."
+    return ''
+
+
+def _sort_key(value: str):
+    # numbers by value, so that rounding of the last digit doesn't reorder rows
+    try:
+        number = float(value)
+        return 0, 0.0 if number == 0 else round(number, 6), ''
+    except ValueError:
+        return 1, 0.0, value
+
+
+def check_folder(client_input_folder: str, output_root: str, runs: Dict[str, dict] = None) -> List[Difference]:
+    """
+    Runs selections of client_input_folder with each of runs and returns differences of their outputs
+    from the first run's
+    """
+    runs = runs or RUNS
+    differences = []
+    output_folders = {}
+    for name, options in runs.items():
+        output_folders[name] = os.path.join(output_root, name)
+        os.makedirs(output_folders[name])
+        try:
+            selection.run(client_input_folder, output_folders[name], **options)
+        except Exception as e:
+            differences.append(Difference(name, '', f"{type(e).__name__}: {str(e).splitlines()[0][:300]}"))
+    reference = next(iter(runs))
+    if differences and differences[0].run == reference:
+        return differences
+    expected_files = sorted(f for f in os.listdir(output_folders[reference]) if f not in EXTRA_FILE_NAMES)
+    for name in list(runs)[1:]:
+        files = sorted(f for f in os.listdir(output_folders[name]) if f not in EXTRA_FILE_NAMES)
+        for file_name in sorted(set(files) ^ set(expected_files)):
+            differences.append(Difference(name, file_name, 'missing' if file_name in expected_files else 'extra'))
+        for file_name in sorted(set(files) & set(expected_files)):
+            message = compare_outputs(os.path.join(output_folders[name], file_name),
+                                      os.path.join(output_folders[reference], file_name))
+            if message:
+                differences.append(Difference(name, file_name, message))
+    return differences
+
+
+def main(args: List[str] = None):
+    parser = argparse.ArgumentParser(description='Checks that all engines give the same outputs')
+    parser.add_argument('client_input_folders', nargs='*',
+                        help='folders to check, source_data and a synthetic folder by default')
+    parser.add_argument('--output-root', help='folder to keep outputs of each run in')
+    options = parser.parse_args(args)
+    with tempfile.TemporaryDirectory() as work_folder:
+        folders = options.client_input_folders
+        if not folders:
+            synthetic_folder = os.path.join(work_folder, 'synthetic')
+            write_synthetic_folder(synthetic_folder)
+            folders = [os.path.join(os.path.dirname(os.path.abspath(__file__)), 'source_data'), synthetic_folder]
+        output_root = options.output_root or os.path.join(work_folder, 'outputs')
+        failed = 0
+        for position, folder in enumerate(folders):
+            folder_output_root = os.path.join(output_root, f'{position}_{os.path.basename(os.path.normpath(folder))}')
+            if os.path.exists(folder_output_root):
+                shutil.rmtree(folder_output_root)
+            differences = check_folder(folder, folder_output_root)
+            for difference in differences:
+                print(f"{folder} {difference.run} {difference.file_name}: {difference.message}")
+            failed += bool(differences)
+            print(f"{folder}: {len(RUNS)} runs {'identical' if not differences else 'DIFFER'}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
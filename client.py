@@ -1,27 +1,260 @@
-import requests
+import argparse
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from typing import List, NamedTuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Client of server.py. One client reuses pooled keep-alive connections for all its requests, uploads files
+# gzip-compressed (the server decompresses files named *.gz), submits many sessions concurrently with
+# bounded parallelism, polls for their outputs and streams them to disk.
 
 url = 'http://127.0.0.1:5000/'
+CHUNK_SIZE = 1 << 20
+
+
+class ClientError(Exception):
+    pass
+
+
+class ClientSession(NamedTuple):
+    client_input_folder: str
+    # downloaded outputs archive
+    output_file: str
+    session_id: str = None
+
+
+class ClientResult(NamedTuple):
+    client_input_folder: str
+    session_id: str
+    seconds: float
+    error: str
+
+
+def get_file_names(client_input_folder: str) -> List[str]:
+    return sorted(os.path.join(client_input_folder, f) for f in os.listdir(client_input_folder)
+                  if os.path.isfile(os.path.join(client_input_folder, f)))
+
+
+class SelectionClient:
+    def __init__(self, server_url: str = url, max_parallel: int = 4, compress: bool = True,
+                 timeout: float = 600, retries: int = 3):
+        self.server_url = server_url.rstrip('/') + '/'
+        self.max_parallel = max_parallel
+        self.compress = compress
+        self.timeout = timeout
+        self.http = requests.Session()
+        # one pooled connection per concurrent submission, connection errors are retried with backoff
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_parallel,
+                              max_retries=Retry(total=retries, connect=retries, read=0, backoff_factor=0.2,
+                                                allowed_methods=['GET']))
+        self.http.mount('http://', adapter)
+        self.http.mount('https://', adapter)
+
+    def close(self):
+        self.http.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _open(self, file_name: str, stack: ExitStack):
+        """
+        Returns upload name and file object of file_name, gzip-compressed to a spooled temporary file
+        """
+        name = os.path.basename(file_name)
+        source = stack.enter_context(open(file_name, 'rb'))
+        if not self.compress:
+            return name, source
+        compressed = stack.enter_context(tempfile.SpooledTemporaryFile(max_size=16 * CHUNK_SIZE))
+        with gzip.GzipFile(fileobj=compressed, mode='wb', compresslevel=1) as target:
+            shutil.copyfileobj(source, target, CHUNK_SIZE)
+        compressed.seek(0)
+        return f'{name}.gz', compressed
+
+    def upload(self, session_id: str, file_names: List[str]):
+        """
+        Uploads files of a session, the server runs its selections before responding
+        """
+        with ExitStack() as stack:
+            files = [('source', self._open(file_name, stack)) for file_name in file_names]
+            response = self.http.post(self.server_url, params={'session_id': session_id}, files=files,
+                                      timeout=self.timeout)
+        if response.status_code != 200:
+            raise ClientError(f"Upload of session {session_id} failed: {response.status_code} {response.text[:200]}")
+
+    def preview(self, file_names: List[str], sample_rows: int = None, examples: int = None) -> list:
+        """
+        Returns previews of the selections of files estimated by the server on a sample, see preview
+        """
+        params = {name: value for name, value in [('sample_rows', sample_rows), ('examples', examples)]
+                  if value is not None}
+        with ExitStack() as stack:
+            files = [('source', self._open(file_name, stack)) for file_name in file_names]
+            response = self.http.post(self.server_url + 'preview', params=params, files=files, timeout=self.timeout)
+        if response.status_code != 200:
+            raise ClientError(f"Preview failed: {response.status_code} {response.text[:200]}")
+        return response.json()
+
+    def summarize(self, file_names: List[str], engine: str = None) -> dict:
+        """
+        Returns counts of the selections of files computed by the server without their outputs, see summary
+        """
+        params = {'engine': engine} if engine is not None else {}
+        with ExitStack() as stack:
+            files = [('source', self._open(file_name, stack)) for file_name in file_names]
+            response = self.http.post(self.server_url + 'summary', params=params, files=files, timeout=self.timeout)
+        if response.status_code != 200:
+            raise ClientError(f"Summary failed: {response.status_code} {response.text[:200]}")
+        return response.json()
+
+    def is_done(self, session_id: str) -> bool:
+        response = self.http.get(self.server_url + 'status', params={'session_id': session_id}, timeout=self.timeout)
+        return response.status_code == 200
+
+    def wait(self, session_id: str, timeout: float = None, interval: float = 0.1):
+        """
+        Polls until outputs of session are available, the interval doubles up to 5 seconds
+        """
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        while not self.is_done(session_id):
+            if time.monotonic() > deadline:
+                raise ClientError(f"Session {session_id} not done in time")
+            time.sleep(interval)
+            interval = min(interval * 2, 5)
+
+    def download(self, session_id: str, output_file: str):
+        """
+        Streams outputs archive of session to output_file
+        """
+        with self.http.get(self.server_url + 'download', params={'session_id': session_id}, stream=True,
+                           timeout=self.timeout) as response:
+            if response.status_code != 200:
+                raise ClientError(f"Download of session {session_id} failed: {response.status_code}")
+            os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+            # written to a temporary file which is renamed when complete
+            tmp_file = f'{output_file}.{uuid.uuid4().hex}.tmp'
+            try:
+                with open(tmp_file, 'wb') as file:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        file.write(chunk)
+                os.replace(tmp_file, output_file)
+            finally:
+                if os.path.exists(tmp_file):
+                    os.remove(tmp_file)
+
+    def _query(self, path: str, session_id: str, keys: List = None, as_of: str = None, **params) -> dict:
+        """
+        Runs a point query over outputs of a finished session, keys are posted as a json batch
+        """
+        params = dict(params, session_id=session_id, **({'as_of': as_of} if as_of is not None else {}))
+        json = {'keys': [str(key) for key in keys]} if keys is not None else None
+        response = self.http.request('POST' if json else 'GET', self.server_url + path, params=params, json=json,
+                                     timeout=self.timeout)
+        if response.status_code != 200:
+            raise ClientError(f"Query {path} of session {session_id} failed: {response.status_code} "
+                              f"{response.text[:200]}")
+        return response.json()
+
+    def is_selected(self, session_id: str, selection_id, keys: List, as_of: str = None) -> dict:
+        """
+        Returns whether selection_id (output id of a sweep variant) selected each of keys, by key
+        """
+        return self._query('selected', session_id, keys, as_of, selection_id=selection_id)
+
+    def get_selections(self, session_id: str, keys: List, as_of: str = None) -> dict:
+        """
+        Returns ids of the selections selecting each of keys, by key
+        """
+        return self._query('selections', session_id, keys, as_of)
+
+    def get_counts(self, session_id: str) -> dict:
+        """
+        Returns number of selected rows of each selection of a finished session
+        """
+        return self._query('counts', session_id)
 
+    def run_session(self, session: ClientSession) -> ClientResult:
+        """
+        Uploads all files of the session's input folder, waits for and downloads its outputs.
+        Errors are returned in the result
+        """
+        started = time.perf_counter()
+        session_id = session.session_id or uuid.uuid4().hex
+        try:
+            file_names = get_file_names(session.client_input_folder)
+            try:
+                self.upload(session_id, file_names)
+            except requests.exceptions.ReadTimeout:
+                # the server keeps running the session, its outputs are polled for
+                pass
+            self.wait(session_id)
+            self.download(session_id, session.output_file)
+        except (ClientError, OSError, requests.exceptions.RequestException) as e:
+            return ClientResult(session.client_input_folder, session_id, time.perf_counter() - started,
+                                f"{type(e).__name__}: {e}")
+        return ClientResult(session.client_input_folder, session_id, time.perf_counter() - started, '')
 
-def download_result(session_id):
-    response = requests.get(url + 'download', params={'session_id': session_id})
-    if response.status_code == 200:
-        with open('result/r1.zip', 'wb') as file:
-            file.write(response.content)
+    def run_sessions(self, sessions: List[ClientSession]) -> List[ClientResult]:
+        """
+        Runs up to max_parallel sessions concurrently, returns their results in sessions order
+        """
+        with ThreadPoolExecutor(max_workers=self.max_parallel) as executor:
+            return list(executor.map(self.run_session, sessions))
 
 
-def post_input(session_id, input_data_file, selection_file, universe_file):
-    files = [('source', ('input_data.csv', open(input_data_file, 'rb'))),
-             ('source', ('selection.json', open(selection_file, 'rb'))),
-             ('source', ('universe.json', open(universe_file, 'rb')))]
-    r = requests.post(url, params={'session_id': session_id}, files=files)
+def main(args: List[str] = None):
+    parser = argparse.ArgumentParser(description='Runs selections of client folders on a server')
+    parser.add_argument('client_input_folders', nargs='+', help='folders of files to upload')
+    parser.add_argument('--url', default=url)
+    parser.add_argument('--output-root', default='result', help='folder of downloaded <input folder name>.zip')
+    parser.add_argument('--parallel', type=int, default=4, help='number of concurrently submitted sessions')
+    parser.add_argument('--no-compress', action='store_true', help='upload files uncompressed')
+    parser.add_argument('--preview', action='store_true',
+                        help='print numbers of selected rows estimated on a sample instead of running selections')
+    parser.add_argument('--summary', action='store_true',
+                        help='print numbers of rows passing filters and selections instead of running selections')
+    options = parser.parse_args(args)
+    if options.summary:
+        with SelectionClient(options.url, options.parallel, not options.no_compress) as client:
+            for folder in options.client_input_folders:
+                for count in client.summarize(get_file_names(folder))['summary']:
+                    print(f"{folder} selection {count['selection_id']} {count['column']}: {count['passed']:,} "
+                          f"of {count['reached']:,}")
+        return 0
+    if options.preview:
+        with SelectionClient(options.url, options.parallel, not options.no_compress) as client:
+            for folder in options.client_input_folders:
+                for p in client.preview(get_file_names(folder)):
+                    print(f"{folder} selection {p['selection_id']}: ~{p['selected']:,.0f} selected "
+                          f"({p['lower']:,.0f} - {p['upper']:,.0f}) of {p['rows']:,} rows"
+                          + ''.join(f"\n  unreliable: {warning}" for warning in p['warnings']))
+        return 0
+    sessions = [ClientSession(folder, os.path.join(options.output_root,
+                                                   f'{os.path.basename(os.path.normpath(folder))}.zip'))
+                for folder in options.client_input_folders]
+    started = time.perf_counter()
+    with SelectionClient(options.url, options.parallel, not options.no_compress) as client:
+        results = client.run_sessions(sessions)
+    elapsed = time.perf_counter() - started
+    for result in results:
+        if result.error:
+            print(f"{result.client_input_folder}: {result.error}")
+    failed = sum(1 for result in results if result.error)
+    print(f"{len(results)} sessions ({failed} failed) in {elapsed:.2f}s: {len(results) / elapsed:.1f} sessions/s")
+    return 1 if failed else 0
 
 
 if __name__ == '__main__':
-    session_id = str(uuid.uuid4())  # 'tteesstt'
-    post_input(session_id,
-               input_data_file='source_data/input_data_dax.csv',
-               selection_file='source_data/selection.json',
-               universe_file='source_data/universe.json')
-    download_result(session_id)
+    sys.exit(main())
@@ -0,0 +1,92 @@
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+
+import general
+
+# On-disk columnar copies of input data files keyed by content hash of the file. Numeric and boolean columns
+# are stored as .npy files and memory-mapped read-only, so repeated runs and processes over the same input
+# share one page cache resident copy instead of parsing the csv into heap copies of their own.
+# Text columns are stored as codes (.npy) and the list of their distinct values.
+
+META_FILE_NAME = 'columns.json'
+
+
+def _get_column_file(folder: str, position: int) -> str:
+    return os.path.join(folder, f'{position}.npy')
+
+
+def _is_mappable(values: pd.Series) -> bool:
+    return isinstance(values.dtype, np.dtype) and values.dtype.kind in 'biuf'
+
+
+def _write(df: pd.DataFrame, folder: str) -> bool:
+    """
+    Writes df to folder, returns False if a column can't be cached
+    """
+    # written to a temporary folder which is renamed when complete, readers never see a partial cache
+    tmp_folder = f'{folder}.{uuid.uuid4().hex}.tmp'
+    os.makedirs(tmp_folder)
+    try:
+        columns = []
+        for position, (name, values) in enumerate(df.items()):
+            column = {'name': name, 'dtype': str(values.dtype)}
+            if _is_mappable(values):
+                array = values.to_numpy()
+            else:
+                codes, uniques = pd.factorize(values)
+                if not all(isinstance(u, str) for u in uniques):
+                    return False
+                array = codes.astype(np.int32)
+                column['values'] = list(uniques)
+            np.save(_get_column_file(tmp_folder, position), array)
+            columns.append(column)
+        with open(os.path.join(tmp_folder, META_FILE_NAME), 'w') as file:
+            json.dump({'rows': len(df), 'columns': columns}, file)
+        try:
+            os.rename(tmp_folder, folder)
+        except OSError:
+            # cached by a concurrent run in the meantime
+            pass
+        return True
+    finally:
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+
+
+def _read(folder: str) -> pd.DataFrame:
+    with open(os.path.join(folder, META_FILE_NAME), 'r') as file:
+        meta = json.load(file)
+    columns = {}
+    for position, column in enumerate(meta['columns']):
+        array = np.load(_get_column_file(folder, position), mmap_mode='r')
+        if 'values' in column:
+            # code -1 (NULL) takes the last value
+            values = np.array(column['values'] + [None], dtype=object)
+            columns[column['name']] = pd.Series(values[array], dtype=column['dtype'])
+        else:
+            # plain ndarray view of the mapped memory, pandas treats np.memmap as a different array class
+            columns[column['name']] = array.view(np.ndarray)
+    return pd.DataFrame(columns, index=pd.RangeIndex(meta['rows']), copy=False)
+
+
+def read_csv(input_data_file: str, cache_folder: str) -> pd.DataFrame:
+    """
+    Returns input data file as a data frame memory-mapped from cache_folder. The file is parsed and cached
+    by the first run reading it
+    """
+    folder = os.path.join(cache_folder, general.get_file_hash(input_data_file))
+    if not os.path.exists(os.path.join(folder, META_FILE_NAME)):
+        df = pd.read_csv(input_data_file)
+        os.makedirs(cache_folder, exist_ok=True)
+        if not _write(df, folder):
+            return df
+    general.touch(folder)
+    try:
+        return _read(folder)
+    except FileNotFoundError:
+        # evicted while being read
+        return pd.read_csv(input_data_file)
@@ -0,0 +1,129 @@
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import sql_expr_parser
+
+# Compiles numeric sub-expressions of sql_expr_parser AST (arithmetic, comparisons, and/or/not, between, in)
+# to a single numexpr program evaluated in one multi-threaded pass. Without numexpr the same source is
+# evaluated with numpy. Programs only run on numeric columns without NULLs, where two-valued logic gives
+# the SQL result, otherwise sql_expr_evaluator falls back to its pandas implementation. Predicates reading no
+# column (2 > 3, or 2 between 3 and x comparing 2 with 3) aren't compiled: they would be python bools, which
+# numexpr can't combine with its expressions and ~ turns into integers, the evaluator computes them instead.
+
+_ARITHMETIC = ('+', '-', '*')
+_COMPARISONS = {'=': '==', '!=': '!=', '<': '<', '<=': '<=', '>': '>', '>=': '>='}
+_NUMPY_NAMESPACE = {'__builtins__': {}}
+
+
+@lru_cache(maxsize=None)
+def get_numexpr():
+    """
+    Returns numexpr module or None if it is not installed. Imported on first use as it takes about
+    as long as importing numpy
+    """
+    try:
+        import numexpr
+    except ImportError:
+        return None
+    return numexpr
+
+
+class Program:
+    """
+    Compiled sub-expression over variables c0..cn bound to columns
+    """
+
+    def __init__(self, source: str, columns: Dict[str, str]):
+        self.source = source
+        self.columns = columns
+        self.code = compile(source, '<expression>', 'eval')
+
+    def _get_arrays(self, df: pd.DataFrame) -> Optional[Dict[str, np.ndarray]]:
+        arrays = {}
+        for column, variable in self.columns.items():
+            values = df[column]
+            if not isinstance(values.dtype, np.dtype) or values.dtype.kind not in 'if':
+                return None
+            array = values.to_numpy()
+            if values.dtype.kind == 'f' and np.isnan(array).any():
+                return None
+            arrays[variable] = array
+        return arrays
+
+    def run(self, df: pd.DataFrame) -> Optional[pd.Series]:
+        """
+        Returns result over df or None if columns of df are not numeric or have NULLs
+        """
+        arrays = self._get_arrays(df)
+        if arrays is None:
+            return None
+        numexpr = get_numexpr()
+        if numexpr is not None:
+            result = numexpr.evaluate(self.source, local_dict=arrays)
+        else:
+            result = eval(self.code, _NUMPY_NAMESPACE, arrays)
+        return pd.Series(result, index=df.index)
+
+
+def _is_number(node) -> bool:
+    return node[0] == 'lit' and isinstance(node[1], (int, float)) and not isinstance(node[1], bool)
+
+
+def _compile(node, columns: Dict[str, str]) -> Optional[Tuple[str, str]]:
+    """
+    Returns source of node and its kind ('num' or 'bool'), None if node can't be compiled
+    """
+    node_type = node[0]
+    if node_type == 'col':
+        return columns.setdefault(node[1], f'c{len(columns)}'), 'num'
+    if _is_number(node):
+        return repr(node[1]), 'num'
+    operands = [_compile(child, columns) for child in sql_expr_parser.children(node)]
+    if not operands or None in operands:
+        return None
+    sources = [source for source, _ in operands]
+    numeric = all(kind == 'num' for _, kind in operands)
+    predicates = all(kind == 'bool' for _, kind in operands)
+    if node_type == 'neg' and numeric:
+        return f'(-{sources[0]})', 'num'
+    if node_type == 'binop' and numeric and node[1] in _ARITHMETIC:
+        return f'({sources[0]} {node[1]} {sources[1]})', 'num'
+    if not sql_expr_parser._extract_identifiers(node):
+        return None
+    if node_type == 'binop' and numeric and node[1] in _COMPARISONS:
+        return f'({sources[0]} {_COMPARISONS[node[1]]} {sources[1]})', 'bool'
+    if node_type in ('and', 'or') and predicates:
+        return '(' + (' & ' if node_type == 'and' else ' | ').join(sources) + ')', 'bool'
+    if node_type == 'not' and predicates:
+        return f'(~{sources[0]})', 'bool'
+    if node_type == 'between' and numeric and sql_expr_parser._extract_identifiers(node[1]):
+        source = f'(({sources[0]} >= {sources[1]}) & ({sources[0]} <= {sources[2]}))'
+        return (f'(~{source})' if node[4] else source), 'bool'
+    if node_type == 'in' and numeric and all(_is_number(v) for v in node[2]):
+        source = '(' + ' | '.join(f'({sources[0]} == {v})' for v in sources[1:]) + ')'
+        return (f'(~{source})' if node[3] else source), 'bool'
+    return None
+
+
+@lru_cache(maxsize=4096)
+def get_programs(node) -> Dict[tuple, Program]:
+    """
+    Returns programs of all compilable sub-expressions of node reading at least one column.
+    Cached by AST, so equal expression texts share their programs. The cache is bounded, as long-running
+    server workers see new expressions with every upload
+    """
+    programs = {}
+    nodes = [node]
+    while nodes:
+        current = nodes.pop()
+        nodes.extend(sql_expr_parser.children(current))
+        if current[0] in ('col', 'lit') or current in programs:
+            continue
+        columns = {}
+        compiled = _compile(current, columns)
+        if compiled is not None and columns:
+            programs[current] = Program(compiled[0], columns)
+    return programs
@@ -1,8 +1,30 @@
+import hashlib
 import os
 import shutil
+import time
+import uuid
 
-input_folder = 'input'
-output_folder = 'output'
+# Session folders live under sessions_root (e.g. a tmpfs mount such as /dev/shm/slct), set by the
+# SLCT_SESSIONS_ROOT environment variable or set_sessions_root. A session folder is a symlink to a uniquely
+# named version folder: runs write their own staging folder and publish it by atomically replacing the symlink,
+# so concurrent requests of a session never share or delete a folder in use. The column cache and compiled plans
+# of uploaded files are kept in cache_folder under sessions_root, entries not used for the session ttl are
+# evicted with the sessions.
+
+sessions_root = os.environ.get('SLCT_SESSIONS_ROOT', '.')
+input_folder = os.path.join(sessions_root, 'input')
+output_folder = os.path.join(sessions_root, 'output')
+cache_folder = os.path.join(sessions_root, 'cache')
+# seconds session inputs and outputs are kept after their last update
+session_ttl = float(os.environ.get('SLCT_SESSION_TTL', 24 * 3600))
+
+
+def set_sessions_root(root):
+    global sessions_root, input_folder, output_folder, cache_folder
+    sessions_root = root
+    input_folder = os.path.join(root, 'input')
+    output_folder = os.path.join(root, 'output')
+    cache_folder = os.path.join(root, 'cache')
 
 
 def get_session_input_folder(session_id):
@@ -14,6 +36,113 @@ def get_session_output_folder(session_id):
 
 
 def make_dir(directory):
+    # the old folder is moved out of the way first, so it is never removed while being recreated
     if os.path.exists(directory):
-        shutil.rmtree(directory)
-    os.mkdir(directory)
\ No newline at end of file
+        remove_dir(directory)
+    os.makedirs(directory, exist_ok=True)
+
+
+def remove_dir(directory):
+    trash = f'{directory}.{uuid.uuid4().hex}.removed'
+    try:
+        os.rename(directory, trash)
+    except FileNotFoundError:
+        return
+    shutil.rmtree(trash, ignore_errors=True)
+
+
+def make_staging_dir(directory):
+    """
+    Returns a new empty folder next to directory to be published as directory by publish_dir
+    """
+    staging_dir = f'{directory}.{uuid.uuid4().hex}'
+    os.makedirs(staging_dir)
+    return staging_dir
+
+
+def publish_dir(staging_dir, directory):
+    """
+    Atomically points directory to staging_dir, readers see either the previous or the new contents.
+    The previous contents are removed
+    """
+    link = f'{staging_dir}.link'
+    os.symlink(os.path.basename(staging_dir), link)
+    previous = None
+    if os.path.islink(directory):
+        previous = os.path.realpath(directory)
+    elif os.path.isdir(directory):
+        # a plain folder can't be replaced by a symlink
+        remove_dir(directory)
+    os.replace(link, directory)
+    if previous is not None and previous != os.path.realpath(staging_dir):
+        shutil.rmtree(previous, ignore_errors=True)
+
+
+def evict_sessions(ttl):
+    """
+    Removes session folders not updated for ttl seconds and staging folders left behind by failed runs
+    """
+    expired = time.time() - ttl
+    for folder in (input_folder, output_folder):
+        try:
+            entries = list(os.scandir(folder))
+        except FileNotFoundError:
+            continue
+        published = {os.path.realpath(entry.path) for entry in entries if entry.is_symlink()}
+        for entry in entries:
+            try:
+                if entry.stat(follow_symlinks=False).st_mtime >= expired:
+                    continue
+                if entry.is_symlink():
+                    target = os.path.realpath(entry.path)
+                    os.unlink(entry.path)
+                    shutil.rmtree(target, ignore_errors=True)
+                elif os.path.realpath(entry.path) not in published:
+                    if entry.is_dir(follow_symlinks=False):
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                    else:
+                        os.remove(entry.path)
+            except FileNotFoundError:
+                # removed by a concurrent eviction
+                pass
+    evict_cache(ttl)
+
+
+def evict_cache(ttl):
+    """
+    Removes entries of cache_folder not used for ttl seconds, runs reading an evicted entry fall back to the
+    input files
+    """
+    expired = time.time() - ttl
+    try:
+        entries = list(os.scandir(cache_folder))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        try:
+            if entry.stat(follow_symlinks=False).st_mtime >= expired:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                remove_dir(entry.path)
+            else:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+def touch(path):
+    """
+    Marks a cache entry as used
+    """
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def get_file_hash(file_name):
+    digest = hashlib.sha1()
+    with open(file_name, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,418 @@
+import argparse
+import collections
+import gzip
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import requests
+
+import client
+
+# Load generator of server.py. Concurrent clients replay a weighted mix of operations on client input folders,
+# back to back (closed loop) or at a target rate of requests (open loop, Poisson arrivals), against a server
+# started locally or a running one (--url). Reports throughput, latency percentiles and errors per operation
+# and, over time, throughput, errors and resident memory of the server processes.
+#   upload    POST / of all files of a folder as a new session, the server runs its selections before responding
+#   download  GET /download of the outputs archive of a session of the folder
+#   counts    GET /counts of a session of the folder (point query of results_index)
+#   summary   POST /summary of all files of a folder
+# Files are gzip-compressed once, as client.py uploads them. Each folder is uploaded once before the run, the
+# sessions downloaded and queried. Open loop latencies count from the scheduled start of requests, so requests
+# waiting for a free client behind a slow server count the time they waited. The load generator shares the
+# cpus of the host with a local server, leave the server enough of them to measure it.
+
+OPERATIONS = ('upload', 'download', 'counts', 'summary')
+DEFAULT_MIX = 'upload=1,download=4'
+PERCENTILES = (50, 95, 99)
+
+
+class LoadTestError(Exception):
+    pass
+
+
+class RequestResult(NamedTuple):
+    operation: str
+    # seconds from start of the run
+    started: float
+    latency: float
+    # 0 if no response
+    status: int
+    error: str
+    received_bytes: int
+
+
+class OperationStats(NamedTuple):
+    operation: str
+    requests: int
+    errors: int
+    # completed requests per second
+    throughput: float
+    # latency percentiles (PERCENTILES) and maximum of successful requests in seconds
+    percentiles: Tuple[float, ...]
+    max_latency: float
+
+    def to_dict(self) -> dict:
+        return {'operation': self.operation, 'requests': self.requests, 'errors': self.errors,
+                'throughput': self.throughput, 'max_latency': self.max_latency,
+                **{f'p{p}': latency for p, latency in zip(PERCENTILES, self.percentiles)}}
+
+
+class Interval(NamedTuple):
+    # seconds from start of the run to the end of interval
+    end: float
+    completed: int
+    errors: int
+    # resident memory of server processes at the end of interval, None if unknown
+    rss: Optional[int]
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """
+    Returns weights of operations of a mix like upload=1,download=4
+    """
+    weights = {}
+    for item in mix.split(','):
+        operation, _, weight = item.partition('=')
+        operation = operation.strip()
+        if operation not in OPERATIONS:
+            raise ValueError(f"Unknown operation {operation!r}, expected one of {OPERATIONS}")
+        weights[operation] = float(weight) if weight else 1.0
+        if weights[operation] <= 0:
+            raise ValueError(f"Weight of {operation} must be positive")
+    return weights
+
+
+def get_payload(client_input_folder: str) -> List[Tuple[str, Tuple[str, bytes]]]:
+    """
+    Returns files of client_input_folder to post, gzip-compressed
+    """
+    payload = []
+    for file_name in client.get_file_names(client_input_folder):
+        with open(file_name, 'rb') as file:
+            payload.append(('source', (f'{os.path.basename(file_name)}.gz', gzip.compress(file.read(), 1))))
+    return payload
+
+
+def get_rss(pid: int) -> Optional[int]:
+    """
+    Returns resident memory of process pid and its descendants (forked server workers) in bytes, None if unknown.
+    Pages shared by forked workers are counted once per worker
+    """
+    children = collections.defaultdict(list)
+    try:
+        for entry in os.listdir('/proc'):
+            if entry.isdigit():
+                try:
+                    with open(f'/proc/{entry}/stat') as file:
+                        # the command may contain spaces and parentheses, ppid follows state after the last ')'
+                        children[int(file.read().rpartition(')')[2].split()[1])].append(int(entry))
+                except (OSError, IndexError, ValueError):
+                    pass
+    except OSError:
+        return None
+    rss, pids = 0, [pid]
+    while pids:
+        process = pids.pop()
+        pids.extend(children[process])
+        try:
+            with open(f'/proc/{process}/status') as file:
+                rss += next((int(line.split()[1]) * 1024 for line in file if line.startswith('VmRSS:')), 0)
+        except OSError:
+            if process == pid:
+                return None
+    return rss
+
+
+def get_free_port(host: str) -> int:
+    with socket.create_server((host, 0)) as listener:
+        return listener.getsockname()[1]
+
+
+def start_server(workers: int, sessions_root: str, log_file, host: str = '127.0.0.1',
+                 timeout: float = 60) -> Tuple[subprocess.Popen, str]:
+    """
+    Starts server.py in a process group of its own, returns its process and url once it accepts connections
+    """
+    port = get_free_port(host)
+    process = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py'),
+                                '--host', host, '--port', str(port), '--workers', str(workers),
+                                '--sessions-root', sessions_root],
+                               stdout=log_file, stderr=subprocess.STDOUT, start_new_session=True)
+    deadline = time.monotonic() + timeout
+    while True:
+        if process.poll() is not None:
+            raise LoadTestError(f"Server exited with code {process.returncode}, see {log_file.name}")
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return process, f'http://{host}:{port}/'
+        except OSError:
+            if time.monotonic() > deadline:
+                stop_server(process)
+                raise LoadTestError(f"Server not accepting connections in {timeout}s, see {log_file.name}")
+            time.sleep(0.1)
+
+
+def stop_server(process: subprocess.Popen):
+    """
+    Stops the server and its workers
+    """
+    for sig, timeout in [(signal.SIGTERM, 10), (signal.SIGKILL, None)]:
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            return
+        try:
+            process.wait(timeout)
+            return
+        except subprocess.TimeoutExpired:
+            pass
+
+
+class Schedule:
+    """
+    Hands out the operation, folder and scheduled start of each request to clients: at exponentially distributed
+    intervals of mean 1 / rate, or when asked if rate is None, until duration seconds or max_requests requests
+    """
+
+    def __init__(self, mix: Dict[str, float], folders: int, rate: float = None, duration: float = None,
+                 max_requests: int = None, seed: int = 0):
+        self.operations, self.weights = list(mix), list(mix.values())
+        self.folders = folders
+        self.rate = rate
+        self.duration = duration
+        self.max_requests = max_requests
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.count = 0
+        self.started = self.next_start = time.perf_counter()
+
+    def start(self):
+        self.started = self.next_start = time.perf_counter()
+
+    def next(self) -> Optional[Tuple[str, int, float]]:
+        with self.lock:
+            if self.max_requests is not None and self.count >= self.max_requests:
+                return None
+            if self.rate is None:
+                scheduled = time.perf_counter()
+            else:
+                scheduled = self.next_start
+                self.next_start += self.random.expovariate(self.rate)
+            if self.duration is not None and scheduled - self.started >= self.duration:
+                return None
+            self.count += 1
+            return (self.random.choices(self.operations, self.weights)[0], self.random.randrange(self.folders),
+                    scheduled)
+
+
+def send(http: requests.Session, server_url: str, operation: str, payload: list, session_id: str,
+         timeout: float) -> Tuple[int, int]:
+    """
+    Sends a request of operation, returns its status code and number of bytes received
+    """
+    if operation == 'upload':
+        response = http.post(server_url, params={'session_id': uuid.uuid4().hex}, files=payload, timeout=timeout)
+    elif operation == 'summary':
+        response = http.post(server_url + 'summary', files=payload, timeout=timeout)
+    elif operation == 'download':
+        # streamed and discarded, as client.py streams it to disk
+        with http.get(server_url + 'download', params={'session_id': session_id}, stream=True,
+                      timeout=timeout) as response:
+            return response.status_code, sum(len(chunk) for chunk in response.iter_content(client.CHUNK_SIZE))
+    else:
+        response = http.get(server_url + 'counts', params={'session_id': session_id}, timeout=timeout)
+    return response.status_code, len(response.content)
+
+
+def upload_sessions(server_url: str, payloads: List[list], timeout: float) -> List[str]:
+    """
+    Uploads each folder as a session to download and query, returns their session ids
+    """
+    session_ids = []
+    with requests.Session() as http:
+        for payload in payloads:
+            session_id = f'loadtest-{uuid.uuid4().hex}'
+            response = http.post(server_url, params={'session_id': session_id}, files=payload, timeout=timeout)
+            if response.status_code != 200:
+                raise LoadTestError(f"Upload before the run failed: {response.status_code} {response.text[:200]}")
+            session_ids.append(session_id)
+    return session_ids
+
+
+def run_load(server_url: str, payloads: List[list], session_ids: List[str], schedule: Schedule, concurrency: int,
+             timeout: float = 600, server_pid: int = None,
+             sample_interval: float = 1.0) -> Tuple[List[RequestResult], List[Tuple[float, Optional[int]]], float]:
+    """
+    Runs requests of schedule by concurrency clients, returns their results, (seconds, rss) samples of the
+    server every sample_interval seconds and the duration of the run
+    """
+    results = []
+    stopped = threading.Event()
+
+    def run_client():
+        with requests.Session() as http:
+            while True:
+                request = schedule.next()
+                if request is None:
+                    return
+                operation, folder, scheduled = request
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                status, received, error = 0, 0, ''
+                try:
+                    status, received = send(http, server_url, operation, payloads[folder], session_ids[folder],
+                                            timeout)
+                    if status != 200:
+                        error = f'HTTP {status}'
+                except requests.exceptions.RequestException as e:
+                    error = type(e).__name__
+                # list.append is atomic
+                results.append(RequestResult(operation, scheduled - schedule.started,
+                                             time.perf_counter() - scheduled, status, error, received))
+
+    samples = []
+
+    def sample():
+        while True:
+            samples.append((time.perf_counter() - schedule.started,
+                            get_rss(server_pid) if server_pid is not None else None))
+            if stopped.wait(sample_interval):
+                return
+
+    schedule.start()
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    clients = [threading.Thread(target=run_client, daemon=True) for _ in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.perf_counter() - schedule.started
+    stopped.set()
+    sampler.join()
+    samples.append((elapsed, get_rss(server_pid) if server_pid is not None else None))
+    return results, samples, elapsed
+
+
+def get_operation_stats(results: List[RequestResult], elapsed: float) -> List[OperationStats]:
+    """
+    Returns stats of each operation and of all requests (operation 'all')
+    """
+    stats = []
+    for operation in [o for o in OPERATIONS if any(r.operation == o for r in results)] + ['all']:
+        operation_results = [r for r in results if operation in ('all', r.operation)]
+        latencies = np.array([r.latency for r in operation_results if not r.error])
+        stats.append(OperationStats(
+            operation, len(operation_results), sum(1 for r in operation_results if r.error),
+            len(operation_results) / elapsed if elapsed else 0.0,
+            tuple(np.percentile(latencies, PERCENTILES).tolist()) if len(latencies) else (np.nan,) * len(PERCENTILES),
+            float(latencies.max()) if len(latencies) else np.nan))
+    return stats
+
+
+def get_intervals(results: List[RequestResult], samples: List[Tuple[float, Optional[int]]]) -> List[Interval]:
+    """
+    Returns requests completed and failed between consecutive memory samples, with the memory of the later
+    """
+    completed = np.sort([r.started + r.latency for r in results])
+    failed = np.sort([r.started + r.latency for r in results if r.error])
+    intervals, previous = [], 0.0
+    for end, rss in samples[1:]:
+        intervals.append(Interval(end, int(np.searchsorted(completed, end) - np.searchsorted(completed, previous)),
+                                  int(np.searchsorted(failed, end) - np.searchsorted(failed, previous)), rss))
+        previous = end
+    return intervals
+
+
+def format_report(stats: List[OperationStats], intervals: List[Interval], errors: collections.Counter) -> str:
+    lines = [f"{'operation':<10}{'requests':>10}{'errors':>8}{'req/s':>9}"
+             + ''.join(f"{f'p{p} ms':>10}" for p in PERCENTILES) + f"{'max ms':>10}"]
+    for s in stats:
+        lines.append(f"{s.operation:<10}{s.requests:>10}{s.errors:>8}{s.throughput:>9.2f}"
+                     + ''.join(f"{latency * 1000:>10.1f}" for latency in s.percentiles) + f"{s.max_latency * 1000:>10.1f}")
+    if errors:
+        lines.append('errors: ' + ', '.join(f'{error} x{count}' for error, count in errors.most_common()))
+    lines.append('')
+    lines.append(f"{'seconds':>8}{'req/s':>9}{'errors':>8}{'rss MB':>9}")
+    previous = 0.0
+    for interval in intervals:
+        duration = interval.end - previous
+        lines.append(f"{interval.end:>8.1f}{interval.completed / duration if duration else 0.0:>9.2f}"
+                     f"{interval.errors:>8}{interval.rss / (1 << 20) if interval.rss is not None else np.nan:>9.1f}")
+        previous = interval.end
+    return '\n'.join(lines)
+
+
+def main(args: List[str] = None):
+    parser = argparse.ArgumentParser(description='Load tests server.py with a mix of requests on client folders')
+    parser.add_argument('client_input_folders', nargs='*', default=['source_data'], help='folders of files to upload')
+    parser.add_argument('--url', help='url of a running server, a server is started locally by default')
+    parser.add_argument('--server-pid', type=int, help='process of the running server to sample memory of')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes of the local server')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'weights of operations {OPERATIONS}')
+    parser.add_argument('--concurrency', type=int, default=4, help='clients sending requests concurrently')
+    parser.add_argument('--rate', type=float, help='requests per second, clients send back to back by default')
+    parser.add_argument('--duration', type=float, default=30, help='seconds requests are started for')
+    parser.add_argument('--requests', type=int, help='number of requests, at most')
+    parser.add_argument('--timeout', type=float, default=600, help='seconds to wait for a response')
+    parser.add_argument('--sample-interval', type=float, default=1.0, help='seconds between memory samples')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='file to write the report to as json')
+    options = parser.parse_args(args)
+    try:
+        mix = parse_mix(options.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    if options.rate is not None and options.rate <= 0:
+        parser.error('--rate must be positive')
+
+    payloads = [get_payload(folder) for folder in options.client_input_folders]
+    with tempfile.TemporaryDirectory() as sessions_root:
+        process = None
+        server_url, server_pid = options.url, options.server_pid
+        if server_url is None:
+            log_file = open(os.path.join(sessions_root, 'server.log'), 'w')
+            process, server_url = start_server(options.workers, os.path.join(sessions_root, 'sessions'), log_file)
+            server_pid = process.pid
+        try:
+            server_url = server_url.rstrip('/') + '/'
+            started = time.perf_counter()
+            session_ids = upload_sessions(server_url, payloads, options.timeout)
+            print(f"{len(session_ids)} sessions uploaded in {time.perf_counter() - started:.2f}s")
+            schedule = Schedule(mix, len(payloads), options.rate, options.duration, options.requests, options.seed)
+            results, samples, elapsed = run_load(server_url, payloads, session_ids, schedule, options.concurrency,
+                                                 options.timeout, server_pid, options.sample_interval)
+        finally:
+            if process is not None:
+                stop_server(process)
+                log_file.close()
+
+    stats = get_operation_stats(results, elapsed)
+    intervals = get_intervals(results, samples)
+    errors = collections.Counter(r.error for r in results if r.error)
+    print(f"{len(results)} requests by {options.concurrency} clients in {elapsed:.2f}s"
+          + (f" at {options.rate} requests/s" if options.rate else ''))
+    print(format_report(stats, intervals, errors))
+    if options.json:
+        with open(options.json, 'w') as file:
+            json.dump({'options': vars(options), 'elapsed': elapsed,
+                       'operations': [s.to_dict() for s in stats],
+                       'intervals': [i._asdict() for i in intervals],
+                       'errors': dict(errors)}, file, indent=2, default=float)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+import io
+import os
+import re
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+# Differences of selection outputs from the outputs of a reference run (a previous output folder).
+# Outputs are compared as written, cell by cell as text, and keyed by the universe key: rows of keys only in
+# the new output are 'added', only in the reference output 'removed', and rows of keys in both with any
+# differing column (attribute, filter flag, is_selected) are 'changed'. Unchanged selections write no file.
+# A run writing differences has no outputs, so it can't be the reference of another run.
+
+CHANGE_COLUMN = 'change'
+CHANGED_COLUMNS_COLUMN = 'changed_columns'
+SUMMARY_FILE_NAME = 'diff_summary.csv'
+OUTPUT_FILE_PATTERN = re.compile(r'output_(.+)\.csv')
+
+
+class OutputDiffError(Exception):
+    pass
+
+
+def get_output_file_name(folder: str, selection_id) -> str:
+    return os.path.join(folder, f'output_{selection_id}.csv')
+
+
+def get_diff_file_name(folder: str, selection_id) -> str:
+    return os.path.join(folder, f'diff_{selection_id}.csv')
+
+
+def check_reference_folder(reference_folder: str):
+    """
+    Raises OutputDiffError unless reference_folder has outputs to compare with
+    """
+    if not any(OUTPUT_FILE_PATTERN.fullmatch(name) for name in os.listdir(reference_folder)):
+        raise OutputDiffError("Reference run has no outputs (it wrote differences from another run)")
+
+
+def _read(text: str, key_columns: List[str], name: str) -> pd.DataFrame:
+    df = pd.read_csv(io.StringIO(text), dtype=str, keep_default_na=False)
+    duplicated = df.duplicated(key_columns)
+    if duplicated.any():
+        keys = df.loc[duplicated, key_columns].head(3).to_dict('records')
+        raise OutputDiffError(f"Duplicate keys {key_columns} in {name}, e.g. {keys}")
+    return df.set_index(key_columns, drop=False)
+
+
+def get_diff(output: str, reference: str, key_columns: List[str]) -> Optional[pd.DataFrame]:
+    """
+    Returns added, removed and changed rows of output csv text compared to reference csv text
+    (None if they are the same), with change and changed_columns columns after the key columns.
+    Removed rows have their reference values. Raises OutputDiffError if keys of either aren't unique
+    """
+    if output == reference:
+        return None
+    current, previous = _read(output, key_columns, 'output'), _read(reference, key_columns, 'reference output')
+    columns = list(dict.fromkeys(current.columns.tolist() + previous.columns.tolist()))
+    current, previous = current.reindex(columns=columns, fill_value=''), previous.reindex(columns=columns,
+                                                                                         fill_value='')
+    added = current[~current.index.isin(previous.index)].assign(**{CHANGE_COLUMN: 'added',
+                                                                   CHANGED_COLUMNS_COLUMN: ''})
+    removed = previous[~previous.index.isin(current.index)].assign(**{CHANGE_COLUMN: 'removed',
+                                                                      CHANGED_COLUMNS_COLUMN: ''})
+    common = current.index[current.index.isin(previous.index)]
+    differs = current.loc[common] != previous.loc[common]
+    changed_rows = differs.any(axis=1)
+    differs = differs[changed_rows]
+    # names of differing columns joined column by column
+    changed_columns = pd.Series('', index=differs.index)
+    for column in columns:
+        changed_columns += np.where(differs[column], f'{column};', '')
+    changed = current.loc[differs.index].assign(**{CHANGE_COLUMN: 'changed',
+                                                   CHANGED_COLUMNS_COLUMN: changed_columns.str.rstrip(';')})
+    diff = pd.concat([added, removed, changed], ignore_index=True)
+    if diff.empty:
+        return None
+    return diff[key_columns + [CHANGE_COLUMN, CHANGED_COLUMNS_COLUMN] + [c for c in columns if c not in key_columns]]
+
+
+def write_output(df_out: pd.DataFrame, client_output_folder: str, selection_id, key_columns: List[str],
+                 reference_folder: str = None) -> Optional[pd.DataFrame]:
+    """
+    Writes output of a selection. With reference_folder only its differences from the reference output
+    are written (nothing if there are none) and returned, a missing reference output has no rows
+    """
+    output = df_out.to_csv(index=False, lineterminator='\n')
+    if reference_folder is None:
+        with open(get_output_file_name(client_output_folder, selection_id), 'w') as file:
+            file.write(output)
+        return None
+    try:
+        with open(get_output_file_name(reference_folder, selection_id), 'r', newline='') as file:
+            reference = file.read()
+    except FileNotFoundError:
+        reference = df_out.iloc[:0].to_csv(index=False, lineterminator='\n')
+    diff = get_diff(output, reference, key_columns)
+    if diff is not None:
+        with open(get_diff_file_name(client_output_folder, selection_id), 'w') as file:
+            diff.to_csv(file, index=False, lineterminator='\n')
+    return diff
+
+
+def write_summary(diffs: dict, client_output_folder: str):
+    """
+    Writes numbers of added, removed and changed rows of each selection by selection id
+    """
+    counts = {change: [0 if diff is None else int((diff[CHANGE_COLUMN] == change).sum()) for diff in diffs.values()]
+              for change in ('added', 'removed', 'changed')}
+    pd.DataFrame({'selection_id': list(diffs), **counts}).to_csv(
+        os.path.join(client_output_folder, SUMMARY_FILE_NAME), index=False)
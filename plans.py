@@ -0,0 +1,161 @@
+import hashlib
+import os
+import pickle
+import uuid
+from typing import Dict, List, NamedTuple, Tuple
+
+import attributes
+import general
+import selections
+import sql_expr_parser
+
+# Execution plans of selections compiled from a universe and a selections file: what each application level
+# computes and filters, the sql query of the selection and parsed expressions. Plans are compiled by
+# selection.compile_plans and cached by content hash of both files, so runs over unchanged files neither
+# rebuild them nor parse their expressions.
+
+# part of the cache key, change when plan classes or parsing of expressions change
+PLAN_VERSION = 10
+
+
+class PlanError(Exception):
+    pass
+
+
+class LevelPlan(NamedTuple):
+    application_level: int
+    preceding_filters: List[str]
+    # attributes of the level's filters grouped by nesting level of the sql query, dependencies first
+    attr_groups: List[List[str]]
+    output_attrs: List[str]
+    filters: List[Tuple[int, str]]
+
+    def get_attr_codes(self) -> List[str]:
+        return [attr_code for attr_codes in self.attr_groups for attr_code in attr_codes] + self.output_attrs
+
+
+class SelectionPlan(NamedTuple):
+    selection: selections.Selection
+    levels: List[LevelPlan]
+    # input attributes the selection reads
+    input_columns: List[str]
+    sql: str
+    # rank attributes only compared to a threshold, computed exactly up to their limit (see selection.get_rank_limits)
+    rank_limits: Dict[str, int]
+
+
+class Plans(NamedTuple):
+    universe_attributes: List[attributes.Attribute]
+    key_column: str
+    selections: List[SelectionPlan]
+    # parsed filter and attribute expressions by expression text
+    expressions: Dict[str, tuple]
+    # date column of stacked input data of several dates, see attributes.partition_by_as_of
+    as_of_column: str = None
+
+    def get_output_key(self) -> List[str]:
+        """
+        Columns identifying output rows
+        """
+        return [self.as_of_column, self.key_column] if self.as_of_column else [self.key_column]
+
+
+def _parse(expression: str, parsed: Dict[str, tuple], context: str) -> tuple:
+    if expression not in parsed:
+        try:
+            parsed[expression] = sql_expr_parser.parse(expression)
+        except Exception as e:
+            raise PlanError(f"{context}: invalid expression {expression!r}: {e}")
+    return parsed[expression]
+
+
+def validate(universe_attributes: List[attributes.Attribute], sels: List[selections.Selection]) -> Dict[str, tuple]:
+    """
+    Checks that expressions of sels and of attributes they use parse, refer to attributes of the universe
+    and that these attributes don't depend on each other cyclically. Returns parsed expressions
+    """
+    universe = {a.code: a for a in universe_attributes}
+    parsed = {}
+    used = []
+    for selection in sels:
+        for f in selection.filters:
+            context = f"Selection {selection.get_id()} filter {f['filter_id']}"
+            node = _parse(f['expression'], parsed, context)
+            for attr_code in sql_expr_parser._extract_identifiers(node):
+                if attr_code not in universe:
+                    raise PlanError(f"{context}: unknown attribute {attr_code}")
+                used.append(attr_code)
+        for attr_code in (a['attr_code'] for a in selection.output_attrs):
+            if attr_code not in universe:
+                raise PlanError(f"Selection {selection.get_id()}: unknown output attribute {attr_code}")
+            used.append(attr_code)
+    # depth first walk over dependencies of used attributes, an attribute met again on its own path is a cycle
+    finished, path = set(), []
+
+    def visit(attr_code: str):
+        if attr_code in finished:
+            return
+        if attr_code in path:
+            raise PlanError(f"Cyclic dependencies between attributes: {path[path.index(attr_code):] + [attr_code]}")
+        attr = universe[attr_code]
+        if isinstance(attr, attributes.AttributeExpression):
+            _parse(attr.expression, parsed, f"Attribute {attr_code}")
+        path.append(attr_code)
+        for dependency in attr.get_dependencies():
+            if dependency not in universe:
+                raise PlanError(f"Attribute {attr_code}: unknown attribute {dependency}")
+            visit(dependency)
+        path.pop()
+        finished.add(attr_code)
+
+    for attr_code in used:
+        visit(attr_code)
+    return parsed
+
+
+def get_key(universe_file: str, selections_file: str) -> str:
+    return hashlib.sha1(f"{PLAN_VERSION}:{general.get_file_hash(universe_file)}:"
+                        f"{general.get_file_hash(selections_file)}".encode()).hexdigest()
+
+
+def _get_plans_file(cache_folder: str, key: str) -> str:
+    return os.path.join(cache_folder, f'plans_{key}.pickle')
+
+
+def read_plans(cache_folder: str, key: str) -> Plans:
+    """
+    Returns cached plans or None. Their parsed expressions are added to the parser's cache.
+    Unreadable plans (e.g. of classes changed without a new PLAN_VERSION) are removed and recompiled
+    """
+    plans_file = _get_plans_file(cache_folder, key)
+    try:
+        with open(plans_file, 'rb') as file:
+            plans = pickle.load(file)
+    except FileNotFoundError:
+        return None
+    except (pickle.UnpicklingError, EOFError, AttributeError, ImportError, TypeError, ValueError):
+        try:
+            os.remove(plans_file)
+        except FileNotFoundError:
+            pass
+        return None
+    general.touch(plans_file)
+    sql_expr_parser.add_parsed(plans.expressions)
+    return plans
+
+
+def write_plans(plans: Plans, cache_folder: str, key: str):
+    os.makedirs(cache_folder, exist_ok=True)
+    plans_file = _get_plans_file(cache_folder, key)
+    # written to a temporary file which is renamed when complete, readers never see a partial file
+    tmp_file = f'{plans_file}.{uuid.uuid4().hex}.tmp'
+    try:
+        with open(tmp_file, 'wb') as file:
+            pickle.dump(plans, file)
+        os.replace(tmp_file, plans_file)
+    except BaseException:
+        try:
+            os.remove(tmp_file)
+        except FileNotFoundError:
+            pass
+        raise
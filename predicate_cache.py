@@ -0,0 +1,85 @@
+import threading
+from typing import Dict, List, Set
+
+import pandas as pd
+
+import expr_compiler
+import sql_expr_evaluator
+import sql_expr_parser
+
+# Filters of different selections often share atomic predicates (country_code IN ('US'),
+# region_name like '%##EUROPE-OLD##%' etc.). Filter expressions are split into normalized
+# atoms, and atoms over loaded columns are evaluated once per run and reused by every selection.
+
+CONNECTIVES = ('and', 'or', 'not')
+
+
+def normalize(node):
+    """
+    Returns canonical form of an expression: literals on the right side of comparisons, sorted and
+    deduplicated IN lists, so that equivalent atomic predicates are equal tuples. Filters of compiled plans
+    are simplified (sql_expr_parser.simplify_filter), which includes this canonical form
+    """
+    node_type = node[0]
+    if node_type in CONNECTIVES:
+        return (node_type, *map(normalize, node[1:]))
+    if node_type == 'binop' and node[1] in sql_expr_parser.FLIPPED_COMPARISONS and node[2][0] == 'lit' \
+            and node[3][0] != 'lit':
+        return ('binop', sql_expr_parser.FLIPPED_COMPARISONS[node[1]], normalize(node[3]), node[2])
+    if node_type == 'in' and all(v[0] == 'lit' for v in node[2]):
+        return ('in', normalize(node[1]), tuple(sorted(set(node[2]), key=sql_expr_parser.literal_sort_key)),
+                node[3])
+    return node
+
+
+def split_atoms(node) -> List:
+    """
+    Returns atomic predicates of an expression, i.e. its sub-expressions below and/or/not
+    """
+    if node[0] in CONNECTIVES:
+        return [atom for child in node[1:] for atom in split_atoms(child)]
+    return [node]
+
+
+class AtomCache:
+    """
+    Evaluates atomic predicates over columns of the loaded data once per run
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self.shared_columns: Set[str] = set(df.columns)
+        self._results: Dict[tuple, pd.Series] = {}
+        self._is_shared: Dict[tuple, bool] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(node):
+        return normalize(node)
+
+    def is_shared(self, node) -> bool:
+        """
+        Atoms reading only loaded columns give the same result for every selection
+        """
+        if node not in self._is_shared:
+            self._is_shared[node] = (node[0] not in CONNECTIVES + ('col', 'lit') and
+                                     all(c in self.shared_columns for c in sql_expr_parser._extract_identifiers(node)))
+        return self._is_shared[node]
+
+    def get(self, node, df: pd.DataFrame):
+        """
+        Returns result of a shared atom for rows of df (which are rows of the loaded data), None for other nodes
+        """
+        if not self.is_shared(node):
+            return None
+        result = self._results.get(node)
+        if result is None:
+            result = sql_expr_evaluator.evaluate(node, self.df, programs=expr_compiler.get_programs(node))
+            if not isinstance(result, pd.Series):
+                # constant atom, e.g. 1=1
+                return result
+            with self._lock:
+                self._results.setdefault(node, result)
+        if df.index is self.df.index or df.index.equals(self.df.index):
+            return result
+        return result.reindex(df.index)
@@ -0,0 +1,271 @@
+import argparse
+import json
+import math
+import sys
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+
+import attributes
+import plans
+import selection
+import sharding
+import sql_expr_parser
+import window_functions
+
+# Preview of selections on a sample of input data: estimated numbers of selected rows with 95% error bounds,
+# pass rates of each filter and a few example rows, in a fraction of the time of a full run.
+# Expressions and filters are row by row, but rank and aggregate attributes are computed over whole partitions,
+# so a selection is sampled by clusters: whole partitions of the columns every rank and aggregate attribute it
+# reads is partitioned by (see sharding), single rows if it reads none. Clusters are stratified by size, strata
+# of similar partitions are sampled at the same rate, and ranks and aggregates are exact on every sampled row.
+# A selection whose window attributes have no such column in common is sampled by rows: its ranks and
+# aggregates are computed over the sample only, filters reading them are reported as making the estimate
+# unreliable (the top n rows of a sample are as many as the top n rows of all rows). Only attributes read by
+# filters decide the sample, output ranks and aggregates of example rows may be computed within the sample.
+
+SAMPLE_ROWS = 10000
+EXAMPLE_ROWS = 5
+# normal quantile of two-sided 95% bounds
+Z_95 = 1.96
+# clusters sampled from a stratum below which its variance isn't estimated reliably
+MIN_STRATUM_CLUSTERS = 5
+
+
+class Sample(NamedTuple):
+    # partition columns whole partitions of which are sampled, none if rows are sampled
+    columns: List[str]
+    # positions of the sampled rows in df, in the order of df
+    rows: np.ndarray
+    # sampled cluster of each sampled row, numbered from 0
+    clusters: np.ndarray
+    # stratum of each sampled cluster
+    cluster_strata: np.ndarray
+    # numbers of clusters of each stratum and of those sampled
+    strata_clusters: np.ndarray
+    strata_sampled: np.ndarray
+
+    def get_weights(self) -> np.ndarray:
+        """
+        Returns rows each sampled row stands for
+        """
+        return (self.strata_clusters / self.strata_sampled)[self.cluster_strata[self.clusters]]
+
+    def estimate_total(self, values: np.ndarray) -> (float, float):
+        """
+        Returns estimated sum of values over all rows from values of the sampled rows and the half width
+        of its 95% bounds (stratified cluster sampling without replacement)
+        """
+        totals = np.bincount(self.clusters, weights=values, minlength=len(self.cluster_strata))
+        estimate, variance = 0.0, 0.0
+        for stratum, (n_clusters, n_sampled) in enumerate(zip(self.strata_clusters, self.strata_sampled)):
+            stratum_totals = totals[self.cluster_strata == stratum]
+            estimate += n_clusters * stratum_totals.mean()
+            if n_sampled > 1:
+                variance += n_clusters ** 2 * (1 - n_sampled / n_clusters) * stratum_totals.var(ddof=1) / n_sampled
+        return estimate, Z_95 * math.sqrt(variance)
+
+
+class SelectionPreview(NamedTuple):
+    selection_id: str
+    rows: int
+    sample_rows: int
+    sampled_by: List[str]
+    # estimated number of selected rows and its 95% bounds
+    selected: float
+    lower: float
+    upper: float
+    # estimated pass rate of each filter_<id> and filters_level_<n> among rows reaching its level
+    pass_rates: Dict[str, Optional[float]]
+    # why the estimate is unreliable, empty if it isn't
+    warnings: List[str]
+    # selected rows of the sample as output by the selection
+    examples: pd.DataFrame
+
+    def to_dict(self) -> dict:
+        return dict(self._asdict(), examples=json.loads(self.examples.to_json(orient='records')))
+
+
+def get_sample(df: pd.DataFrame, columns: List[str], sample_rows: int, seed: int = 0) -> Sample:
+    """
+    Returns a stratified sample of about sample_rows rows of df made of whole partitions of columns (of rows
+    without columns). Clusters are stratified by the power of 2 of their size, strata expected to have fewer
+    than MIN_STRATUM_CLUSTERS clusters sampled are merged with the next larger ones. At least 2 clusters of
+    each stratum are sampled
+    """
+    if columns:
+        codes, n_clusters = window_functions.Partitions().get_codes(df, columns)
+    else:
+        codes, n_clusters = np.arange(len(df)), len(df)
+    sizes = np.bincount(codes, minlength=n_clusters)
+    fraction = min(1.0, sample_rows / max(len(df), 1))
+    _, size_classes = np.unique(np.log2(np.maximum(sizes, 1)).astype(np.int64), return_inverse=True)
+    stratum_of_class = np.zeros(size_classes.max(initial=-1) + 1, dtype=np.int64)
+    stratum, expected = 0, 0.0
+    for size_class, n in enumerate(np.bincount(size_classes)):
+        stratum_of_class[size_class] = stratum
+        expected += n * fraction
+        if expected >= MIN_STRATUM_CLUSTERS:
+            stratum, expected = stratum + 1, 0.0
+    if expected and stratum:
+        # the last stratum is too small to stand on its own
+        stratum_of_class[stratum_of_class == stratum] = stratum - 1
+    strata = stratum_of_class[size_classes]
+    strata_clusters = np.bincount(strata)
+    rng = np.random.default_rng(seed)
+    chosen = [np.empty(0, dtype=np.int64)]
+    strata_sampled = np.zeros(len(strata_clusters), dtype=np.int64)
+    for stratum, n in enumerate(strata_clusters):
+        strata_sampled[stratum] = min(n, max(2, int(round(n * fraction))))
+        chosen.append(rng.choice(np.flatnonzero(strata == stratum), strata_sampled[stratum], replace=False))
+    chosen = np.sort(np.concatenate(chosen))
+    cluster_of_code = np.full(n_clusters, -1, dtype=np.int64)
+    cluster_of_code[chosen] = np.arange(len(chosen))
+    rows = np.flatnonzero(cluster_of_code[codes] >= 0)
+    return Sample(list(columns), rows, cluster_of_code[codes[rows]], strata[chosen], strata_clusters, strata_sampled)
+
+
+def get_sample_columns(plan: plans.SelectionPlan, universe_attributes: List[attributes.Attribute],
+                       df: pd.DataFrame) -> List[str]:
+    """
+    Returns loaded columns whose partitions selection is sampled by, none to sample rows.
+    Only attributes read by filters decide which rows are selected
+    """
+    _, columns = sharding.get_partition_columns([identifier for level in plan.levels for _, expression in level.filters
+                                                 for identifier in sql_expr_parser.extract_identifiers(expression)],
+                                                universe_attributes)
+    return [c for c in columns if c in df.columns]
+
+
+def get_warnings(plan: plans.SelectionPlan, universe_attributes: List[attributes.Attribute], columns: List[str],
+                 fraction: float) -> List[str]:
+    """
+    Returns filters of selection reading rank or aggregate attributes whose partitions a sample of whole
+    partitions of columns may split
+    """
+    warnings = []
+    for level in plan.levels:
+        for filter_id, expression in level.filters:
+            for attr_code in dict.fromkeys(dependency for identifier in
+                                           sql_expr_parser.extract_identifiers(expression) for dependency in
+                                           attributes.get_attribute_dependencies(identifier, universe_attributes)):
+                attr = attributes.get_attribute(attr_code, universe_attributes)
+                if not isinstance(attr, (attributes.AttributeRank, attributes.AttributeAggregate)) \
+                        or (columns and set(columns) <= set(attr.partition_by)):
+                    continue
+                over = f"partitions of {', '.join(attr.partition_by)}" if attr.partition_by else "all rows"
+                if isinstance(attr, attributes.AttributeRank):
+                    warnings.append(f"filter_{filter_id} reads rank {attr_code} over {over} ranked within the "
+                                    f"sample: a rank threshold keeps as many rows of the sample as of all rows, "
+                                    f"the estimate may be up to {1 / fraction:.0f}x too high")
+                else:
+                    warnings.append(f"filter_{filter_id} reads {attr.aggregate_function} {attr_code} over {over} "
+                                    f"aggregated within the sample")
+    return warnings
+
+
+def _get_rate(passed: np.ndarray, reached: np.ndarray, weights: np.ndarray) -> Optional[float]:
+    total = weights[reached].sum()
+    return float(weights[reached & passed].sum() / total) if total else None
+
+
+def preview_selection(plan: plans.SelectionPlan, compiled: plans.Plans, df: pd.DataFrame, sample: Sample,
+                      example_rows: int = EXAMPLE_ROWS) -> SelectionPreview:
+    """
+    Runs selection of plan over sample of df and estimates its results over all rows of df
+    """
+    universe_attributes = compiled.universe_attributes
+    # every row and filter is computed to estimate pass rates
+    sample_plan = selection.compile_selection(plan.selection.with_output_settings(show_all=True, add_filters=True),
+                                              universe_attributes)
+    df_sample = selection.build_selection_df(sample_plan, universe_attributes, df.iloc[sample.rows], workers=1)
+    weights = sample.get_weights()
+    reached = np.ones(len(df_sample), dtype=bool)
+    pass_rates = {}
+    for level in sample_plan.levels:
+        for filter_id, _ in level.filters:
+            pass_rates[f"filter_{filter_id}"] = _get_rate(df_sample[f"filter_{filter_id}"].to_numpy() == 1,
+                                                          reached, weights)
+        passed = df_sample[f"filters_level_{level.application_level}"].to_numpy() == 1
+        pass_rates[f"filters_level_{level.application_level}"] = _get_rate(passed, reached, weights)
+        reached &= passed
+    selected = df_sample['is_selected'].to_numpy() == 1
+    n_selected, n_rows, n_sample = int(selected.sum()), len(df), len(df_sample)
+    warnings = []
+    if n_sample == n_rows:
+        # a sample of all rows is exact
+        estimate = lower = upper = float(n_selected)
+    else:
+        estimate, bound = sample.estimate_total(selected.astype(np.float64))
+        # rows of the sample are known to be selected or not
+        lower = max(estimate - bound, n_selected)
+        upper = min(estimate + bound, n_rows - (n_sample - n_selected))
+        if not n_selected:
+            # no selected row sampled: rule of three
+            upper = min(n_rows - n_sample, 3 * n_rows / n_sample)
+        warnings = get_warnings(plan, universe_attributes, sample.columns, n_sample / n_rows)
+        if np.any(sample.strata_sampled < np.minimum(sample.strata_clusters, MIN_STRATUM_CLUSTERS)):
+            warnings.append(f"only {sample.strata_sampled.sum()} of {sample.strata_clusters.sum()} partitions of "
+                            f"{', '.join(sample.columns)} sampled, too few for reliable bounds")
+    df_out = selection.get_selection_results(plan.selection, compiled.key_column, df_sample, compiled.as_of_column)
+    if 'is_selected' in df_out:
+        df_out = df_out[df_out['is_selected'] == 1]
+    return SelectionPreview(plan.selection.get_output_id(), n_rows, n_sample, sample.columns, estimate, lower, upper,
+                            pass_rates, warnings, df_out.head(example_rows))
+
+
+def preview_selections(df: pd.DataFrame, compiled: plans.Plans, sample_rows: int = SAMPLE_ROWS,
+                       example_rows: int = EXAMPLE_ROWS, seed: int = 0) -> List[SelectionPreview]:
+    """
+    Previews compiled selection plans over loaded input data, see preview
+    """
+    selection.check_input_data(df, compiled)
+    samples = {}
+    previews = []
+    for plan in compiled.selections:
+        columns = tuple(get_sample_columns(plan, compiled.universe_attributes, df))
+        if columns not in samples:
+            samples[columns] = get_sample(df, list(columns), sample_rows, seed)
+        previews.append(preview_selection(plan, compiled, df, samples[columns], example_rows))
+    return previews
+
+
+def preview(client_input_folder: str, sample_rows: int = SAMPLE_ROWS, example_rows: int = EXAMPLE_ROWS,
+            seed: int = 0, cache_folder: str = None) -> List[SelectionPreview]:
+    """
+    Previews all selections of client_input_folder on samples of about sample_rows rows of its input data:
+    estimated numbers of selected rows with their bounds, pass rates of filters and example_rows selected rows.
+    Selections sharing the columns they are sampled by share their sample
+    """
+    df, compiled = selection.get_inputs(client_input_folder, cache_folder)
+    return preview_selections(df, compiled, sample_rows, example_rows, seed)
+
+
+def main(args: List[str] = None):
+    parser = argparse.ArgumentParser(description='Previews selections of a client folder on a sample')
+    parser.add_argument('client_input_folder')
+    parser.add_argument('--sample-rows', type=int, default=SAMPLE_ROWS, help='approximate number of sampled rows')
+    parser.add_argument('--examples', type=int, default=EXAMPLE_ROWS, help='number of example rows')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='print previews as json')
+    options = parser.parse_args(args)
+    previews = preview(options.client_input_folder, options.sample_rows, options.examples, options.seed)
+    if options.json:
+        print(json.dumps([p.to_dict() for p in previews], indent=2))
+        return 0
+    for p in previews:
+        sampled_by = f"partitions of {', '.join(p.sampled_by)}" if p.sampled_by else "rows"
+        print(f"selection {p.selection_id}: ~{p.selected:,.0f} selected ({p.lower:,.0f} - {p.upper:,.0f}) "
+              f"of {p.rows:,} rows, sample of {p.sample_rows:,} rows by {sampled_by}")
+        for column, rate in p.pass_rates.items():
+            print(f"  {column}: {'-' if rate is None else f'{rate:.1%}'}")
+        for warning in p.warnings:
+            print(f"  unreliable: {warning}")
+        if len(p.examples):
+            print('  ' + p.examples.to_string(index=False).replace('\n', '\n  '))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+import general
+import selection
+
+# Point queries over the published outputs of a session ("does selection Y select key X", "which selections
+# select X", numbers of selected rows) are answered from an in-memory index of its outputs. Each server worker
+# process builds the index of a session once from the published output folder and rebuilds it when the session
+# is published again, the least recently queried sessions are dropped above max_sessions.
+# Keys are compared as written to the outputs (csv text), keys of stacked input data are (as_of, key) pairs.
+
+max_sessions = int(os.environ.get('SLCT_INDEXED_SESSIONS', 64))
+OUTPUT_FILE_PATTERN = re.compile(r'output_(.+)\.csv')
+
+# session id -> (published output folder, its index)
+_indexes: 'OrderedDict[str, Tuple[str, SessionIndex]]' = OrderedDict()
+_lock = threading.Lock()
+
+
+class SessionIndex:
+    """
+    Keys of the rows each selection (by output id) of a session selected
+    """
+
+    def __init__(self, selected: Dict[str, frozenset], as_of_column: str = None):
+        self.selected = selected
+        self.as_of_column = as_of_column
+
+    def get_key(self, key: str, as_of: str = None):
+        return key if self.as_of_column is None else (as_of, key)
+
+    def is_selected(self, selection_id: str, key: str, as_of: str = None) -> bool:
+        return self.get_key(key, as_of) in self.selected[selection_id]
+
+    def get_selections(self, key: str, as_of: str = None) -> List[str]:
+        key = self.get_key(key, as_of)
+        return [selection_id for selection_id, keys in self.selected.items() if key in keys]
+
+    def get_counts(self) -> Dict[str, int]:
+        return {selection_id: len(keys) for selection_id, keys in self.selected.items()}
+
+
+def read_index(client_input_folder: str, client_output_folder: str) -> SessionIndex:
+    """
+    Builds the index of outputs of a run. Runs writing differences from a reference run have no outputs to index
+    """
+    _, key_column, as_of_column = selection.read_universe(os.path.join(client_input_folder,
+                                                                       selection.UNIVERSE_FILE_NAME))
+    columns = {key_column, as_of_column, 'is_selected'}
+    selected = {}
+    for entry in sorted(os.scandir(client_output_folder), key=lambda e: e.name):
+        match = OUTPUT_FILE_PATTERN.fullmatch(entry.name)
+        if match is None:
+            continue
+        df = pd.read_csv(entry.path, dtype=str, keep_default_na=False, usecols=lambda c: c in columns)
+        if 'is_selected' in df:
+            df = df[df['is_selected'] == '1']
+        keys = df[key_column] if as_of_column is None else zip(df[as_of_column], df[key_column])
+        selected[match.group(1)] = frozenset(keys)
+    return SessionIndex(selected, as_of_column)
+
+
+def get_index(session_id: str) -> Optional[SessionIndex]:
+    """
+    Returns index of the published outputs of session, None if it has none
+    """
+    # a publish points the session folder to a new folder, so its target identifies the indexed outputs
+    version = os.path.realpath(general.get_session_output_folder(session_id))
+    with _lock:
+        cached = _indexes.get(session_id)
+        if cached is not None and cached[0] == version:
+            _indexes.move_to_end(session_id)
+            return cached[1]
+    if not os.path.isdir(version):
+        return None
+    try:
+        index = read_index(os.path.realpath(general.get_session_input_folder(session_id)), version)
+    except FileNotFoundError:
+        # replaced by a concurrent publish while being read
+        return get_index(session_id) if os.path.realpath(general.get_session_output_folder(session_id)) != version \
+            else None
+    with _lock:
+        _indexes[session_id] = (version, index)
+        _indexes.move_to_end(session_id)
+        while len(_indexes) > max_sessions:
+            _indexes.popitem(last=False)
+    return index
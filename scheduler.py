@@ -0,0 +1,190 @@
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, List, NamedTuple, Set
+
+import numpy as np
+import pandas as pd
+
+
+class Task:
+    """
+    Computes column output from a frame holding its input columns
+    """
+
+    def __init__(self, output: str, inputs: List[str], compute: Callable[[pd.DataFrame], object],
+                 kind: str, level: int = None):
+        self.output = output
+        self.inputs = list(dict.fromkeys(inputs))
+        self.compute = compute
+        self.kind = kind
+        self.level = level
+
+
+class TraceRecord(NamedTuple):
+    output: str
+    kind: str
+    level: int
+    worker: str
+    ready: float
+    started: float
+    finished: float
+    dependencies: str
+
+
+class CyclicDependencyError(Exception):
+    pass
+
+
+def _get_nbytes(value) -> int:
+    if isinstance(value, (pd.Series, np.ndarray)):
+        return value.nbytes
+    return 0
+
+
+def _to_numpy(value):
+    return value.to_numpy() if isinstance(value, pd.Series) and isinstance(value.dtype, np.dtype) else value
+
+
+def _is_mapped(value) -> bool:
+    array = _to_numpy(value)
+    while isinstance(array, np.ndarray):
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base
+    return False
+
+
+def _get_array(value) -> np.ndarray:
+    """
+    Returns numpy array holding value if it can be spilled, None otherwise
+    """
+    array = _to_numpy(value)
+    if isinstance(array, np.ndarray) and array.dtype != object and not _is_mapped(array):
+        return array
+    return None
+
+
+class MemoryBudget:
+    """
+    Accounts memory of task results held by run_tasks. When they exceed budget bytes, the largest ones are
+    spilled to .npy files in spill_folder and memory-mapped back, so the OS may page them out
+    """
+
+    def __init__(self, budget: int = None, spill_folder: str = None):
+        self.budget = budget
+        self.spill_folder = spill_folder
+        self.peak_bytes = 0
+        self.spilled_bytes = 0
+        self._spilled = 0
+
+    def _spill(self, results: Dict[str, object], output: str):
+        value = results[output]
+        file_name = os.path.join(self.spill_folder, f'{self._spilled}.npy')
+        self._spilled += 1
+        np.save(file_name, _get_array(value))
+        array = np.load(file_name, mmap_mode='r').view(np.ndarray)
+        results[output] = pd.Series(array, index=value.index, name=value.name) if isinstance(value, pd.Series) \
+            else array
+        self.spilled_bytes += array.nbytes
+
+    def update(self, results: Dict[str, object]):
+        """
+        Accounts results held after a task finished, spills results above budget
+        """
+        in_memory = {output: _get_nbytes(value) for output, value in results.items() if not _is_mapped(value)}
+        held = sum(in_memory.values())
+        self.peak_bytes = max(self.peak_bytes, held)
+        if self.budget is None or self.spill_folder is None:
+            return
+        for output in sorted(in_memory, key=in_memory.get, reverse=True):
+            if held <= self.budget:
+                break
+            if _get_array(results[output]) is not None:
+                self._spill(results, output)
+                held -= in_memory[output]
+
+
+def _get_frame(task: Task, df: pd.DataFrame, results: Dict[str, object]) -> pd.DataFrame:
+    # copy=False: tasks only read their inputs, so they share the memory of df and earlier results
+    return pd.DataFrame({c: results[c] if c in results else df[c] for c in task.inputs}, index=df.index, copy=False)
+
+
+def run_tasks(tasks: List[Task], df: pd.DataFrame, workers: int = None, keep: Set[str] = None,
+              memory: MemoryBudget = None) -> (Dict[str, object], List[TraceRecord]):
+    """
+    Runs tasks as soon as the tasks producing their inputs are finished, independent tasks run concurrently
+    on a thread pool (numpy sort and group kernels release the GIL). workers=1 runs tasks inline in list order.
+    With keep only these results are returned and the others are freed once the tasks reading them are finished,
+    memory accounts (and may spill) the results held meanwhile.
+    Returns task results by output column and the trace of the schedule
+    """
+    producers = {task.output: task for task in tasks}
+    waiting_for = {task.output: {c for c in task.inputs if c in producers and c != task.output} for task in tasks}
+    dependants = defaultdict(list)
+    for task in tasks:
+        for dependency in waiting_for[task.output]:
+            dependants[dependency].append(task)
+    readers_left = {output: len(dependants[output]) for output in producers}
+    results, trace, ready_at = {}, [], {}
+    start = time.perf_counter()
+
+    def execute(task: Task, frame: pd.DataFrame):
+        started = time.perf_counter() - start
+        result = task.compute(frame)
+        record = TraceRecord(task.output, task.kind, task.level, threading.current_thread().name,
+                             ready_at[task.output], started, time.perf_counter() - start,
+                             ';'.join(sorted(c for c in task.inputs if c in producers)))
+        return result, record
+
+    def finish(task: Task, result, record: TraceRecord) -> List[Task]:
+        results[task.output] = result
+        trace.append(record)
+        if keep is not None:
+            for dependency in {c for c in task.inputs if c in producers and c != task.output}:
+                readers_left[dependency] -= 1
+                if not readers_left[dependency] and dependency not in keep:
+                    del results[dependency]
+            if not readers_left[task.output] and task.output not in keep:
+                del results[task.output]
+        if memory is not None:
+            memory.update(results)
+        newly_ready = []
+        for dependant in dependants[task.output]:
+            waiting_for[dependant.output].discard(task.output)
+            if not waiting_for[dependant.output]:
+                newly_ready.append(dependant)
+                ready_at[dependant.output] = time.perf_counter() - start
+        return newly_ready
+
+    ready = [task for task in tasks if not waiting_for[task.output]]
+    for task in ready:
+        ready_at[task.output] = 0.0
+    if workers == 1:
+        while ready:
+            task = ready.pop(0)
+            ready.extend(finish(task, *execute(task, _get_frame(task, df, results))))
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='attr') as executor:
+            running = {}
+            while ready or running:
+                for task in ready:
+                    running[executor.submit(execute, task, _get_frame(task, df, results))] = task
+                ready = []
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    ready.extend(finish(task, *future.result()))
+    if len(trace) < len(tasks):
+        raise CyclicDependencyError(f"Cyclic dependencies between: {sorted(set(producers) - {r.output for r in trace})}")
+    return results, trace
+
+
+def get_trace_df(trace: List[TraceRecord]) -> pd.DataFrame:
+    """
+    Returns schedule trace as a data frame ordered by start time
+    """
+    trace_df = pd.DataFrame(trace, columns=TraceRecord._fields).astype({'level': 'Int64'})
+    return trace_df.sort_values('started', ignore_index=True)
@@ -1,18 +1,38 @@
 import json
+import math
 import os
-from typing import List, Set
+import re
+import tempfile
+from typing import Dict, List, Set
 from collections import defaultdict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import ExitStack
+from functools import partial
 
+import numpy as np
 import pandas as pd
-import pandasql
 
 import attributes
+import column_cache
+import output_diff
+import plans
+import predicate_cache
+import scheduler
 import selections
+import selectivity
+import sharding
+import sql_expr_evaluator
 import sql_expr_parser
+import window_functions
 
 UNIVERSE_FILE_NAME = 'universe_dax.json'
 SELECTIONS_FILE_NAME = 'selection_dax.json'
 INPUT_DATA_FILE_NAME = 'input_data_dax.csv'
+AS_OF_COUNTS_FILE_NAME = 'as_of_counts.csv'
+
+# 'sql' runs generated sql through pandasql (SQLite), 'duckdb' through DuckDB, 'native' computes the same columns
+# with pandas/numpy
+ENGINES = ('sql', 'native', 'duckdb')
 
 
 class InputDataFileNotFound(Exception):
@@ -27,28 +47,126 @@ class UniverseFileError(Exception):
     pass
 
 
-def get_inputs(client_input_folder: str) -> (pd.DataFrame, List[attributes.Attribute], List[selections.Selection]):
+class InputDataError(Exception):
+    pass
+
+
+class SqlBackend:
     """
-    Extracts inputs from client_input_folder
+    Runs generated selection sql over input data queried as table df
+    """
+
+    def run(self, sql: str, df: pd.DataFrame) -> pd.DataFrame:
+        raise NotImplementedError("Subclasses should implement this method.")
+
+
+class SqliteBackend(SqlBackend):
+    def run(self, sql: str, df: pd.DataFrame) -> pd.DataFrame:
+        # pandasql imports sqlalchemy, which is as slow to import as pandas, only the sql engine pays for it
+        import pandasql
+        return pandasql.sqldf(sql, {'df': df})
+
+
+class DuckdbBackend(SqlBackend):
+    """
+    Scans df in place and computes window functions vectorized on all cores. Generated sql follows SQLite:
+    NULLs sort first ascending and last descending, integers divide to integers, LIKE ignores case and
+    IS (NOT) compares any values, which DuckDB spells IS (NOT) DISTINCT FROM
+    """
+    SETTINGS = ("SET default_null_order = 'nulls_first_on_asc_last_on_desc'",
+                "SET integer_division = true")
+    # string literals, LIKE and IS are replaced outside of them only
+    LITERAL = re.compile(r"('(?:[^']|'')*')")
+    LIKE = re.compile(r'\blike\b', re.IGNORECASE)
+    IS = re.compile(r'\bis\s+(not\s+)?(?!null\b|not\s+null\b|distinct\b)', re.IGNORECASE)
+
+    def _get_sql(self, part: str) -> str:
+        part = self.LIKE.sub('ilike', part)
+        return self.IS.sub(lambda match: 'is distinct from ' if match.group(1) else 'is not distinct from ', part)
+
+    def get_sql(self, sql: str) -> str:
+        return ''.join(part if i % 2 else self._get_sql(part) for i, part in enumerate(self.LITERAL.split(sql)))
+
+    def run(self, sql: str, df: pd.DataFrame) -> pd.DataFrame:
+        import duckdb
+        with duckdb.connect() as connection:
+            for setting in self.SETTINGS:
+                connection.execute(setting)
+            connection.register('df', df)
+            return connection.execute(self.get_sql(sql)).df()
+
+
+SQL_BACKENDS: Dict[str, SqlBackend] = {'sql': SqliteBackend(), 'duckdb': DuckdbBackend()}
+
+
+def read_input_data(input_data_file: str, cache_folder: str = None) -> pd.DataFrame:
+    """
+    Reads input data file, with cache_folder through the memory-mapped column_cache
     """
     try:
-        df = pd.read_csv(os.path.join(client_input_folder, INPUT_DATA_FILE_NAME))
+        if cache_folder:
+            return column_cache.read_csv(input_data_file, cache_folder)
+        return pd.read_csv(input_data_file)
     except FileNotFoundError as e:
         raise InputDataFileNotFound(f"Input data file not found: {e}")
+
+
+def read_universe(universe_file: str) -> (List[attributes.Attribute], str, str):
+    """
+    Returns universe attributes, key column and as-of date column (None unless input data stacks several dates)
+    """
     try:
-        with open(os.path.join(client_input_folder, UNIVERSE_FILE_NAME), 'r') as file:
+        with open(universe_file, 'r') as file:
             universe_src = json.load(file)
         universe_attributes = attributes.get_universe_attributes(universe_src['attributes'])
-        key_column = universe_src['key']
+        as_of_column = universe_src.get('as_of')
+        if as_of_column:
+            universe_attributes = attributes.partition_by_as_of(universe_attributes, as_of_column)
+        return universe_attributes, universe_src['key'], as_of_column
     except (FileNotFoundError, json.JSONDecodeError) as e:
         raise UniverseFileError(f"Error loading Universe file: {e}")
+
+
+def read_selections(selections_file: str) -> List[selections.Selection]:
     try:
-        with open(os.path.join(client_input_folder, SELECTIONS_FILE_NAME), 'r') as file:
+        with open(selections_file, 'r') as file:
             selections_src = json.load(file)
-        sels = selections.get_selections(selections_src['selections'])
+        return selections.get_selections(selections_src['selections'])
     except (FileNotFoundError, json.JSONDecodeError) as e:
         raise SelectionsFileError(f"Error loading Selections file: {e}")
-    return df, universe_attributes, sels, key_column
+
+
+def get_plans(client_input_folder: str, cache_folder: str = None) -> plans.Plans:
+    """
+    Returns plans compiled from universe and selections files of client_input_folder,
+    with cache_folder they are compiled once per content of these files
+    """
+    universe_file = os.path.join(client_input_folder, UNIVERSE_FILE_NAME)
+    selections_file = os.path.join(client_input_folder, SELECTIONS_FILE_NAME)
+    key = None
+    if cache_folder:
+        try:
+            key = plans.get_key(universe_file, selections_file)
+        except FileNotFoundError:
+            # reported by the readers below
+            pass
+        else:
+            compiled = plans.read_plans(cache_folder, key)
+            if compiled is not None:
+                return compiled
+    universe_attributes, key_column, as_of_column = read_universe(universe_file)
+    compiled = compile_plans(universe_attributes, key_column, read_selections(selections_file), as_of_column)
+    if key:
+        plans.write_plans(compiled, cache_folder, key)
+    return compiled
+
+
+def get_inputs(client_input_folder: str, cache_folder: str = None) -> (pd.DataFrame, plans.Plans):
+    """
+    Extracts inputs from client_input_folder
+    """
+    df = read_input_data(os.path.join(client_input_folder, INPUT_DATA_FILE_NAME), cache_folder)
+    return df, get_plans(client_input_folder, cache_folder)
 
 
 def get_ordered_attrs(selection: selections.Selection,
@@ -88,83 +206,598 @@ def add_attrs_to_sql_query(sql_query: str,
         return sql_query
 
 
-def add_attrs_to_selection_sql(sql_query: str, selection: selections.Selection, application_level: int,
-                               universe_attributes: List[attributes.Attribute], input_attrs: Set[str]) -> str:
-    preceding_filters = [f"filters_level_{level}" for level in selection.get_application_levels() if
-                         level < application_level]
+def add_attrs_to_selection_sql(sql_query: str, level: plans.LevelPlan,
+                               universe_attributes: List[attributes.Attribute]) -> str:
     # add filters relevant attributes
-    ordered_attrs = get_ordered_attrs(selection, universe_attributes, application_level, input_attrs)
-    for attr_codes in ordered_attrs.values():
-        sql_query = add_attrs_to_sql_query(sql_query, list(attr_codes), universe_attributes, preceding_filters)
+    for attr_codes in level.attr_groups:
+        sql_query = add_attrs_to_sql_query(sql_query, attr_codes, universe_attributes, level.preceding_filters)
     # add output attributes
-    sql_query = add_attrs_to_sql_query(sql_query, selection.get_output_attrs(application_level),
-                                       universe_attributes, preceding_filters)
+    sql_query = add_attrs_to_sql_query(sql_query, level.output_attrs, universe_attributes, level.preceding_filters)
     return sql_query
 
 
-def add_filters_to_selection_sql(sql_query: str, selection: selections.Selection, application_level: int):
-    filters = ','.join(f"case when {expression} then 1 else 0 end as filter_{filter_id}"
-                       for filter_id, expression in selection.get_filters(application_level))
-    sql_query = f"select d.*,{filters} from ({sql_query}) d"
-    # add combined filters column
-    aux_string = " and ".join(f"filter_{filter_id}=1" for filter_id, _ in selection.get_filters(application_level))
-    sql_query = f"select d.*,case when {aux_string} then 1 else 0 end as filters_level_{application_level} " \
+def add_filters_to_selection_sql(sql_query: str, level: plans.LevelPlan, filter_columns: bool = True,
+                                 drop_failed: bool = False):
+    """
+    Adds filter_<id> columns and their combined filters_level_<n> column. Without filter_columns only the
+    combined column is added, with drop_failed rows failing the level are dropped
+    """
+    if filter_columns:
+        filters = ','.join(f"case when {expression} then 1 else 0 end as filter_{filter_id}"
+                           for filter_id, expression in level.filters)
+        sql_query = f"select d.*,{filters} from ({sql_query}) d"
+        aux_string = " and ".join(f"filter_{filter_id}=1" for filter_id, _ in level.filters)
+    else:
+        aux_string = " and ".join(f"({expression})" for _, expression in level.filters)
+    # add combined filters column, failed rows are dropped by the same select so that levels nest no deeper
+    # (SQLite's parser stack overflows at about 15 nested subqueries)
+    sql_query = f"select d.*,case when {aux_string} then 1 else 0 end as filters_level_{level.application_level} " \
                 f"from ({sql_query}) d"
+    if drop_failed:
+        sql_query += f" where {aux_string}"
     return sql_query
 
 
-def add_is_selected_to_selection_sql(sql_query: str, selection: selections.Selection):
-    aux_string = " and ".join(f"filters_level_{lvl}=1" for lvl in selection.get_application_levels())
+def add_is_selected_to_selection_sql(sql_query: str, levels: List[plans.LevelPlan]):
+    aux_string = " and ".join(f"filters_level_{level.application_level}=1" for level in levels)
     sql_query = f"select d.*,case when {aux_string} then 1 else 0 end as is_selected from ({sql_query}) d"
     return sql_query
 
 
+def build_levels_sql(levels: List[plans.LevelPlan], universe_attributes: List[attributes.Attribute],
+                     filter_columns: bool = True, drop_failed: bool = False) -> str:
+    """
+    Builds the query of levels. Without filter_columns filter_<id> columns aren't computed, with drop_failed
+    rows failing a level are dropped before the next one (its attributes rank them last and mask them out of
+    aggregates, so they don't change values of the other rows)
+    """
+    sql_query = 'select * from df'
+    for level in levels:
+        sql_query = add_attrs_to_selection_sql(sql_query, level, universe_attributes)
+        sql_query = add_filters_to_selection_sql(sql_query, level, filter_columns, drop_failed)
+    sql_query = add_is_selected_to_selection_sql(sql_query, levels)
+    return sql_query
+
+
 def build_selection_sql(selection: selections.Selection, universe_attributes: List[attributes.Attribute]) -> str:
     """
     builds sql query to express selection process in sql
     """
+    show_all, _, add_filters, _ = selection.get_output_settings()
+    return build_levels_sql(get_level_plans(selection, universe_attributes), universe_attributes,
+                            filter_columns=bool(add_filters), drop_failed=not show_all)
+
+
+def get_level_plans(selection: selections.Selection,
+                    universe_attributes: List[attributes.Attribute]) -> List[plans.LevelPlan]:
+    """
+    Returns what each application level of selection computes and filters. Output attributes are
+    only computed if they are output (add_attributes)
+    """
+    _, add_attributes, _, _ = selection.get_output_settings()
     input_attrs = {a.code for a in universe_attributes if type(a) == attributes.AttributeInput}
-    sql_query = 'select * from df'
+    levels = []
     for lvl in selection.get_application_levels():
-        sql_query = add_attrs_to_selection_sql(sql_query, selection, lvl, universe_attributes, input_attrs)
-        sql_query = add_filters_to_selection_sql(sql_query, selection, lvl)
-    sql_query = add_is_selected_to_selection_sql(sql_query, selection)
-    return sql_query
+        preceding_filters = [f"filters_level_{level}" for level in selection.get_application_levels() if
+                             level < lvl]
+        attr_groups = [list(attr_codes)
+                       for attr_codes in get_ordered_attrs(selection, universe_attributes, lvl, input_attrs).values()]
+        levels.append(plans.LevelPlan(lvl, preceding_filters, attr_groups,
+                                      selection.get_output_attrs(lvl) if add_attributes else [],
+                                      selection.get_filters(lvl)))
+    return levels
 
 
-def get_selection_results(selection: selections.Selection, key_column: str, df: pd.DataFrame) -> pd.DataFrame:
+def _get_rank_threshold(node: tuple) -> (str, int):
     """
-    Returns df with attributes, filters relevant to selection
+    Returns attribute and limit of a 'attr < n', 'attr <= n' (or mirrored) filter: the greatest integer rank passing it
+    """
+    if node[0] != 'binop' or node[1] not in ('<', '<=', '>', '>='):
+        return None
+    op, left, right = node[1:]
+    if op in ('>', '>='):
+        op, left, right = op.replace('>', '<'), right, left
+    if left[0] != 'col' or right[0] != 'lit' or not isinstance(right[1], (int, float)) or isinstance(right[1], bool) \
+            or not math.isfinite(right[1]):
+        return None
+    return left[1], math.ceil(right[1]) - 1 if op == '<' else math.floor(right[1])
+
+
+def get_rank_limits(selection: selections.Selection, universe_attributes: List[attributes.Attribute]) -> Dict[str, int]:
+    """
+    Returns rank attributes of selection whose values matter only up to a limit: the only filter using them
+    compares them to a threshold, no other attribute depends on them and rows failing the filter aren't output
+    with attributes. Such attributes rank only the top rows of each partition, the others get limit + 1
+    """
+    show_all, add_attributes, _, _ = selection.get_output_settings()
+    if show_all and add_attributes:
+        return {}
+    thresholds, compared = defaultdict(list), set()
+    for f in selection.filters:
+        threshold = _get_rank_threshold(sql_expr_parser.parse(f['expression']))
+        if threshold is not None:
+            thresholds[threshold[0]].append(threshold[1])
+        else:
+            compared.update(sql_expr_parser.extract_identifiers(f['expression']))
+    used = list(thresholds) + list(compared) + ([a['attr_code'] for a in selection.output_attrs]
+                                                if add_attributes else [])
+    # attributes other attributes are computed from
+    read = {dependency for attr_code in used
+            for dependency in attributes.get_attribute_dependencies(attr_code, universe_attributes)[1:]}
+    return {attr_code: limits[0] for attr_code, limits in thresholds.items()
+            if len(limits) == 1 and attr_code not in compared and attr_code not in read
+            and type(attributes.get_attribute(attr_code, universe_attributes)) == attributes.AttributeRank}
+
+
+def compile_selection(selection: selections.Selection,
+                      universe_attributes: List[attributes.Attribute]) -> plans.SelectionPlan:
+    show_all, _, add_filters, _ = selection.get_output_settings()
+    levels = get_level_plans(selection, universe_attributes)
+    used = [attr_code for level in levels for attr_code in level.get_attr_codes()]
+    used.extend(identifier for level in levels for _, expression in level.filters
+                for identifier in sql_expr_parser.extract_identifiers(expression))
+    input_columns = [attr_code for attr_code in dict.fromkeys(
+        dependency for attr_code in used for dependency in attributes.get_attribute_dependencies(attr_code,
+                                                                                                universe_attributes))
+                     if type(attributes.get_attribute(attr_code, universe_attributes)) == attributes.AttributeInput]
+    sql = build_levels_sql(levels, universe_attributes, filter_columns=bool(add_filters), drop_failed=not show_all)
+    return plans.SelectionPlan(selection, levels, input_columns, sql, get_rank_limits(selection, universe_attributes))
+
+
+def compile_plans(universe_attributes: List[attributes.Attribute], key_column: str,
+                  sels: List[selections.Selection], as_of_column: str = None) -> plans.Plans:
+    """
+    Validates sels against the universe and compiles their plans, raises plans.PlanError.
+    Each variant of a parameter sweep gets a plan of its own, plans execute simplified filters
+    """
+    sels = [variant for s in sels for variant in s.get_variants()]
+    # errors refer to the filters as written, simplified filters may use fewer attributes
+    plans.validate(universe_attributes, sels)
+    numeric = attributes.get_numeric_attributes(universe_attributes)
+    sels = [s.with_expressions(lambda expression: sql_expr_parser.simplify_filter(expression, numeric)) for s in sels]
+    expressions = plans.validate(universe_attributes, sels)
+    return plans.Plans(universe_attributes, key_column, [compile_selection(s, universe_attributes) for s in sels],
+                       expressions, as_of_column)
+
+
+def get_filters_level_values(df: pd.DataFrame, filter_columns: List[str]) -> np.ndarray:
+    return window_functions.get_mask(df, filter_columns).astype('int64')
+
+
+def get_conjunction_values(df: pd.DataFrame, expressions: List[str],
+                           atoms: predicate_cache.AtomCache = None) -> np.ndarray:
+    """
+    Returns 0/1 flags of rows passing all expressions, without a column of each of them
+    """
+    passed = np.ones(len(df), dtype=bool)
+    for expression in expressions:
+        passed &= sql_expr_evaluator.evaluate_filter(expression, df, atoms).to_numpy() == 1
+    return passed.astype('int64')
+
+
+def get_selection_tasks(plan: plans.SelectionPlan, universe_attributes: List[attributes.Attribute],
+                        df_columns: List[str], partitions: window_functions.Partitions,
+                        atoms: predicate_cache.AtomCache = None) -> List[scheduler.Task]:
+    """
+    Returns the computation graph of a selection: the same attributes, filters, filters_level and is_selected
+    columns as its sql query, in the order the query adds them
+    """
+    _, _, add_filters, _ = plan.selection.get_output_settings()
+    available = set(df_columns)
+    tasks = []
+    for level in plan.levels:
+        lvl = level.application_level
+        # add filters relevant attributes, then output attributes
+        for attr_code in level.get_attr_codes():
+            # don't recompute attributes already added by a preceding level
+            if attr_code not in available:
+                attr = attributes.get_attribute(attr_code, universe_attributes)
+                if attr_code in plan.rank_limits:
+                    compute = partial(attr.get_top_values, limit=plan.rank_limits[attr_code],
+                                      preceding_filters=level.preceding_filters, partitions=partitions)
+                else:
+                    compute = partial(attr.get_values, preceding_filters=level.preceding_filters,
+                                      partitions=partitions)
+                tasks.append(scheduler.Task(attr_code, attr.get_input_columns(level.preceding_filters), compute,
+                                            'attribute', lvl))
+                available.add(attr_code)
+        if not add_filters:
+            # filters that aren't output are only evaluated into the combined filters column
+            expressions = [expression for _, expression in level.filters]
+            tasks.append(scheduler.Task(f"filters_level_{lvl}",
+                                        list(dict.fromkeys(identifier for expression in expressions for identifier
+                                                           in sql_expr_parser.extract_identifiers(expression))),
+                                        partial(get_conjunction_values, expressions=expressions, atoms=atoms),
+                                        'filters_level', lvl))
+            continue
+        filter_columns = []
+        for filter_id, expression in level.filters:
+            tasks.append(scheduler.Task(f"filter_{filter_id}",
+                                        sql_expr_parser.extract_identifiers(expression),
+                                        partial(sql_expr_evaluator.evaluate_filter, expression, atoms=atoms),
+                                        'filter', lvl))
+            filter_columns.append(f"filter_{filter_id}")
+        # add combined filters column
+        tasks.append(scheduler.Task(f"filters_level_{lvl}", filter_columns,
+                                    partial(get_filters_level_values, filter_columns=filter_columns),
+                                    'filters_level', lvl))
+    levels_columns = [f"filters_level_{level.application_level}" for level in plan.levels]
+    tasks.append(scheduler.Task("is_selected", levels_columns,
+                                partial(get_filters_level_values, filter_columns=levels_columns),
+                                'is_selected'))
+    return tasks
+
+
+def get_output_columns(selection: selections.Selection, tasks: List[scheduler.Task]) -> Set[str]:
+    """
+    Returns computed columns get_selection_results outputs for selection
+    """
+    _, add_attributes, add_filters, _ = selection.get_output_settings()
+    return {task.output for task in tasks
+            if task.output == 'is_selected'
+            or (add_attributes and task.kind == 'attribute')
+            or (add_filters and task.kind == 'filter')}
+
+
+def build_selection_df(plan: plans.SelectionPlan, universe_attributes: List[attributes.Attribute],
+                       df: pd.DataFrame, workers: int = None,
+                       trace: List[scheduler.TraceRecord] = None,
+                       atoms: predicate_cache.AtomCache = None,
+                       memory: scheduler.MemoryBudget = None) -> pd.DataFrame:
+    """
+    computes selection natively, returns the same columns as its sql query over df.
+    Independent attributes and filters are computed concurrently by up to workers threads,
+    records of the schedule are appended to trace. Filters reuse predicates already evaluated by atoms.
+    With memory only the computed columns get_selection_results outputs are returned, the others are freed
+    as soon as no later task reads them
+    """
+    # shares partition group-bys between all window attributes of the selection
+    partitions = window_functions.Partitions()
+    tasks = get_selection_tasks(plan, universe_attributes, df.columns.tolist(), partitions, atoms)
+    keep = get_output_columns(plan.selection, tasks) if memory is not None else None
+    results, schedule = scheduler.run_tasks(tasks, df, workers, keep, memory)
+    if trace is not None:
+        trace.extend(schedule)
+    new_columns = pd.DataFrame({task.output: results[task.output] for task in tasks if task.output in results},
+                               index=df.index, copy=False)
+    return pd.concat([df, new_columns], axis=1)
+
+
+def _get_compute_key(compute: partial) -> tuple:
+    # partitions and atoms are caches shared by all tasks, not inputs
+    keywords = tuple((k, tuple(v) if isinstance(v, list) else v) for k, v in sorted(compute.keywords.items())
+                     if k not in ('partitions', 'atoms'))
+    return compute.func, compute.args, keywords
+
+
+def _compute_renamed(frame: pd.DataFrame, compute: partial, names: Dict[str, str]):
+    return compute(frame.rename(columns=names))
+
+
+def get_sweeps(selection_plans: List[plans.SelectionPlan]) -> List[List[plans.SelectionPlan]]:
+    """
+    Groups plans of variants of the same sweep, other plans are groups of their own
+    """
+    sweeps = []
+    for plan in selection_plans:
+        if sweeps and plan.selection.variant is not None and sweeps[-1][-1].selection.variant is not None \
+                and sweeps[-1][-1].selection.get_id() == plan.selection.get_id():
+            sweeps[-1].append(plan)
+        else:
+            sweeps.append([plan])
+    return sweeps
+
+
+def build_sweep_dfs(sweep: List[plans.SelectionPlan], universe_attributes: List[attributes.Attribute],
+                    df: pd.DataFrame, workers: int = None,
+                    atoms: predicate_cache.AtomCache = None,
+                    memory: scheduler.MemoryBudget = None) -> List[pd.DataFrame]:
+    """
+    computes variants of a parameter sweep natively in one schedule, returns the same data frames as
+    build_selection_df for each variant. Tasks computing the same column from the same inputs in several
+    variants (attributes and filters not depending on parameter values) run once.
+    With memory only the computed columns get_selection_results outputs for some variant are kept
+    """
+    # a rank attribute limited in every variant is computed up to the greatest limit, which serves all of them
+    limited = set.intersection(*(set(plan.rank_limits) for plan in sweep))
+    rank_limits = {attr_code: max(plan.rank_limits[attr_code] for plan in sweep) for attr_code in limited}
+    partitions = window_functions.Partitions()
+    combined = {}
+    variants_columns = []
+    keep = set() if memory is not None else None
+    for plan in sweep:
+        # output column of each task of the variant in the combined schedule
+        columns = {}
+        tasks = get_selection_tasks(plan._replace(rank_limits=rank_limits), universe_attributes,
+                                    df.columns.tolist(), partitions, atoms)
+        for task in tasks:
+            inputs = [columns.get(c, c) if c != task.output else c for c in task.inputs]
+            key = (task.output, task.kind, _get_compute_key(task.compute), tuple(inputs))
+            if key not in combined:
+                output = f'{task.output}#{len(combined)}'
+                names = {column: name for column, name in zip(inputs, task.inputs) if column != name}
+                combined[key] = scheduler.Task(output, inputs,
+                                               partial(_compute_renamed, compute=task.compute, names=names),
+                                               task.kind, task.level)
+            columns[task.output] = combined[key].output
+        variants_columns.append(columns)
+        if keep is not None:
+            keep.update(columns[output] for output in get_output_columns(plan.selection, tasks))
+    results, _ = scheduler.run_tasks(list(combined.values()), df, workers, keep, memory)
+    return [pd.concat([df, pd.DataFrame({name: results[column] for name, column in columns.items()
+                                         if column in results},
+                                        index=df.index, copy=False)], axis=1)
+            for columns in variants_columns]
+
+
+def write_sweep_counts(sweep: List[plans.SelectionPlan], df_outs: List[pd.DataFrame], client_output_folder: str):
+    """
+    Writes parameter values and number of selected rows of each variant of a sweep to sweep_<selection_id>.csv
+    """
+    counts = pd.DataFrame([{'variant': plan.selection.variant, **plan.selection.parameter_values,
+                            'selected': int((df_out['is_selected'] == 1).sum()) if 'is_selected' in df_out
+                            else len(df_out)}
+                           for plan, df_out in zip(sweep, df_outs)])
+    counts.to_csv(os.path.join(client_output_folder, f'sweep_{sweep[0].selection.get_id()}.csv'), index=False)
+
+
+def get_as_of_counts(output_id: str, df_out: pd.DataFrame, as_of_column: str) -> pd.DataFrame:
+    """
+    Returns number of selected rows of each date of stacked input data
+    """
+    selected = df_out if 'is_selected' not in df_out else df_out[df_out['is_selected'] == 1]
+    counts = selected.groupby(as_of_column, dropna=False).size()
+    # dates without selected rows are counted too
+    counts = counts.reindex(df_out[as_of_column].drop_duplicates().sort_values(), fill_value=0)
+    return pd.DataFrame({'selection_id': output_id, as_of_column: counts.index, 'selected': counts.to_numpy()})
+
+
+def can_short_circuit(selection: selections.Selection) -> bool:
+    """
+    Only selected rows are output (failed filters of which are empty), so filters may stop at the first failure
+    """
+    show_all, _, _, _ = selection.get_output_settings()
+    return not show_all
+
+
+def filter_rows(df: pd.DataFrame, level: plans.LevelPlan, stats: selectivity.SelectivityStats,
+                atoms: predicate_cache.AtomCache = None) -> pd.DataFrame:
+    """
+    Returns rows of df passing all filters of level. Filters are evaluated from the most to the
+    least selective, each one only on rows passed the previous ones
+    """
+    filters = sorted(level.filters,
+                     key=lambda f: stats.get_pass_rate(f[1], df))
+    rows = np.arange(len(df))
+    for _, expression in filters:
+        if not len(rows):
+            break
+        identifiers = list(dict.fromkeys(sql_expr_parser.extract_identifiers(expression)))
+        passed = sql_expr_evaluator.evaluate_filter(expression, df[identifiers].iloc[rows], atoms).to_numpy() == 1
+        rows = rows[passed]
+    return df.iloc[rows]
+
+
+def build_selected_df(plan: plans.SelectionPlan, universe_attributes: List[attributes.Attribute],
+                      df: pd.DataFrame, stats: selectivity.SelectivityStats,
+                      atoms: predicate_cache.AtomCache = None) -> pd.DataFrame:
+    """
+    Short-circuit version of build_selection_df returning only the selected rows (with the same columns).
+    Attributes of a level only depend on rows passed the preceding levels (failed rows are ranked after them
+    and masked out of aggregates), so they are computed on the surviving rows only. Level 1 attributes are
+    computed on all rows
+    """
+    _, _, add_filters, _ = plan.selection.get_output_settings()
+    for level in plan.levels:
+        # partition keys are cached per set of rows
+        partitions = window_functions.Partitions()
+        new_columns = {}
+        for attr_code in level.get_attr_codes():
+            if attr_code not in df.columns and attr_code not in new_columns:
+                attr = attributes.get_attribute(attr_code, universe_attributes)
+                frame = df if not new_columns else pd.concat([df, pd.DataFrame(new_columns, index=df.index)], axis=1)
+                if attr_code in plan.rank_limits:
+                    new_columns[attr_code] = attr.get_top_values(frame, plan.rank_limits[attr_code],
+                                                                 level.preceding_filters, partitions)
+                else:
+                    new_columns[attr_code] = attr.get_values(frame, level.preceding_filters, partitions)
+        if new_columns:
+            df = pd.concat([df, pd.DataFrame(new_columns, index=df.index)], axis=1)
+        df = filter_rows(df, level, stats, atoms)
+        # surviving rows passed every filter of the level, filters that aren't output get no columns
+        flags = {f"filter_{filter_id}": 1 for filter_id, _ in level.filters} if add_filters else {}
+        flags[f"filters_level_{level.application_level}"] = 1
+        df = df.assign(**flags)
+    return df.assign(is_selected=1)
+
+
+def _build_shard(plan: plans.SelectionPlan, universe_attributes: List[attributes.Attribute], shard: pd.DataFrame,
+                 short_circuit: bool) -> pd.DataFrame:
+    if short_circuit and can_short_circuit(plan.selection):
+        return build_selected_df(plan, universe_attributes, shard, selectivity.SelectivityStats(shard))
+    # shards run in processes of their own, threads would oversubscribe the cores
+    return build_selection_df(plan, universe_attributes, shard, workers=1)
+
+
+def build_sharded_df(plan: plans.SelectionPlan, universe_attributes: List[attributes.Attribute], df: pd.DataFrame,
+                     executor: Executor, n_shards: int, short_circuit: bool = True) -> pd.DataFrame:
+    """
+    computes selection by shards of df (see sharding) on executor processes, returns the same rows and columns
+    as build_selection_df (build_selected_df with short_circuit) in the order of df.
+    None if selection can't be sharded
+    """
+    shardable, column = sharding.get_shard_column([attr_code for level in plan.levels
+                                                   for attr_code in level.get_attr_codes()], universe_attributes)
+    if not shardable:
+        return None
+    shards = sharding.get_shards(df, column, n_shards)
+    if len(shards) < 2:
+        return None
+    parts = executor.map(partial(_build_shard, plan, universe_attributes, short_circuit=short_circuit),
+                         [df.iloc[rows] for rows in shards])
+    df_selection = pd.concat(parts)
+    return df_selection.iloc[np.argsort(df.index.get_indexer(df_selection.index), kind='stable')]
+
+
+def get_selection_results(selection: selections.Selection, key_column: str, df: pd.DataFrame,
+                          as_of_column: str = None) -> pd.DataFrame:
+    """
+    Returns df with attributes, filters relevant to selection. Rows of stacked input data are identified
+    by as_of_column and key_column
     """
     show_all, add_attributes, add_filters, add_failed_filters = selection.get_output_settings()
-    relevant_columns = [key_column]
+    relevant_columns = [as_of_column, key_column] if as_of_column else [key_column]
     if add_attributes:
         relevant_columns.extend(c for c in df.columns.tolist()
-                                if c not in (key_column, "is_selected") and not c.startswith("filter"))
+                                if c not in (key_column, as_of_column, "is_selected") and not c.startswith("filter"))
     if add_filters:
         relevant_columns.extend(c for c in df.columns.tolist()
                                 if c.startswith("filter_"))
         if add_failed_filters:
-            # Vectorized operation
-            filter_cols = df.columns[df.columns.str.startswith('filter_')]
-            df["failed_filters"] = df[filter_cols].apply(lambda x: ';'.join(x.index[x == 0].tolist()), axis=1)
+            # names of failed filters joined column by column
+            failed_filters = pd.Series('', index=df.index, dtype=object)
+            for column in df.columns[df.columns.str.startswith('filter_')]:
+                failed_filters += np.where((df[column] == 0).fillna(False).to_numpy(dtype=bool), f'{column};', '')
+            df["failed_filters"] = failed_filters.str.slice(stop=-1)
             relevant_columns.append("failed_filters")
     if show_all:
         relevant_columns.append("is_selected")
         return df[relevant_columns]
     else:
-        return df[df['is_selected'] == 1][relevant_columns]
-
-
-# todo: make sure that all INPUT attributes are in input_data_file
-def run(client_input_folder: str, client_output_folder: str):
-    df, universe_attributes, sels, key_column = get_inputs(client_input_folder)
-    for selection in sels:
-        selection_sql = build_selection_sql(selection, universe_attributes)
-        df_out = get_selection_results(selection, key_column, pandasql.sqldf(selection_sql))
-        output_file_name = os.path.join(client_output_folder, f'output_{selection.get_id()}.csv')
-        with open(output_file_name, 'w') as file:
-            df_out.to_csv(file, index=False, lineterminator='\n')
+        # rows and columns are selected at once, only relevant columns of selected rows are copied
+        return df.loc[df['is_selected'] == 1, relevant_columns]
+
+
+def check_input_data(df: pd.DataFrame, compiled: plans.Plans):
+    """
+    Raises InputDataError if input attributes read by compiled plans are missing in df
+    """
+    missing = [c for c in dict.fromkeys(c for plan in compiled.selections for c in plan.input_columns)
+               if c not in df.columns]
+    if missing:
+        raise InputDataError(f"Input attributes missing in input data: {missing}")
+
+
+def run(client_input_folder: str, client_output_folder: str, engine: str = 'sql', workers: int = None,
+        trace: bool = False, short_circuit: bool = True, cache_folder: str = None, memory_budget: int = None,
+        reference_folder: str = None, shard_processes: int = None):
+    """
+    Runs all selections of client_input_folder and writes their outputs to client_output_folder, variants of
+    a parameter sweep to output_<selection_id>_<variant>.csv and their counts to sweep_<selection_id>.csv.
+    Native engine uses up to workers threads per selection, with trace it also writes the schedule
+    of each selection to trace_<selection_id>.csv. With short_circuit selections outputting only selected
+    rows are computed by build_selected_df. With cache_folder input data is memory-mapped from its column cache.
+    With memory_budget (bytes) native engine frees computed columns as soon as they are not needed, spills them
+    to disk above the budget and writes peak memory of computed columns of each selection (of each sweep
+    as a whole) to memory.csv.
+    With reference_folder (output folder of a previous run) only differences from its outputs are written,
+    see output_diff. With shard_processes native engine computes each selection by shards of input data
+    on as many processes when its attributes allow it, see sharding. memory_budget and shard_processes are only
+    supported by native engine and can't be combined, ValueError is raised otherwise
+    """
+    df, compiled = get_inputs(client_input_folder, cache_folder)
+    run_selections(df, compiled, client_output_folder, engine, workers, trace, short_circuit,
+                   memory_budget=memory_budget, reference_folder=reference_folder, shard_processes=shard_processes)
+
+
+def run_selections(df: pd.DataFrame, compiled: plans.Plans, client_output_folder: str,
+                   engine: str = 'sql', workers: int = None, trace: bool = False, short_circuit: bool = True,
+                   stats: selectivity.SelectivityStats = None, atoms: predicate_cache.AtomCache = None,
+                   memory_budget: int = None, reference_folder: str = None, shard_processes: int = None):
+    """
+    Runs compiled selection plans over loaded input data, see run.
+    stats and atoms of df may be shared by runs over the same df
+    """
+    sharded = shard_processes is not None and shard_processes > 1
+    if memory_budget is not None and engine != 'native':
+        raise ValueError(f"memory_budget is only supported by the native engine, not {engine}")
+    if sharded and engine != 'native':
+        raise ValueError(f"shard_processes is only supported by the native engine, not {engine}")
+    if memory_budget is not None and sharded:
+        raise ValueError("memory_budget and shard_processes can't be combined")
+    with ExitStack() as stack:
+        spill_folder, executor = None, None
+        if memory_budget is not None:
+            spill_folder = stack.enter_context(tempfile.TemporaryDirectory())
+        elif sharded:
+            executor = stack.enter_context(ProcessPoolExecutor(shard_processes))
+        _run_selections(df, compiled, client_output_folder, engine, workers, trace, short_circuit, stats, atoms,
+                        reference_folder, memory_budget, spill_folder, executor, shard_processes)
+
+
+def _run_selections(df: pd.DataFrame, compiled: plans.Plans, client_output_folder: str, engine: str, workers: int,
+                    trace: bool, short_circuit: bool, stats: selectivity.SelectivityStats,
+                    atoms: predicate_cache.AtomCache, reference_folder: str = None, memory_budget: int = None,
+                    spill_folder: str = None, executor: Executor = None, n_shards: int = None):
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine}, expected one of {ENGINES}")
+    check_input_data(df, compiled)
+    if reference_folder is not None:
+        output_diff.check_reference_folder(reference_folder)
+    if engine == 'native':
+        if stats is None and short_circuit:
+            stats = selectivity.SelectivityStats(df)
+        if atoms is None:
+            # predicates over input columns repeated across selections are evaluated once
+            atoms = predicate_cache.AtomCache(df)
+    universe_attributes = compiled.universe_attributes
+    memory_report = []
+    diffs = {}
+    as_of_counts = []
+    for sweep in get_sweeps(compiled.selections):
+        sweep_dfs = None
+        if engine == 'native' and len(sweep) > 1:
+            memory = None
+            if spill_folder:
+                sweep_id = str(sweep[0].selection.get_id())
+                memory = scheduler.MemoryBudget(memory_budget, os.path.join(spill_folder, sweep_id))
+                os.makedirs(memory.spill_folder)
+            sweep_dfs = build_sweep_dfs(sweep, universe_attributes, df, workers, atoms, memory)
+            if memory is not None:
+                memory_report.append((sweep_id, memory.peak_bytes, memory.spilled_bytes))
+        df_outs = []
+        for variant, plan in enumerate(sweep):
+            selection = plan.selection
+            output_id = selection.get_output_id()
+            sharded_df = None
+            if sweep_dfs is None and executor is not None:
+                sharded_df = build_sharded_df(plan, universe_attributes, df, executor, n_shards, short_circuit)
+            if sweep_dfs is not None:
+                df_selection = sweep_dfs[variant]
+            elif sharded_df is not None:
+                df_selection = sharded_df
+            elif spill_folder:
+                # memory-budgeted selections go through the schedule, which frees and spills columns
+                memory = scheduler.MemoryBudget(memory_budget, os.path.join(spill_folder, output_id))
+                os.makedirs(memory.spill_folder)
+                df_selection = build_selection_df(plan, universe_attributes, df, workers, atoms=atoms, memory=memory)
+                memory_report.append((output_id, memory.peak_bytes, memory.spilled_bytes))
+            elif engine == 'native' and short_circuit and can_short_circuit(selection):
+                df_selection = build_selected_df(plan, universe_attributes, df, stats, atoms)
+            elif engine == 'native':
+                schedule = []
+                df_selection = build_selection_df(plan, universe_attributes, df, workers, schedule, atoms)
+                if trace:
+                    scheduler.get_trace_df(schedule).to_csv(
+                        os.path.join(client_output_folder, f'trace_{output_id}.csv'), index=False)
+            else:
+                df_selection = SQL_BACKENDS[engine].run(plan.sql, df)
+            df_out = get_selection_results(selection, compiled.key_column, df_selection, compiled.as_of_column)
+            diffs[output_id] = output_diff.write_output(df_out, client_output_folder, output_id,
+                                                        compiled.get_output_key(), reference_folder)
+            df_outs.append(df_out)
+            if compiled.as_of_column:
+                as_of_counts.append(get_as_of_counts(output_id, df_out, compiled.as_of_column))
+        if selection.variant is not None:
+            write_sweep_counts(sweep, df_outs, client_output_folder)
+    if reference_folder is not None:
+        output_diff.write_summary(diffs, client_output_folder)
+    if as_of_counts:
+        pd.concat(as_of_counts, ignore_index=True).to_csv(os.path.join(client_output_folder, AS_OF_COUNTS_FILE_NAME),
+                                                          index=False)
+    if memory_report:
+        pd.DataFrame(memory_report, columns=['selection_id', 'peak_bytes', 'spilled_bytes']).to_csv(
+            os.path.join(client_output_folder, 'memory.csv'), index=False)
 
 
 if __name__ == '__main__':
@@ -1,12 +1,19 @@
+import itertools
 from typing import List, Dict, Tuple
 
 
 class Selection:
-    def __init__(self, id: int, filters: List[Dict], output_attrs: List[Dict], output_settings: Dict):
+    def __init__(self, id: int, filters: List[Dict], output_attrs: List[Dict], output_settings: Dict,
+                 parameters: Dict[str, List] = None, parameter_values: Dict = None, variant: int = None):
         self.id = id
         self.filters = filters
         self.output_attrs = output_attrs
         self.output_settings = output_settings
+        # parameter sweep: values of each parameter, filter expressions refer to parameter p as {p}
+        self.parameters = parameters or {}
+        # values of the parameters of one variant of a sweep and its number (from 1)
+        self.parameter_values = parameter_values or {}
+        self.variant = variant
 
     def get_application_levels(self) -> List[int]:
         return sorted(set(f['application_level'] for f in self.filters))
@@ -28,10 +35,62 @@ class Selection:
     def get_id(self) -> int:
         return self.id
 
+    def get_output_id(self) -> str:
+        """
+        Id of the outputs of selection, <id>_<variant> for a variant of a sweep
+        """
+        return str(self.id) if self.variant is None else f'{self.id}_{self.variant}'
+
+    def get_variants(self) -> List['Selection']:
+        """
+        Returns a selection for each combination of parameter values with the values substituted
+        in filter expressions, the selection itself if it has no parameters
+        """
+        if not self.parameters:
+            return [self]
+        names = list(self.parameters)
+        variants = []
+        for variant, values in enumerate(itertools.product(*(self.parameters[name] for name in names)), 1):
+            parameter_values = dict(zip(names, values))
+            filters = [dict(f, expression=substitute(f['expression'], parameter_values)) for f in self.filters]
+            variants.append(Selection(self.id, filters, self.output_attrs, self.output_settings,
+                                      parameter_values=parameter_values, variant=variant))
+        return variants
+
+    def with_expressions(self, get_expression) -> 'Selection':
+        """
+        Returns a copy of selection with each filter expression replaced by get_expression(expression)
+        """
+        filters = [dict(f, expression=get_expression(f['expression'])) for f in self.filters]
+        return Selection(self.id, filters, self.output_attrs, self.output_settings, self.parameters,
+                         self.parameter_values, self.variant)
+
+    def with_output_settings(self, **output_settings) -> 'Selection':
+        """
+        Returns a copy of selection with output_settings replacing its own
+        """
+        return Selection(self.id, self.filters, self.output_attrs, dict(self.output_settings, **output_settings),
+                         self.parameters, self.parameter_values, self.variant)
+
+
+def to_literal(value) -> str:
+    if value is None:
+        return 'null'
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return repr(value)
+
+
+def substitute(expression: str, parameter_values: Dict) -> str:
+    for name, value in parameter_values.items():
+        expression = expression.replace('{' + name + '}', to_literal(value))
+    return expression
+
 
 def get_selections(selections: List[Dict]) -> List[Selection]:
     return [Selection(selection['selection_id'],
                       selection['filters'],
                       selection['output_attrs'],
-                      selection['output_settings'])
+                      selection['output_settings'],
+                      selection.get('parameters'))
             for selection in selections]
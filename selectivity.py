@@ -0,0 +1,44 @@
+from typing import Dict
+
+import pandas as pd
+
+import sql_expr_evaluator
+import sql_expr_parser
+
+SAMPLE_SIZE = 1000
+
+
+class SelectivityStats:
+    """
+    Estimates pass rates of filter expressions on a fixed random sample of rows.
+    Predicates over loaded columns are estimated once per run on a sample of the loaded data,
+    predicates over computed attributes on a sample of the rows they are applied to
+    """
+
+    def __init__(self, df: pd.DataFrame, sample_size: int = SAMPLE_SIZE, seed: int = 0):
+        self.sample_size = sample_size
+        self.seed = seed
+        self.sample = self._get_sample(df)
+        self._pass_rates: Dict[str, float] = {}
+
+    def _get_sample(self, df: pd.DataFrame) -> pd.DataFrame:
+        if len(df) <= self.sample_size:
+            return df
+        return df.sample(n=self.sample_size, random_state=self.seed)
+
+    def get_pass_rate(self, expression: str, df: pd.DataFrame) -> float:
+        """
+        Returns estimated share of rows of df passing expression
+        """
+        identifiers = list(dict.fromkeys(sql_expr_parser.extract_identifiers(expression)))
+        if all(i in self.sample.columns for i in identifiers):
+            if expression not in self._pass_rates:
+                self._pass_rates[expression] = self._estimate(expression, self.sample[identifiers])
+            return self._pass_rates[expression]
+        return self._estimate(expression, self._get_sample(df[identifiers]))
+
+    @staticmethod
+    def _estimate(expression: str, sample: pd.DataFrame) -> float:
+        if not len(sample):
+            return 1.0
+        return float(sql_expr_evaluator.evaluate_filter(expression, sample).mean())
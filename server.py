@@ -1,36 +1,312 @@
+import argparse
+import gzip
 import os
 import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+import traceback
 from flask import Flask, request, send_file
+from werkzeug.utils import secure_filename
 import general
+import output_diff
+import preview
+import results_index
 import selection
+import summary
+
+# Production mode (python server.py --workers N) serves requests by N long-lived worker processes,
+# the same app can be served by any WSGI server, e.g. gunicorn -w N server:app with SLCT_SESSIONS_ROOT
+# and SLCT_SESSION_TTL set. Each upload runs in staging folders of its own published atomically when
+# complete (see general.publish_dir), expired sessions are evicted by uploads.
+# Membership of keys in selections and selection counts of finished sessions are served from an in-memory
+# index of their outputs (see results_index), without reading the outputs archive.
+# Uploads to /preview are previewed on a sample of their input data (see preview), uploads to /summary are
+# only counted (see summary), neither is stored.
+
+OUTPUTS_ARCHIVE_NAME = 'all_outputs.zip'
+# marker file whose modification time is the last eviction of any worker
+EVICTED_FILE_NAME = '.evicted'
 
 app = Flask(__name__)
 
 
+def is_valid_session_id(session_id) -> bool:
+    return bool(session_id) and len(session_id) <= 64 and all(c.isalnum() or c in '-_' for c in session_id)
+
+
+def evict_expired_sessions():
+    """
+    Evicts expired sessions at most once per tenth of the session ttl across all workers
+    """
+    marker = os.path.join(general.sessions_root, EVICTED_FILE_NAME)
+    try:
+        if time.time() - os.stat(marker).st_mtime < general.session_ttl / 10:
+            return
+    except FileNotFoundError:
+        os.makedirs(general.sessions_root, exist_ok=True)
+    with open(marker, 'a'):
+        os.utime(marker)
+    general.evict_sessions(general.session_ttl)
+
+
+def save_file(file, folder):
+    """
+    Saves an uploaded file to folder, files named *.gz are decompressed
+    """
+    filename = secure_filename(file.filename)
+    if filename.endswith('.gz'):
+        with gzip.GzipFile(fileobj=file.stream) as source, open(os.path.join(folder, filename[:-3]), 'wb') as target:
+            shutil.copyfileobj(source, target, 1 << 20)
+    else:
+        file.save(os.path.join(folder, filename))
+
+
 @app.route('/', methods=['POST'])
 def upload():
     files = request.files.getlist("source")
     session_id = request.args.get('session_id')
+    # outputs of a previous session to write differences from
+    reference_session_id = request.args.get('reference_session_id')
+    if not is_valid_session_id(session_id) or (reference_session_id is not None
+                                                and not is_valid_session_id(reference_session_id)):
+        return 'invalid session_id', 400
 
     if files:
-        client_input_folder = general.get_session_input_folder(session_id)
-        client_output_folder = general.get_session_output_folder(session_id)
-        general.make_dir(client_input_folder)
-        for file in files:
-            file.save(os.path.join(client_input_folder, file.filename))
-        selection.run(client_input_folder, client_output_folder)
+        evict_expired_sessions()
+        reference_folder = None
+        if reference_session_id is not None:
+            # resolved once, a concurrent upload of the reference session doesn't change it during the run
+            reference_folder = os.path.realpath(general.get_session_output_folder(reference_session_id))
+            if not os.path.isdir(reference_folder):
+                return 'unknown reference_session_id', 404
+            try:
+                output_diff.check_reference_folder(reference_folder)
+            except output_diff.OutputDiffError as e:
+                return str(e), 409
+        client_input_folder = general.make_staging_dir(general.get_session_input_folder(session_id))
+        client_output_folder = general.make_staging_dir(general.get_session_output_folder(session_id))
+        try:
+            for file in files:
+                save_file(file, client_input_folder)
+            selection.run(client_input_folder, client_output_folder, cache_folder=general.cache_folder,
+                          reference_folder=reference_folder)
+            # archived next to the outputs, so the archive doesn't include itself
+            archive = shutil.make_archive(f'{client_output_folder}_outputs', 'zip', client_output_folder)
+            os.replace(archive, os.path.join(client_output_folder, OUTPUTS_ARCHIVE_NAME))
+        except Exception as e:
+            shutil.rmtree(client_input_folder, ignore_errors=True)
+            shutil.rmtree(client_output_folder, ignore_errors=True)
+            if isinstance(e, output_diff.OutputDiffError):
+                return str(e), 400
+            raise
+        general.publish_dir(client_input_folder, general.get_session_input_folder(session_id))
+        general.publish_dir(client_output_folder, general.get_session_output_folder(session_id))
+        # indexed by the worker running the session, others index it on their first query
+        results_index.get_index(session_id)
         return '', 200
     else:
-        return None
+        return 'no source files', 400
+
+
+@app.route('/preview', methods=['POST'])
+def sample_preview():
+    """
+    Estimated numbers of selected rows, pass rates of filters and example rows of each selection of uploaded files
+    """
+    files = request.files.getlist("source")
+    if not files:
+        return 'no source files', 400
+    # input data is cached under sessions_root
+    evict_expired_sessions()
+    with tempfile.TemporaryDirectory() as client_input_folder:
+        for file in files:
+            save_file(file, client_input_folder)
+        previews = preview.preview(client_input_folder,
+                                   sample_rows=request.args.get('sample_rows', preview.SAMPLE_ROWS, type=int),
+                                   example_rows=request.args.get('examples', preview.EXAMPLE_ROWS, type=int),
+                                   seed=request.args.get('seed', 0, type=int), cache_folder=general.cache_folder)
+    return [p.to_dict() for p in previews]
+
+
+@app.route('/summary', methods=['POST'])
+def count_summary():
+    """
+    Rows passing each filter, level and selection of uploaded files and rows of each combination of failed filters
+    """
+    files = request.files.getlist("source")
+    if not files:
+        return 'no source files', 400
+    # input data is cached under sessions_root
+    evict_expired_sessions()
+    engine = request.args.get('engine', 'native')
+    if engine not in selection.ENGINES:
+        return f'unknown engine, expected one of {selection.ENGINES}', 400
+    with tempfile.TemporaryDirectory() as client_input_folder:
+        for file in files:
+            save_file(file, client_input_folder)
+        column_counts, failed_counts = summary.summarize(client_input_folder, engine,
+                                                         cache_folder=general.cache_folder)
+    # NaN (pass rates of levels no row reaches) isn't json
+    return {'summary': column_counts.astype(object).where(column_counts.notna(), None).to_dict('records'),
+            'failed_filters': failed_counts.to_dict('records')}
+
+
+@app.route('/status', methods=['GET'])
+def status():
+    session_id = request.args.get('session_id')
+    if not is_valid_session_id(session_id):
+        return 'invalid session_id', 400
+    if not os.path.exists(os.path.join(general.get_session_output_folder(session_id), OUTPUTS_ARCHIVE_NAME)):
+        return 'pending', 404
+    return 'done', 200
 
 
 @app.route('/download', methods=['GET'])
 def download():
     session_id = request.args.get('session_id')
-    client_output_folder = general.get_session_output_folder(session_id)
-    filename = f'{client_output_folder}/all_outputs'
-    shutil.make_archive(filename, 'zip', client_output_folder)
-    return send_file(filename + '.zip', as_attachment=True)
+    if not is_valid_session_id(session_id):
+        return 'invalid session_id', 400
+    filename = os.path.join(general.get_session_output_folder(session_id), OUTPUTS_ARCHIVE_NAME)
+    if not os.path.exists(filename):
+        return 'unknown session_id', 404
+    return send_file(os.path.abspath(filename), as_attachment=True)
+
+
+def get_query_index(keyed: bool = True):
+    """
+    Returns index of the session of a point query and the error response if there is none.
+    Queries of keyed sessions of stacked input data need the as_of date of the keys
+    """
+    session_id = request.args.get('session_id')
+    if not is_valid_session_id(session_id):
+        return None, ('invalid session_id', 400)
+    index = results_index.get_index(session_id)
+    if index is None:
+        return None, ('unknown session_id', 404)
+    if keyed and index.as_of_column is not None and request.args.get('as_of') is None:
+        return None, (f'as_of ({index.as_of_column}) required for stacked input data', 400)
+    return index, None
+
+
+def get_query_keys() -> list:
+    """
+    Keys of a point query: key parameters of the query string, or a json {"keys": [...]} body of a batch
+    """
+    keys = request.args.getlist('key')
+    body = request.get_json(silent=True)
+    if isinstance(body, dict):
+        keys.extend(str(key) for key in body.get('keys', []))
+    return keys
+
+
+@app.route('/selected', methods=['GET', 'POST'])
+def selected():
+    """
+    Whether selection_id selects each key, by key
+    """
+    index, error = get_query_index()
+    if error:
+        return error
+    selection_id = request.args.get('selection_id')
+    if selection_id not in index.selected:
+        return 'unknown selection_id', 404
+    keys = get_query_keys()
+    if not keys:
+        return 'no key', 400
+    as_of = request.args.get('as_of')
+    return {key: index.is_selected(selection_id, key, as_of) for key in keys}
+
+
+@app.route('/selections', methods=['GET', 'POST'])
+def selections():
+    """
+    Ids of the selections selecting each key, by key
+    """
+    index, error = get_query_index()
+    if error:
+        return error
+    keys = get_query_keys()
+    if not keys:
+        return 'no key', 400
+    as_of = request.args.get('as_of')
+    return {key: index.get_selections(key, as_of) for key in keys}
+
+
+@app.route('/counts', methods=['GET'])
+def counts():
+    """
+    Number of selected rows of each selection
+    """
+    index, error = get_query_index(keyed=False)
+    if error:
+        return error
+    return index.get_counts()
+
+
+def serve(host: str, port: int, workers: int):
+    """
+    Serves app by workers processes forked after binding the listening socket, each accepting connections
+    and serving requests on threads. Unlike processes forked per request, workers run selections in parallel
+    and keep their in-memory indexes (see results_index) between requests
+    """
+    from werkzeug.serving import make_server
+    listener = socket.create_server((host, port), backlog=128)
+    print(f" * Serving on http://{host}:{port} by {workers} workers")
+    if workers <= 1:
+        make_server(host, port, app, threaded=True, fd=listener.fileno()).serve_forever()
+        return
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                make_server(host, port, app, threaded=True, fd=listener.fileno()).serve_forever()
+            except KeyboardInterrupt:
+                pass
+            except BaseException:
+                traceback.print_exc()
+                os._exit(1)
+            os._exit(0)
+        children.append(pid)
+    # stopping the server (SIGTERM or Ctrl-C) stops its workers
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Runs selections of uploaded client files')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--sessions-root', default=general.sessions_root,
+                        help='folder of session inputs and outputs, e.g. on tmpfs')
+    parser.add_argument('--session-ttl', type=float, default=general.session_ttl,
+                        help='seconds sessions are kept after their last upload')
+    parser.add_argument('--indexed-sessions', type=int, default=results_index.max_sessions,
+                        help='sessions whose outputs each worker keeps indexed in memory for point queries')
+    parser.add_argument('--dev', action='store_true', help='single process development server')
+    options = parser.parse_args(args)
+    general.set_sessions_root(options.sessions_root)
+    general.session_ttl = options.session_ttl
+    results_index.max_sessions = options.indexed_sessions
+    if options.dev:
+        Flask.run(app, options.host, options.port)
+    else:
+        serve(options.host, options.port, options.workers)
 
 
-Flask.run(app)
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import attributes
+
+# Splits input data of a selection into shards computed independently by worker processes. Expressions and
+# filters are row by row, so a selection can be sharded by a column every rank and aggregate attribute it
+# reads is partitioned by (whole partitions go to one shard), or by rows if it reads no such attribute.
+
+
+def get_partition_columns(attr_codes: List[str],
+                          universe_attributes: List[attributes.Attribute]) -> Tuple[bool, List[str]]:
+    """
+    Returns whether attributes attr_codes (with their dependencies) can be computed by groups of rows and the
+    columns every rank and aggregate attribute among them is partitioned by: groups of rows with equal values
+    of any of them never split a partition. No columns if groups may split rows arbitrarily
+    """
+    common = None
+    for attr_code in dict.fromkeys(dependency for attr_code in attr_codes for dependency in
+                                   attributes.get_attribute_dependencies(attr_code, universe_attributes)):
+        attr = attributes.get_attribute(attr_code, universe_attributes)
+        if isinstance(attr, (attributes.AttributeRank, attributes.AttributeAggregate)):
+            common = list(attr.partition_by) if common is None else [c for c in common if c in attr.partition_by]
+            if not common:
+                return False, []
+    return True, common or []
+
+
+def get_shard_column(attr_codes: List[str],
+                     universe_attributes: List[attributes.Attribute]) -> Tuple[bool, Optional[str]]:
+    """
+    Returns whether attributes attr_codes (with their dependencies) can be computed by shards and the column
+    to shard by, None if shards may split rows arbitrarily
+    """
+    shardable, columns = get_partition_columns(attr_codes, universe_attributes)
+    return shardable, columns[0] if columns else None
+
+
+def get_shards(df: pd.DataFrame, column: Optional[str], n_shards: int) -> List[np.ndarray]:
+    """
+    Returns row positions of each shard in the order of df. Partitions of column are assigned, largest first,
+    to the shard with the fewest rows so far. Empty shards are dropped
+    """
+    if column is None:
+        return [rows for rows in np.array_split(np.arange(len(df)), n_shards) if len(rows)]
+    codes, uniques = pd.factorize(df[column], use_na_sentinel=False)
+    sizes = np.bincount(codes, minlength=len(uniques))
+    shard_of_code = np.empty(len(uniques), dtype=np.int64)
+    loads = np.zeros(n_shards, dtype=np.int64)
+    for code in np.argsort(-sizes, kind='stable'):
+        shard = int(np.argmin(loads))
+        shard_of_code[code] = shard
+        loads[shard] += sizes[code]
+    shard_of_row = shard_of_code[codes]
+    return [rows for rows in (np.flatnonzero(shard_of_row == shard) for shard in range(n_shards)) if len(rows)]
@@ -0,0 +1,481 @@
+import re
+import sys
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+
+import expr_compiler
+import sql_expr_parser
+
+# Vectorized evaluation of sql_expr_parser AST nodes over a pandas data frame.
+# Follows SQLite semantics used by the SQL engine: three-valued logic for predicates
+# (results are pandas nullable booleans), NULL on division by zero, integer division for
+# integer operands, % of operands converted to integers, case-insensitive LIKE and IS comparing NULL as a value.
+# Comparisons follow SQLite affinity: columns have the affinity of their type (numeric or text), other
+# expressions none. A text or no-affinity operand compared with a numeric column is converted to a number if
+# it looks like one, a no-affinity operand compared with a text column to text. Numbers sort before text.
+
+# text SQLite's numeric affinity converts to a number
+_NUMERIC_TEXT = re.compile(r'\s*[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?\s*')
+# number prefix of text, which is its truth value (false without one)
+_NUMBER_PREFIX = re.compile(r'\s*([+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)')
+
+
+def _is_scalar(value) -> bool:
+    return not isinstance(value, pd.Series)
+
+
+def _is_null(value):
+    if _is_scalar(value):
+        return value is None or value is pd.NA or (isinstance(value, float) and np.isnan(value))
+    return value.isna()
+
+
+def _is_numeric(value) -> bool:
+    if _is_scalar(value):
+        return isinstance(value, (int, float, np.number)) and not isinstance(value, bool)
+    return pd.api.types.is_numeric_dtype(value.dtype) and not pd.api.types.is_bool_dtype(value.dtype)
+
+
+def _is_integer(value) -> bool:
+    if _is_scalar(value):
+        return isinstance(value, (int, np.integer)) and not isinstance(value, bool)
+    return pd.api.types.is_integer_dtype(value.dtype)
+
+
+def _is_text(value) -> bool:
+    if _is_scalar(value):
+        return isinstance(value, str)
+    return isinstance(value.dtype, pd.StringDtype) or (value.dtype == object and
+                                                       pd.api.types.infer_dtype(value, skipna=True) == 'string')
+
+
+def get_affinity(node, value) -> str:
+    """
+    Returns SQLite affinity of an operand: 'numeric' or 'text' for columns, None for other expressions
+    """
+    if node[0] != 'col' or _is_scalar(value):
+        return None
+    return 'numeric' if _is_numeric(value) else 'text'
+
+
+def _to_number(text: str):
+    if not _NUMERIC_TEXT.fullmatch(text):
+        return text
+    return int(text) if text.strip().lstrip('+-').isdigit() else float(text)
+
+
+def _to_text(number) -> str:
+    """
+    Returns number as SQLite converts it to text: reals keep a fractional part, 1e20 is 1.0e+20
+    """
+    if _is_integer(number):
+        return str(int(number))
+    mantissa, e, exponent = f'{number:.15g}'.partition('e')
+    return (mantissa if '.' in mantissa else mantissa + '.0') + e + exponent
+
+
+def _apply_affinity(value, affinity: str, other_affinity: str):
+    """
+    Converts an operand compared with an operand of other_affinity as SQLite does
+    """
+    if other_affinity == 'numeric' and affinity != 'numeric' and not _is_numeric(value):
+        if _is_scalar(value):
+            return _to_number(value) if isinstance(value, str) else value
+        text = value.astype(object)
+        numeric = text.map(lambda v: isinstance(v, str) and _NUMERIC_TEXT.fullmatch(v) is not None)
+        if not numeric.any():
+            return value
+        return text.where(~numeric, text[numeric].map(_to_number))
+    if other_affinity == 'text' and affinity is None and not _is_text(value):
+        if _is_scalar(value):
+            return _to_text(value) if _is_numeric(value) else value
+        return value.astype(object).map(lambda v: v if _is_null(v) or isinstance(v, str) else _to_text(v))
+    return value
+
+
+def _storage_classes(value, index: pd.Index):
+    """
+    Returns whether each value is text, the numbers and the texts of a mixed operand
+    """
+    values = pd.Series(value, index=index, dtype=object) if _is_scalar(value) else value.astype(object)
+    is_text = values.map(lambda v: isinstance(v, str)).to_numpy(dtype=bool)
+    numbers = pd.to_numeric(values.where(~is_text), errors='coerce').to_numpy(dtype=np.float64)
+    return is_text, numbers, values.where(is_text, '').to_numpy(dtype=object)
+
+
+def _is_true(value) -> bool:
+    if isinstance(value, str):
+        match = _NUMBER_PREFIX.match(value)
+        return match is not None and float(match.group(1)) != 0
+    return bool(value)
+
+
+def _as_boolean(value):
+    """
+    Converts value to a predicate result: pandas nullable boolean series or True/False/pd.NA.
+    Text is true if it starts with a non-zero number
+    """
+    if _is_scalar(value):
+        if _is_null(value):
+            return pd.NA
+        return _is_true(value)
+    if isinstance(value.dtype, pd.BooleanDtype):
+        return value
+    if pd.api.types.is_bool_dtype(value.dtype):
+        return value.astype('boolean')
+    if not _is_numeric(value):
+        return value.astype(object).map(lambda v: pd.NA if _is_null(v) else _is_true(v)).astype('boolean')
+    result = (value != 0).astype('boolean')
+    result[value.isna()] = pd.NA
+    return result
+
+
+def _with_nulls(result, *operands):
+    """
+    Sets predicate result to NULL where any of operands is NULL
+    """
+    result = _as_boolean(result)
+    nulls = reduce(lambda a, b: a | b, (_is_null(o) for o in operands))
+    if _is_scalar(result):
+        if _is_scalar(nulls):
+            return pd.NA if nulls else result
+        result = pd.Series(result, index=nulls.index, dtype='boolean')
+    elif _is_scalar(nulls):
+        if nulls:
+            return pd.Series(pd.NA, index=result.index, dtype='boolean')
+        return result
+    result = result.copy()
+    result[nulls] = pd.NA
+    return result
+
+
+_COMPARISONS = {
+    '=': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+}
+
+
+def _compare(op: str, a, b, affinities=(None, None)):
+    if (_is_scalar(a) and _is_null(a)) or (_is_scalar(b) and _is_null(b)):
+        return pd.NA
+    a, b = _apply_affinity(a, affinities[0], affinities[1]), _apply_affinity(b, affinities[1], affinities[0])
+    compare = _COMPARISONS[op]
+    if _is_scalar(a) and _is_scalar(b):
+        if isinstance(a, str) != isinstance(b, str):
+            # numbers sort before text
+            return compare(isinstance(a, str), isinstance(b, str))
+        return compare(a, b)
+    if (_is_numeric(a) and _is_numeric(b)) or (_is_text(a) and _is_text(b)):
+        # ordering of text columns fails on missing values, their result is overwritten with NULL anyway
+        filled = [v.fillna('') if not _is_scalar(v) and v.dtype == object else v for v in (a, b)]
+        return _with_nulls(compare(*filled), a, b)
+    index = (a if not _is_scalar(a) else b).index
+    (a_text, a_numbers, a_texts), (b_text, b_numbers, b_texts) = _storage_classes(a, index), _storage_classes(b, index)
+    with np.errstate(invalid='ignore'):
+        result = np.where(a_text != b_text, compare(a_text, b_text),
+                          np.where(a_text, compare(a_texts, b_texts), compare(a_numbers, b_numbers)))
+    return _with_nulls(pd.Series(result.astype(bool), index=index), a, b)
+
+
+def _is(a, b, affinities=(None, None)):
+    """
+    a IS b: a = b that is never NULL, NULL is only equal to NULL
+    """
+    equal = _compare('=', a, b, affinities)
+    both_null = _is_null(a) & _is_null(b)
+    if _is_scalar(a) and _is_scalar(b):
+        return bool(both_null) or equal is True
+    index = (a if not _is_scalar(a) else b).index
+    if _is_scalar(equal):
+        equal = pd.Series(equal, index=index, dtype='boolean')
+    return equal.fillna(False).astype(bool) | both_null
+
+
+def _truncate(value):
+    if _is_integer(value):
+        return value
+    return int(value) if _is_scalar(value) else np.trunc(value)
+
+
+def _divide(a, b, op: str):
+    integers = _is_integer(a) and _is_integer(b)
+    if op == '%':
+        # SQLite converts operands of % to integers, the result is real if either of them is
+        a, b = _truncate(a), _truncate(b)
+    if _is_scalar(a) and _is_scalar(b):
+        if b == 0:
+            return None
+        if op == '%':
+            remainder = abs(a) % abs(b) * (-1 if a < 0 else 1)
+            return remainder if integers else float(remainder)
+        return int(a / b) if integers else a / b
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = np.fmod(a, b) if op == '%' else a / b
+    if op == '%' and not integers:
+        result = result.astype(np.float64)
+    if op == '/' and integers:
+        # SQLite truncates integer division towards zero
+        result = np.trunc(result)
+    # and returns NULL on division by zero
+    zero = b == 0
+    if _is_scalar(zero):
+        return result * np.nan if zero else result
+    return result.where(~zero)
+
+
+def _arithmetic(op: str, a, b):
+    if (_is_scalar(a) and _is_null(a)) or (_is_scalar(b) and _is_null(b)):
+        return None
+    if op in ('/', '%'):
+        return _divide(a, b, op)
+    if op == '+':
+        return a + b
+    if op == '-':
+        return a - b
+    if op == '*':
+        return a * b
+    raise ValueError(f'Unknown arithmetic operator: {op}')
+
+
+def _concat(a, b):
+    def to_text(value):
+        if _is_scalar(value):
+            return None if _is_null(value) else str(value)
+        return value.astype('string')
+
+    a, b = to_text(a), to_text(b)
+    if a is None or b is None:
+        return None
+    return (a + b).astype(object) if not (_is_scalar(a) and _is_scalar(b)) else a + b
+
+
+def like_to_regex(pattern: str) -> str:
+    """
+    Converts SQL LIKE pattern to an anchored case-insensitive regular expression
+    """
+    return '(?is)^' + ''.join('.*' if c == '%' else '.' if c == '_' else re.escape(c) for c in pattern) + '$'
+
+
+def _like(value, pattern: str):
+    if _is_scalar(value):
+        if _is_null(value):
+            return pd.NA
+        return re.match(like_to_regex(pattern), str(value)) is not None
+    text = value.astype('string')
+    inner = pattern[1:-1]
+    if len(pattern) >= 2 and pattern[0] == pattern[-1] == '%' and not any(c in inner for c in '%_'):
+        # the most common '%tag%' patterns are plain substring searches
+        result = text.str.contains(inner, case=False, regex=False)
+    else:
+        result = text.str.match(like_to_regex(pattern))
+    return _with_nulls(result, value)
+
+
+def _in(value, values: list, affinity: str = None):
+    """
+    value IN (values) is value = v1 or value = v2 ...: true if any of values equals value, otherwise NULL if
+    value or any of values is NULL. values are compared with value's affinity
+    """
+    if _is_scalar(value) or not all(_is_scalar(v) for v in values) or not (_is_numeric(value) or _is_text(value)):
+        return _logical('or', [_compare('=', value, v, (affinity, None)) for v in values])
+    has_null = any(_is_null(v) for v in values)
+    values = [_apply_affinity(v, None, affinity) for v in values if not _is_null(v)]
+    # values of the other storage class never equal value
+    matched = _with_nulls(value.isin([v for v in values if isinstance(v, str) == _is_text(value)]), value)
+    if has_null:
+        matched[(~matched).fillna(False).astype(bool)] = pd.NA
+    return matched
+
+
+def _logical(connective: str, operands: list):
+    operands = [_as_boolean(o) for o in operands]
+    if connective == 'and':
+        return reduce(lambda a, b: a & b, operands)
+    return reduce(lambda a, b: a | b, operands)
+
+
+def _negate(value):
+    value = _as_boolean(value)
+    if _is_scalar(value):
+        return pd.NA if value is pd.NA else not value
+    return ~value
+
+
+def _case(df: pd.DataFrame, whens, else_value, atoms=None, programs=None):
+    result = _broadcast(evaluate(else_value, df, atoms, programs), df)
+    for condition, value in reversed(whens):
+        condition = fill_false(evaluate(condition, df, atoms, programs), df)
+        value = _broadcast(evaluate(value, df, atoms, programs), df)
+        result = value.where(condition, result)
+    return result
+
+
+def _broadcast(value, df: pd.DataFrame) -> pd.Series:
+    if _is_scalar(value):
+        return pd.Series(np.nan if value is None else value, index=df.index)
+    return value
+
+
+def fill_false(value, df: pd.DataFrame) -> pd.Series:
+    """
+    Converts predicate result to a plain boolean series treating NULL as false (as SQL's WHEN does)
+    """
+    if not _is_scalar(value) and value.dtype == bool:
+        return value
+    value = _as_boolean(value)
+    if _is_scalar(value):
+        return pd.Series(value is True, index=df.index)
+    return value.fillna(False).astype(bool)
+
+
+def evaluate(node, df: pd.DataFrame, atoms=None, programs=None):
+    """
+    Evaluates AST node over df, returns pandas series or a scalar for constant sub-expressions.
+    atoms (predicate_cache.AtomCache) provides results of predicates shared between selections,
+    programs (expr_compiler.get_programs) compiled numeric sub-expressions
+    """
+    if atoms is not None:
+        cached = atoms.get(node, df)
+        if cached is not None:
+            return cached
+    if programs and node in programs:
+        result = programs[node].run(df)
+        if result is not None:
+            return result
+    node_type = node[0]
+    if node_type == 'col':
+        return df[node[1]]
+    if node_type == 'lit':
+        return node[1]
+    if node_type == 'neg':
+        value = evaluate(node[1], df, atoms, programs)
+        return None if _is_scalar(value) and _is_null(value) else -value
+    if node_type == 'not':
+        return _negate(evaluate(node[1], df, atoms, programs))
+    if node_type == 'binop':
+        op, a, b = node[1], evaluate(node[2], df, atoms, programs), evaluate(node[3], df, atoms, programs)
+        if op in _COMPARISONS:
+            return _compare(op, a, b, (get_affinity(node[2], a), get_affinity(node[3], b)))
+        if op == '||':
+            return _concat(a, b)
+        return _arithmetic(op, a, b)
+    if node_type in ('and', 'or'):
+        return _logical(node_type, [evaluate(n, df, atoms, programs) for n in node[1:]])
+    if node_type == 'in':
+        value = evaluate(node[1], df, atoms, programs)
+        result = _in(value, [evaluate(v, df, atoms, programs) for v in node[2]], get_affinity(node[1], value))
+        return _negate(result) if node[3] else result
+    if node_type == 'like':
+        result = _like(evaluate(node[1], df, atoms, programs), node[2])
+        return _negate(result) if node[3] else result
+    if node_type == 'between':
+        value = evaluate(node[1], df, atoms, programs)
+        low, high = evaluate(node[2], df, atoms, programs), evaluate(node[3], df, atoms, programs)
+        affinity = get_affinity(node[1], value)
+        result = _logical('and', [_compare('>=', value, low, (affinity, get_affinity(node[2], low))),
+                                  _compare('<=', value, high, (affinity, get_affinity(node[3], high)))])
+        return _negate(result) if node[4] else result
+    if node_type == 'is':
+        a, b = evaluate(node[1], df, atoms, programs), evaluate(node[2], df, atoms, programs)
+        result = _is(a, b, (get_affinity(node[1], a), get_affinity(node[2], b)))
+        return _negate(result) if node[3] else result
+    if node_type == 'is_null':
+        result = _is_null(evaluate(node[1], df, atoms, programs))
+        if _is_scalar(result):
+            return result != node[2]
+        return ~result if node[2] else result
+    if node_type == 'case':
+        return _case(df, node[1], node[2], atoms, programs)
+    raise ValueError(f'Unknown expression node: {node}')
+
+
+def evaluate_expression(expression: str, df: pd.DataFrame) -> pd.Series:
+    """
+    Evaluates sql expression over df as an attribute value (sql: select <expression>)
+    """
+    node = sql_expr_parser.parse(expression)
+    return _broadcast(evaluate(node, df, programs=expr_compiler.get_programs(node)), df)
+
+
+def evaluate_filter(expression: str, df: pd.DataFrame, atoms=None) -> pd.Series:
+    """
+    Evaluates sql predicate over df as 0/1 flags (sql: case when <expression> then 1 else 0 end)
+    """
+    node = sql_expr_parser.parse(expression)
+    if atoms is not None:
+        node = atoms.normalize(node)
+    result = evaluate(node, df, atoms, expr_compiler.get_programs(node))
+    return fill_false(result, df).astype('int64')
+
+
+# expressions main() checks against SQLite, as attribute values and as filters
+CHECKED_EXPRESSIONS = [
+    "I % 3", "-I % 4", "I % 2.5", "N % 2.5", "X % 2", "X % 0.5", "I / 2", "X / I", "I / 0", "2.5 % I",
+    "I + null", "null - X", "X * null", "X / null",
+    "I in (2, 5)", "I not in (2, null)", "I in (2, null)", "X in (I, 2)", "I in ('5', 'a')", "N not in (1, 2.0)",
+    "S in ('a', null)", "S not in ('a', null)", "S in (5, 10)", "S in (2.5, 'abc')", "O in (5, 'b')",
+    "S < 5", "S = 5", "S >= 2.5", "S < 'b'", "S != 'a'", "O < 'b'", "O = 10", "O >= 'b' or O is null",
+    "D = 5", "D < 5", "D > 1e3", "I = '5'", "I < 'abc'", "X >= '2'", "I = D", "X < D", "D <= I", "S = O",
+    "I + 1 = '6'", "S || '' = 5", "I between 2 and '5'", "S between 1 and 5", "D not between 2 and 7",
+    "case when S = 5 then I else X end", "case when D > 3 then 'big' end", "S || I", "- N", "I * 2 - X > 3",
+    "S like '%a%' and I > 2 or X is null", "not (O < 'b')",
+    "2 between 3 and I", "not (1 < 2) or I = 3", "I > 1 and 1 = 1", "I in (1, 2) and 2 > 1", "I > 2 * 3",
+    "N is not 1", "N is 2.0", "X is N", "S is 'a'", "S is not 'a'", "O is not 5", "D is 5", "not (N is not I)",
+    "1 is 1", "null is not 1", "N + 1 is not null",
+]
+
+
+def main():
+    import sqlite3
+    rng = np.random.default_rng(0)
+    n = 200
+    texts = ['a', 'b', 'B', '5', '10', '2.5', 'abc', ' 5', '', None]
+    df = pd.DataFrame({'I': rng.integers(-6, 12, n),
+                       'N': np.where(rng.random(n) < 0.2, np.nan, rng.integers(-3, 9, n)),
+                       'X': np.where(rng.random(n) < 0.2, np.nan, rng.normal(3, 4, n).round(2)),
+                       'S': pd.Series(rng.choice(texts, n), dtype='str'),
+                       'O': pd.Series(rng.choice(texts, n), dtype=object),
+                       'D': pd.Series(rng.choice(['5', '10', '7', '1200', 'x', None], n), dtype='str')})
+    connection = sqlite3.connect(':memory:')
+    df.to_sql('df', connection, index=False)
+
+    def equal(value, expected) -> bool:
+        if _is_null(value) or expected is None:
+            return _is_null(value) and expected is None
+        if isinstance(expected, str) or isinstance(value, str):
+            return value == expected
+        return bool(np.isclose(float(value), float(expected)))
+
+    failed = 0
+    for expression in CHECKED_EXPRESSIONS:
+        # engines run simplified filters, SQLite running the simplified text must give what the filter gives
+        simplified = sql_expr_parser.simplify_filter(expression)
+        for kind, sql, native in [
+                ('value', expression, lambda: _broadcast(evaluate_expression(expression, df), df)),
+                ('filter', f'case when {expression} then 1 else 0 end', lambda: evaluate_filter(expression, df)),
+                ('simplified filter', f'case when {simplified} then 1 else 0 end',
+                 lambda: evaluate_filter(expression, df))]:
+            expected = [row[0] for row in connection.execute(f'select {sql} from df')]
+            try:
+                values = native().tolist()
+            except Exception as e:
+                failed += 1
+                print(f"FAIL {kind} {expression}: {type(e).__name__}: {e}")
+                continue
+            rows = [i for i, (value, e) in enumerate(zip(values, expected)) if not equal(value, e)]
+            if rows:
+                failed += 1
+                print(f"FAIL {kind} {expression}: {len(rows)} rows differ, e.g. "
+                      f"{df.iloc[rows[0]].to_dict()} gives {values[rows[0]]!r} instead of {expected[rows[0]]!r}")
+    print(f"{len(CHECKED_EXPRESSIONS)} expressions against SQLite: {'OK' if not failed else f'{failed} FAILED'}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
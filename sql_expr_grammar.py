@@ -0,0 +1,211 @@
+# based on https://github.com/pyparsing/pyparsing/blob/master/examples/select_parser.py
+#
+# Grammar of sql expressions, its parse actions build the AST nodes described in sql_expr_parser.
+# Expressions are parsed by sql_expr_pratt, this grammar is kept as the reference sql_expr_pratt.main() checks
+# the nodes built by the parser against.
+
+from pyparsing import *
+
+ParserElement.enablePackrat()
+
+LPAR, RPAR, COMMA = map(Suppress, "(),")
+
+# keywords
+AND = CaselessKeyword('AND').setResultsName("keyword")
+OR = CaselessKeyword('OR').setResultsName("keyword")
+CASE = CaselessKeyword('CASE').setResultsName("keyword")
+WHEN = CaselessKeyword('WHEN').setResultsName("keyword")
+THEN = CaselessKeyword('THEN').setResultsName("keyword")
+ELSE = CaselessKeyword('ELSE').setResultsName("keyword")
+END = CaselessKeyword('END').setResultsName("keyword")
+IS = CaselessKeyword('IS').setResultsName("keyword")
+NULL = CaselessKeyword('NULL').setResultsName("keyword")
+NOT = CaselessKeyword('NOT').setResultsName("keyword")
+BETWEEN = CaselessKeyword('BETWEEN').setResultsName("keyword")
+IN = CaselessKeyword('IN').setResultsName("keyword")
+LIKE = CaselessKeyword('LIKE').setResultsName("keyword")
+NOT_NULL = Group(NOT + NULL).setResultsName("keyword")
+NOT_BETWEEN = Group(NOT + BETWEEN).setResultsName("keyword")
+NOT_IN = Group(NOT + IN).setResultsName("keyword")
+NOT_LIKE = Group(NOT + LIKE).setResultsName("keyword")
+
+keywords = [AND, OR, CASE, WHEN, THEN, ELSE, END, IS, NULL, NOT, BETWEEN, IN, LIKE]
+any_keyword = MatchFirst(keywords)
+
+quoted_identifier = QuotedString('"', escQuote='""')
+identifier = (~any_keyword + Word(alphas, alphanums + "_")).setParseAction(pyparsing_common.upcaseTokens) | \
+             quoted_identifier
+identifier = identifier.setResultsName("col").addParseAction(lambda t: ('col', t[0]))
+
+expr = Forward().setName("expression")
+
+numeric_literal = pyparsing_common.number.copy().addParseAction(lambda t: ('lit', t[0]))
+string_literal = QuotedString("'", escQuote="''").setParseAction(lambda t: ('lit', t[0]))
+null_literal = CaselessKeyword('NULL').setParseAction(lambda t: ('lit', None))
+literal_value = (numeric_literal | string_literal | null_literal)
+
+like_string = string_literal.copy().setResultsName("like_string")
+
+in_list = (LPAR + Group(delimitedList(expr)).setResultsName("values_list") + RPAR).setParseAction(
+    lambda t: ('list', tuple(map(_unwrap, t[0]))))
+
+case_expr = (CASE + OneOrMore(Group(Suppress(WHEN) + expr + Suppress(THEN) + expr)) +
+             Optional(Suppress(ELSE) + expr, default=('lit', None)) + END)
+
+
+def _case_node(tokens):
+    # tokens: 'CASE', (condition, value) groups..., else value, 'END'
+    return ('case', tuple((_operand(w[0]), _operand(w[1])) for w in tokens[1:-2]), _operand(tokens[-2]))
+
+
+case_expr.setParseAction(_case_node)
+
+expr_term = (
+        case_expr
+        | in_list
+        | literal_value
+        | identifier
+)
+
+
+def _unwrap(token):
+    """
+    Nodes built by parse actions of nested operator levels come back wrapped in ParseResults
+    """
+    while isinstance(token, ParseResults) and len(token) == 1 and not isinstance(token[0], str):
+        token = token[0]
+    return token
+
+
+def _operand(node):
+    """
+    Parenthesised sub-expressions are matched by in_list, unwraps them outside of IN
+    """
+    node = _unwrap(node)
+    if node[0] == 'list' and len(node[1]) == 1:
+        return _operand(node[1][0])
+    return node
+
+
+def _split_tokens(tokens) -> (list, list):
+    """
+    Splits tokens of an operator level into operands (AST nodes) and upper-cased operator words
+    """
+    operands, operators = [], []
+    for token in map(_unwrap, tokens):
+        if isinstance(token, tuple):
+            operands.append(token)
+        elif isinstance(token, ParseResults):
+            operators.append(' '.join(str(t).upper() for t in token))
+        else:
+            operators.append(str(token).upper())
+    return operands, operators
+
+
+def _unary_prefix_node(tokens):
+    operands, operators = _split_tokens(tokens[0])
+    node = _operand(operands[0])
+    for op in reversed(operators):
+        if op == '-':
+            node = ('neg', node)
+        elif op == 'NOT':
+            node = ('not', node)
+    return node
+
+
+def _not_null_node(tokens):
+    operands, _ = _split_tokens(tokens[0])
+    return ('is_null', _operand(operands[0]), True)
+
+
+def _binary_node(tokens):
+    items = list(tokens[0])
+    node = _operand(items[0])
+    i = 1
+    while i < len(items):
+        _, operators = _split_tokens([items[i]])
+        op = operators[0]
+        right = _unwrap(items[i + 1]) if op in ('IN', 'NOT IN') else _operand(items[i + 1])
+        if op == 'IS':
+            if right == ('lit', None):
+                node = ('is_null', node, False)
+            elif right == ('not', ('lit', None)):
+                node = ('is_null', node, True)
+            else:
+                node = ('is', node, right, False)
+        elif op in ('IN', 'NOT IN'):
+            node = ('in', node, right[1] if right[0] == 'list' else (right,), op == 'NOT IN')
+        else:
+            node = ('binop', '!=' if op == '<>' else op, node, right)
+        i += 2
+    return node
+
+
+def _between_node(tokens):
+    operands, operators = _split_tokens(tokens[0])
+    return ('between', _operand(operands[0]), _operand(operands[1]), _operand(operands[2]), 'NOT' in operators)
+
+
+def _in_list_node(tokens):
+    operands, operators = _split_tokens(tokens[0])
+    return ('in', _operand(operands[0]), operands[1][1], operators[0] == 'NOT IN')
+
+
+def _like_node(tokens):
+    operands, operators = _split_tokens(tokens[0])
+    return ('like', _operand(operands[0]), operands[1][1], operators[0] == 'NOT LIKE')
+
+
+def _connective_node(connective):
+    def parse_action(tokens):
+        operands, _ = _split_tokens(tokens[0])
+        node = [connective]
+        for operand in map(_operand, operands):
+            # flatten nested connectives of the same kind: a and (b and c) -> and(a, b, c)
+            node.extend(operand[1:] if operand[0] == connective else (operand,))
+        return tuple(node)
+
+    return parse_action
+
+
+UNARY, BINARY, TERNARY = 1, 2, 3
+expr << infixNotation(
+    expr_term,
+    [
+        (oneOf("- +") | NOT, UNARY, opAssoc.RIGHT, _unary_prefix_node),
+        (NOT_NULL, UNARY, opAssoc.LEFT, _not_null_node),
+        ("||", BINARY, opAssoc.LEFT, _binary_node),
+        (oneOf("* / %"), BINARY, opAssoc.LEFT, _binary_node),
+        (oneOf("+ -"), BINARY, opAssoc.LEFT, _binary_node),
+        # '<' must not consume the first character of '<>'
+        (Regex(r"<=|>=|<(?!>)|>"), BINARY, opAssoc.LEFT, _binary_node),
+        (
+            oneOf("= != <>")
+            | IS
+            | IN
+            | NOT_IN,
+            BINARY,
+            opAssoc.LEFT,
+            _binary_node,
+        ),
+        ((BETWEEN | NOT_BETWEEN, AND), TERNARY, opAssoc.LEFT, _between_node),
+        (
+            (IN | NOT_IN) + in_list,
+            UNARY,
+            opAssoc.LEFT,
+            _in_list_node,
+        ),
+        (
+            (LIKE | NOT_LIKE) + like_string,
+            UNARY,
+            opAssoc.LEFT,
+            _like_node,
+        ),
+        (AND, BINARY, opAssoc.LEFT, _connective_node('and')),
+        (OR, BINARY, opAssoc.LEFT, _connective_node('or')),
+    ]
+)
+
+
+def parse(expression: str) -> tuple:
+    return _operand(expr.parseString(expression, parseAll=True)[0])
@@ -1,131 +1,546 @@
-# based on https://github.com/pyparsing/pyparsing/blob/master/examples/select_parser.py
-from pyparsing import *
-
-ParserElement.enablePackrat()
-
-LPAR, RPAR, COMMA = map(Suppress, "(),")
-
-# keywords
-AND = CaselessKeyword('AND').setResultsName("keyword")
-OR = CaselessKeyword('OR').setResultsName("keyword")
-CASE = CaselessKeyword('CASE').setResultsName("keyword")
-WHEN = CaselessKeyword('WHEN').setResultsName("keyword")
-THEN = CaselessKeyword('THEN').setResultsName("keyword")
-IS = CaselessKeyword('IS').setResultsName("keyword")
-NULL = CaselessKeyword('NULL').setResultsName("keyword")
-NOT = CaselessKeyword('NOT').setResultsName("keyword")
-BETWEEN = CaselessKeyword('BETWEEN').setResultsName("keyword")
-IN = CaselessKeyword('IN').setResultsName("keyword")
-LIKE = CaselessKeyword('LIKE').setResultsName("keyword")
-NOT_NULL = Group(NOT + NULL).setResultsName("keyword")
-NOT_BETWEEN = Group(NOT + BETWEEN).setResultsName("keyword")
-NOT_IN = Group(NOT + IN).setResultsName("keyword")
-NOT_LIKE = Group(NOT + LIKE).setResultsName("keyword")
-
-keywords = [AND, OR, LIKE, IN]  # todo add others
-any_keyword = MatchFirst(keywords)
-
-quoted_identifier = QuotedString('"', escQuote='""')
-identifier = (~any_keyword + Word(alphas, alphanums + "_")).setParseAction(pyparsing_common.upcaseTokens) | \
-             quoted_identifier
-identifier = identifier.setResultsName("col")
-
-like_string = QuotedString("'%", end_quote_char="%'").setResultsName("like_string")
-
-expr = Forward().setName("expression")
-
-numeric_literal = pyparsing_common.number
-string_literal = QuotedString("'", escQuote="''")
-literal_value = (numeric_literal | string_literal | NULL)
-
-in_list = LPAR + Group(delimitedList(expr)).setResultsName("values_list") + RPAR
-
-expr_term = (
-        in_list
-        | literal_value
-        | Group(identifier)
-)
-
-UNARY, BINARY, TERNARY = 1, 2, 3
-expr << infixNotation(
-    expr_term,
-    [
-        (oneOf("- +") | NOT, UNARY, opAssoc.RIGHT),
-        (NOT_NULL, UNARY, opAssoc.LEFT),
-        ("||", BINARY, opAssoc.LEFT),
-        (oneOf("* / %"), BINARY, opAssoc.LEFT),
-        (oneOf("+ -"), BINARY, opAssoc.LEFT),
-        (oneOf("< <= > >="), BINARY, opAssoc.LEFT),
-        (
-            oneOf("= != <>")
-            | IS
-            | IN
-            | NOT_IN,
-            BINARY,
-            opAssoc.LEFT,
-        ),
-        ((BETWEEN | NOT_BETWEEN, AND), TERNARY, opAssoc.LEFT),
-        (
-            (IN | NOT_IN) + in_list,
-            UNARY,
-            opAssoc.LEFT,
-        ),
-        (
-            (LIKE | NOT_LIKE) + like_string,
-            UNARY,
-            opAssoc.LEFT,
-        ),
-        (AND, BINARY, opAssoc.LEFT),
-        (OR, BINARY, opAssoc.LEFT),
-    ]
-)
+# Parsed expressions are represented as hashable tuples (AST nodes):
+#   ('col', name)                              column reference
+#   ('lit', value)                             number, string or None (NULL)
+#   ('neg', x), ('not', x)                     unary minus and logical negation
+#   ('binop', op, a, b)                        arithmetic, '||' and comparisons ('<>' is stored as '!=')
+#   ('and', x, y, ...), ('or', x, y, ...)      logical connectives
+#   ('in', x, (v1, v2, ...), negated)
+#   ('like', x, pattern, negated)
+#   ('between', x, low, high, negated)
+#   ('is_null', x, negated)
+#   ('is', x, y, negated)                      x is (not) y of a non-NULL y: = where NULL equals only NULL
+#   ('case', ((condition, value), ...), else_value)
+#
+# Filters are simplified before they are compiled (simplify_filter): constants are folded, tautologies and
+# contradictions removed, duplicate conjuncts dropped, ranges of a column merged and predicates put in a canonical
+# form, so that the simplified text is what both engines execute and what caches are keyed by.
+# Simplification keeps SQL's three-valued logic: NULL is only treated as false where just the truth of a predicate
+# matters (a filter, a WHEN condition and the operands of their and/or), never below a NOT.
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, FrozenSet, List
+
+import sql_expr_pratt
+
+# parsed expressions by expression text, least recently used first. Bounded, as long-running server workers
+# parse the expressions of every upload
+max_parsed = 4096
+_parsed: 'OrderedDict[str, tuple]' = OrderedDict()
+_lock = threading.Lock()
+
+TRUE, FALSE, NULL = ('lit', 1), ('lit', 0), ('lit', None)
+FLIPPED_COMPARISONS = {'<': '>', '<=': '>=', '>': '<', '>=': '<=', '=': '=', '!=': '!='}
+NEGATED_COMPARISONS = {'<': '>=', '<=': '>', '>': '<=', '>=': '<', '=': '!=', '!=': '='}
+# nodes whose value is 0, 1 or NULL
+BOOLEAN_NODES = ('and', 'or', 'not', 'in', 'like', 'between', 'is_null', 'is')
+# sqlite integers are 64 bit, greater results of folded arithmetic would be floats
+MAX_INTEGER = 2 ** 63 - 1
+# binding strength of operators printed by to_sql, comparisons are 3. Operands binding less strongly than their
+# operator are parenthesised, so are operands of '||', NOT and comparisons of comparisons whose precedence
+# differs between sql dialects. Negative numbers are parenthesised in arithmetic ('- -1' would be a comment)
+_PRECEDENCE = {'neg': 9, '*': 6, '/': 6, '%': 6, '+': 5, '-': 5, '||': 3.5,
+               'in': 2, 'like': 2, 'between': 2, 'is_null': 2, 'is': 2, 'not': 1.5, 'and': 1, 'or': 0}
+
+
+def children(node) -> list:
+    """
+    Returns direct sub-expressions of an AST node
+    """
+    node_type = node[0]
+    if node_type in ('col', 'lit'):
+        return []
+    if node_type in ('neg', 'not', 'like', 'is_null'):
+        return [node[1]]
+    if node_type == 'binop':
+        return [node[2], node[3]]
+    if node_type == 'is':
+        return [node[1], node[2]]
+    if node_type in ('and', 'or'):
+        return list(node[1:])
+    if node_type == 'in':
+        return [node[1], *node[2]]
+    if node_type == 'between':
+        return [node[1], node[2], node[3]]
+    if node_type == 'case':
+        return [n for when in node[1] for n in when] + [node[2]]
+    raise ValueError(f'Unknown expression node: {node}')
+
+
+def _extract_identifiers(node) -> list:
+    if node[0] == 'col':
+        return [node[1]]
+    return [identifier for child in children(node) for identifier in _extract_identifiers(child)]
 
 
-def _extract_identifiers(parsed_expression):
-    identifiers = []
-    if isinstance(parsed_expression, ParseResults):
-        for item in parsed_expression:
-            if isinstance(item, ParseResults) and item.col:
-                identifiers.append(item.col[0])
-            elif isinstance(item, ParseResults):
-                identifiers.extend(_extract_identifiers(item))
-    return identifiers
+def _add_parsed(expression: str, node):
+    with _lock:
+        _parsed[expression] = node
+        _parsed.move_to_end(expression)
+        while len(_parsed) > max_parsed:
+            _parsed.popitem(last=False)
 
 
 def parse(expression):
-    return expr.parseString(expression)[0]
+    # AST nodes are immutable tuples, so parsed expressions are safely shared between callers
+    with _lock:
+        node = _parsed.get(expression)
+        if node is not None:
+            _parsed.move_to_end(expression)
+    if node is None:
+        node = sql_expr_pratt.parse(expression)
+        _add_parsed(expression, node)
+    return node
+
+
+def add_parsed(parsed: Dict[str, tuple]):
+    """
+    Adds expressions parsed beforehand (e.g. by a cached plan) to the cache of parse
+    """
+    for expression, node in parsed.items():
+        _add_parsed(expression, node)
 
 
 def extract_identifiers(expression):
     return _extract_identifiers(parse(expression))
 
 
+def literal_sort_key(node):
+    return type(node[1]).__name__, node[1]
+
+
+def _is_number(node) -> bool:
+    return node[0] == 'lit' and isinstance(node[1], (int, float)) and not isinstance(node[1], bool)
+
+
+def _is_boolean(node) -> bool:
+    return node[0] in BOOLEAN_NODES or (node[0] == 'binop' and node[1] in FLIPPED_COMPARISONS)
+
+
+def _number(value):
+    """
+    Returns literal of a folded number, None if sqlite would compute it differently (overflow, inf or nan)
+    """
+    if isinstance(value, int):
+        return ('lit', value) if -MAX_INTEGER - 1 <= value <= MAX_INTEGER else None
+    return ('lit', value) if value == value and abs(value) != float('inf') else None
+
+
+def _fold_binop(op: str, a, b):
+    """
+    Returns the literal of a binary operation of literals, None if it isn't folded
+    """
+    x, y = a[1], b[1]
+    if op in FLIPPED_COMPARISONS:
+        if not (_is_number(a) and _is_number(b) or isinstance(x, str) and isinstance(y, str)):
+            return None
+        result = {'<': x < y, '<=': x <= y, '>': x > y, '>=': x >= y, '=': x == y, '!=': x != y}[op]
+        return TRUE if result else FALSE
+    if op == '||':
+        return ('lit', x + y) if isinstance(x, str) and isinstance(y, str) else None
+    if not (_is_number(a) and _is_number(b)):
+        return None
+    if op == '+':
+        return _number(x + y)
+    if op == '-':
+        return _number(x - y)
+    if op == '*':
+        return _number(x * y)
+    if op == '/':
+        if y == 0:
+            return NULL
+        if isinstance(x, int) and isinstance(y, int):
+            # integer division truncates towards zero
+            quotient = abs(x) // abs(y)
+            return _number(quotient if (x < 0) == (y < 0) else -quotient)
+        return _number(x / y)
+    return None
+
+
+def _negate(node):
+    """
+    Returns the negation of a predicate with NOT pushed into comparisons and negatable predicates,
+    None if node can't be negated other than by NOT
+    """
+    node_type = node[0]
+    if node_type == 'lit':
+        if node == NULL:
+            return NULL
+        return (FALSE if node[1] else TRUE) if _is_number(node) else None
+    if node_type == 'not':
+        return node[1] if _is_boolean(node[1]) else None
+    if node_type == 'binop' and node[1] in NEGATED_COMPARISONS:
+        return ('binop', NEGATED_COMPARISONS[node[1]], node[2], node[3])
+    if node_type in ('in', 'like', 'between', 'is_null', 'is'):
+        return (*node[:-1], not node[-1])
+    if node_type in ('and', 'or'):
+        # De Morgan's laws hold in three-valued logic
+        return ('or' if node_type == 'and' else 'and',
+                *(child if negated is None else negated for child, negated in
+                  ((('not', child), _negate(child)) for child in node[1:])))
+    return None
+
+
+def _get_bounds(node):
+    """
+    Returns expression and (value, inclusive) lower and upper bounds (None if unbounded) of a comparison
+    of an expression to numbers, None for other nodes
+    """
+    if node[0] == 'binop' and node[1] in ('<', '<=', '>', '>=', '=') and _is_number(node[3]) \
+            and node[2][0] != 'lit':
+        op, value = node[1], node[3][1]
+        lower = (value, op != '>') if op in ('>', '>=', '=') else None
+        upper = (value, op != '<') if op in ('<', '<=', '=') else None
+        return node[2], lower, upper
+    if node[0] == 'between' and not node[4] and _is_number(node[2]) and _is_number(node[3]) and node[1][0] != 'lit':
+        return node[1], (node[2][1], True), (node[3][1], True)
+    return None
+
+
+def _is_numeric(node, numeric: FrozenSet[str]) -> bool:
+    """
+    Returns whether expression is a number or NULL whatever the data: a numeric column or arithmetic
+    """
+    if node[0] == 'col':
+        return node[1] in numeric
+    return node[0] == 'neg' or node[0] == 'binop' and node[1] in ('+', '-', '*', '/', '%')
+
+
+def _tighter(bound, other, is_lower: bool):
+    if bound is None or other is None:
+        return other if bound is None else bound
+    if bound[0] != other[0]:
+        return bound if (bound[0] > other[0]) == is_lower else other
+    return bound[0], bound[1] and other[1]
+
+
+def _merge_ranges(operands: List[tuple], predicate: bool, numeric: FrozenSet[str]) -> List[tuple]:
+    """
+    Replaces comparisons of the same numeric expression to numbers in conjuncts by its tightest range:
+    x > 1 and x >= 5 and x <= 9 -> x between 5 and 9. Empty ranges are false where only the truth matters.
+    Text compares to numbers as text (with a text column) or as greater than any number, so comparisons
+    of other expressions are left alone
+    """
+    groups = {}
+    for position, operand in enumerate(operands):
+        bounds = _get_bounds(operand)
+        if bounds is not None and _is_numeric(bounds[0], numeric):
+            groups.setdefault(bounds[0], []).append((position, bounds[1], bounds[2]))
+    replaced = {}
+    for expression, members in groups.items():
+        if len(members) < 2:
+            continue
+        lower = upper = None
+        for _, member_lower, member_upper in members:
+            lower, upper = _tighter(lower, member_lower, True), _tighter(upper, member_upper, False)
+        if lower is not None and upper is not None and (lower[0] > upper[0] or
+                                                        lower[0] == upper[0] and not (lower[1] and upper[1])):
+            # x is null or out of the empty range, the conjunction is never true
+            if predicate:
+                return [FALSE]
+            continue
+        if lower is not None and upper is not None and lower[0] == upper[0]:
+            merged = [('binop', '=', expression, ('lit', lower[0]))]
+        elif lower is not None and upper is not None and lower[1] and upper[1]:
+            merged = [('between', expression, ('lit', lower[0]), ('lit', upper[0]), False)]
+        else:
+            merged = ([('binop', '>=' if lower[1] else '>', expression, ('lit', lower[0]))] if lower else []) + \
+                     ([('binop', '<=' if upper[1] else '<', expression, ('lit', upper[0]))] if upper else [])
+        for position, _, _ in members:
+            replaced[position] = []
+        replaced[members[0][0]] = merged
+    if not replaced:
+        return operands
+    return [merged for position, operand in enumerate(operands)
+            for merged in replaced.get(position, [operand])]
+
+
+def _merge_equalities(operands: List[tuple]) -> List[tuple]:
+    """
+    Replaces equalities of the same expression to literals in disjuncts by IN: x = 1 or x in (2, 3) -> x in (1, 2, 3)
+    """
+    groups = {}
+    for position, operand in enumerate(operands):
+        if operand[0] == 'binop' and operand[1] == '=' and operand[3][0] == 'lit' and operand[3] != NULL:
+            groups.setdefault(operand[2], []).append((position, (operand[3],)))
+        elif operand[0] == 'in' and not operand[3] and all(v[0] == 'lit' and v != NULL for v in operand[2]):
+            groups.setdefault(operand[1], []).append((position, operand[2]))
+    replaced = {}
+    for expression, members in groups.items():
+        if len(members) > 1:
+            values = tuple(sorted({v for _, member_values in members for v in member_values}, key=literal_sort_key))
+            for position, _ in members:
+                replaced[position] = []
+            replaced[members[0][0]] = [('in', expression, values, False)]
+    if not replaced:
+        return operands
+    return [merged for position, operand in enumerate(operands)
+            for merged in replaced.get(position, [operand])]
+
+
+def _simplify_connective(connective: str, operands: List[tuple], predicate: bool, numeric: FrozenSet[str]):
+    # a literal operand decides the result (absorbing) or doesn't change it (identity)
+    absorbing, identity = (FALSE, TRUE) if connective == 'and' else (TRUE, FALSE)
+    flat = []
+    for operand in operands:
+        flat.extend(operand[1:] if operand[0] == connective else (operand,))
+    result = []
+    for operand in dict.fromkeys(flat):
+        if _is_number(operand):
+            if bool(operand[1]) == bool(absorbing[1]):
+                return absorbing
+            continue
+        if operand == NULL and predicate:
+            # unknown is as good as false: it decides a conjunction and doesn't change a disjunction
+            if connective == 'and':
+                return FALSE
+            continue
+        result.append(operand)
+    for operand in result:
+        complement = _negate(operand)
+        # is (not) null and is (not) are never unknown, p and not p is never true
+        if complement in result and (operand[0] in ('is_null', 'is') or predicate and connective == 'and'):
+            return absorbing
+    result = _merge_ranges(result, predicate, numeric) if connective == 'and' else _merge_equalities(result)
+    if result == [FALSE]:
+        return FALSE
+    if not result:
+        return identity
+    if len(result) == 1:
+        # and/or of a single value is its truth as 0/1
+        return result[0] if predicate or _is_boolean(result[0]) else (connective, result[0], identity)
+    return (connective, *result)
+
+
+def _simplify_in(node, predicate: bool, numeric: FrozenSet[str]):
+    operand, negated = simplify(node[1], numeric=numeric), node[3]
+    values = tuple(simplify(v, numeric=numeric) for v in node[2])
+    if all(v[0] == 'lit' for v in values):
+        if NULL in values and predicate:
+            # NULL in the list makes a miss unknown instead of false
+            if negated:
+                return FALSE
+            values = tuple(v for v in values if v != NULL)
+            if not values:
+                return FALSE
+        values = tuple(sorted(set(values), key=literal_sort_key))
+    if len(values) == 1:
+        return simplify(('binop', '!=' if negated else '=', operand, values[0]), predicate, numeric)
+    return 'in', operand, values, negated
+
+
+def simplify(node, predicate: bool = False, numeric: FrozenSet[str] = frozenset()):
+    """
+    Returns an equivalent simplified expression. With predicate only the truth of node matters,
+    i.e. NULL is as good as false. numeric are columns known to hold numbers only
+    """
+    node_type = node[0]
+    if node_type in ('col', 'lit'):
+        return node
+    if node_type == 'not':
+        negated = _negate(node[1])
+        if negated is not None:
+            return simplify(negated, predicate, numeric)
+        operand = simplify(node[1], numeric=numeric)
+        negated = _negate(operand)
+        return ('not', operand) if negated is None else simplify(negated, predicate, numeric)
+    if node_type == 'neg':
+        operand = simplify(node[1], numeric=numeric)
+        if operand == NULL or _is_number(operand):
+            return operand if operand == NULL else _number(-operand[1]) or ('neg', operand)
+        return 'neg', operand
+    if node_type == 'binop':
+        op, left, right = node[1], simplify(node[2], numeric=numeric), simplify(node[3], numeric=numeric)
+        if op in FLIPPED_COMPARISONS and left[0] == 'lit' and right[0] != 'lit':
+            op, left, right = FLIPPED_COMPARISONS[op], right, left
+        if left == NULL or right == NULL:
+            return NULL
+        if left[0] == 'lit' and right[0] == 'lit':
+            folded = _fold_binop(op, left, right)
+            if folded is not None:
+                return folded
+        return 'binop', op, left, right
+    if node_type in ('and', 'or'):
+        return _simplify_connective(node_type, [simplify(child, predicate, numeric) for child in node[1:]], predicate,
+                                    numeric)
+    if node_type == 'in':
+        return _simplify_in(node, predicate, numeric)
+    if node_type == 'like':
+        return 'like', simplify(node[1], numeric=numeric), node[2], node[3]
+    if node_type == 'between':
+        operand, low, high = (simplify(child, numeric=numeric) for child in node[1:4])
+        negated = node[4]
+        if low == high and low != NULL:
+            return simplify(('binop', '!=' if negated else '=', operand, low), predicate, numeric)
+        if _is_number(operand) and _is_number(low) and _is_number(high):
+            return TRUE if (low[1] <= operand[1] <= high[1]) != negated else FALSE
+        return 'between', operand, low, high, negated
+    if node_type == 'is_null':
+        operand = simplify(node[1], numeric=numeric)
+        if operand[0] == 'lit':
+            return TRUE if (operand == NULL) != node[2] else FALSE
+        return 'is_null', operand, node[2]
+    if node_type == 'is':
+        left, right, negated = simplify(node[1], numeric=numeric), simplify(node[2], numeric=numeric), node[3]
+        if left[0] == 'lit' and right[0] != 'lit':
+            left, right = right, left
+        if right == NULL:
+            return simplify(('is_null', left, negated), numeric=numeric)
+        if left[0] == 'lit':
+            folded = _fold_binop('=', left, right)
+            if folded is not None:
+                return _negate(folded) if negated else folded
+        return 'is', left, right, negated
+    if node_type == 'case':
+        whens, else_value = [], simplify(node[2], numeric=numeric)
+        for condition, value in node[1]:
+            condition, value = simplify(condition, True, numeric), simplify(value, numeric=numeric)
+            if condition == NULL or _is_number(condition) and not condition[1]:
+                continue
+            if _is_number(condition):
+                # the following branches are never reached
+                else_value = value
+                break
+            whens.append((condition, value))
+        return ('case', tuple(whens), else_value) if whens else else_value
+    raise ValueError(f'Unknown expression node: {node}')
+
+
+def _quote(text: str, quote: str) -> str:
+    return quote + text.replace(quote, quote * 2) + quote
+
+
+def _precedence(node) -> float:
+    node_type = node[0]
+    if _is_number(node) and node[1] < 0:
+        return 4.5
+    if node_type in ('col', 'lit', 'case'):
+        return 10
+    if node_type == 'binop':
+        return _PRECEDENCE.get(node[1], 3)
+    return _PRECEDENCE[node_type]
+
+
+def _operand_sql(node, bound: float) -> str:
+    """
+    Returns sql text of an operand, parenthesised unless it binds more strongly than bound
+    """
+    return to_sql(node) if _precedence(node) > bound else f'({to_sql(node)})'
+
+
+def to_sql(node) -> str:
+    """
+    Returns sql text of an expression, parse of the text returns an equivalent expression
+    """
+    node_type = node[0]
+    if node_type == 'col':
+        name = node[1]
+        return name if re.fullmatch(r'[A-Z][A-Z0-9_]*', name) and name not in sql_expr_pratt.KEYWORDS else _quote(name, '"')
+    if node_type == 'lit':
+        if node[1] is None:
+            return 'null'
+        return _quote(node[1], "'") if isinstance(node[1], str) else repr(node[1])
+    if node_type == 'neg':
+        return f'-{_operand_sql(node[1], 9)}'
+    if node_type == 'not':
+        return f'not {_operand_sql(node[1], 9)}'
+    if node_type == 'binop':
+        bound = 9 if node[1] == '||' else _precedence(node)
+        return f'{_operand_sql(node[2], bound)} {node[1]} {_operand_sql(node[3], bound)}'
+    if node_type in ('and', 'or'):
+        return f' {node_type} '.join(_operand_sql(child, 1) for child in node[1:])
+    if node_type == 'in':
+        return f"{_operand_sql(node[1], 3)} {'not in' if node[3] else 'in'} ({', '.join(map(to_sql, node[2]))})"
+    if node_type == 'like':
+        pattern = _quote(node[2], "'")
+        return f"{_operand_sql(node[1], 3)} {'not like' if node[3] else 'like'} {pattern}"
+    if node_type == 'between':
+        return f"{_operand_sql(node[1], 3)} {'not between' if node[4] else 'between'} " \
+               f"{_operand_sql(node[2], 3)} and {_operand_sql(node[3], 3)}"
+    if node_type == 'is_null':
+        return f"{_operand_sql(node[1], 3)} is {'not null' if node[2] else 'null'}"
+    if node_type == 'is':
+        return f"{_operand_sql(node[1], 3)} {'is not' if node[3] else 'is'} {_operand_sql(node[2], 3)}"
+    if node_type == 'case':
+        whens = ' '.join(f'when {to_sql(condition)} then {to_sql(value)}' for condition, value in node[1])
+        return f'case {whens} else {to_sql(node[2])} end'
+    raise ValueError(f'Unknown expression node: {node}')
+
+
+def simplify_filter(expression: str, numeric: FrozenSet[str] = frozenset()) -> str:
+    """
+    Returns the text of the simplified filter expression. Its parsed expression is the simplified one,
+    a filter simplified to a constant is 1=1 or 1=0. numeric are columns known to hold numbers only
+    """
+    node = simplify(parse(expression), True, numeric)
+    if node[0] == 'lit' and (node == NULL or _is_number(node)):
+        node = TRUE if node[1] else FALSE
+        text = '1=1' if node == TRUE else '1=0'
+    else:
+        text = to_sql(node)
+    _add_parsed(text, node)
+    return text
+
+
+# expressions parse must parse, sql_expr_pratt.main checks them against the reference grammar
+TEST_EXPRESSIONS = [
+    "z > 100",
+    "1=1 and b='yes'",
+    "(1=1 or 2=3) and b='yes'",
+    "(1.0 + bonus)",
+    "bar BETWEEN +180 AND +10E9",
+    "b In ('4')",
+    "C >= CURRENT_Time",
+    'dave != "Dave"',
+    "dave is not null",
+    "pete is null or peter is not null",
+    "a >= 10 * (2 + 3)",
+    "frank = 'is ''scary'''",
+    "space IS NOT null",
+    "ff NOT IN (1,2,4,5)",
+    "ff not between 3 and 9",
+    "ff not like 'bob%'",
+    "case when a=0 then 0 when b<=60 then c else c*100 end",
+]
+
+
 def main():
-    tests = """\
-        z > 100
-        1=1 and b='yes'
-        (1=1 or 2=3) and b='yes'
-        (1.0 + bonus)
-        bar BETWEEN +180 AND +10E9
-        b In ('4')
-        C >= CURRENT_Time
-        dave != "Dave" 
-        dave is not null
-        pete is null or peter is not null
-        a >= 10 * (2 + 3)
-        frank = 'is ''scary'''
-        space IS NOT null
-        ff NOT IN (1,2,4,5)
-        ff not between 3 and 9
-        ff not like 'bob%'
-    """
-
-    success, _ = expr.runTests(tests)
+    success = True
+    for expression in TEST_EXPRESSIONS:
+        try:
+            print(f"{expression}\n  {parse(expression)}")
+        except sql_expr_pratt.ParseError as e:
+            print(f"{expression}\n  {e}")
+            success = False
+
+    # filter -> simplified filter
+    simplified = [
+        ("1=1 and b='yes'", "B = 'yes'"),
+        ("(1=1 or 2=3) and b='yes'", "B = 'yes'"),
+        ("1=2 and b='yes'", "1=0"),
+        ("100 < z and z > 100", "Z > 100"),
+        ("x > 1 and x >= 5 and x <= 9", "X between 5 and 9"),
+        ("x > 5 and x < 3", "1=0"),
+        ("not (x > 5 and x < 3)", "X <= 5 or X >= 3"),
+        ("x = 5 and x > 3", "X = 5"),
+        ("s > 9 and s > 10", "S > 9 and S > 10"),
+        ("s + 0 > 9 and s + 0 > 10", "S + 0 > 10"),
+        ("a = 1 or a = 2 or a in (3, 1)", "A in (1, 2, 3)"),
+        ("b In ('4')", "B = '4'"),
+        ("x in (1, null)", "X = 1"),
+        ("x = null", "1=0"),
+        ("dave is null or dave is not null", "1=1"),
+        ("not (a is null or b like 'x%')", "A is not null and B not like 'x%'"),
+        ("a >= 10 * (2 + 3) - -1", "A >= 51"),
+        ("case when 1=0 then a when b<=60 then c else c*100 end > 0", "case when B <= 60 then C else C * 100 end > 0"),
+    ]
+    for expression, expected in simplified:
+        result = simplify_filter(expression, frozenset({'X', 'Z'}))
+        print(f"{expression} -> {result}")
+        success = success and result == expected
     print("\n{}".format("OK" if success else "FAIL"))
     return 0 if success else 1
 
 
 if __name__ == "__main__":
     main()
-    # p = expr.parseString("ff IN (1,2,4,5) and dd like '%##ASDF##%'")
-    # print(p)
@@ -0,0 +1,167 @@
+import argparse
+import os
+import sys
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+import plans
+import predicate_cache
+import scheduler
+import selection
+import window_functions
+
+# Count-only runs for monitoring: per selection the number of rows passing each filter_<id>, filters_level_<n>
+# and is_selected and the distribution of combinations of failed filters, without output frames or files.
+# Every filter is evaluated on all rows (as with show_all and add_filters) but output attributes aren't computed.
+# The native engine keeps only the 0/1 flag columns of a selection, the sql engines group the selection query by
+# them, so each selection is reduced to the numbers of rows of each combination of flags (and date of stacked
+# input data), which all counts are derived from.
+
+SUMMARY_FILE_NAME = 'summary.csv'
+FAILED_FILTERS_FILE_NAME = 'failed_filters.csv'
+
+
+def get_summary_plan(plan: plans.SelectionPlan, compiled: plans.Plans) -> plans.SelectionPlan:
+    """
+    Returns plan computing every filter of selection on all rows and no output attribute
+    """
+    return selection.compile_selection(plan.selection.with_output_settings(show_all=True, add_attributes=False,
+                                                                           add_filters=True),
+                                       compiled.universe_attributes)
+
+
+def get_flag_columns(plan: plans.SelectionPlan) -> List[Tuple[str, List[str]]]:
+    """
+    Returns 0/1 columns of plan in the order they are computed, with the filters_level columns of the levels
+    preceding theirs
+    """
+    columns = []
+    for level in plan.levels:
+        columns.extend((f"filter_{filter_id}", level.preceding_filters) for filter_id, _ in level.filters)
+        columns.append((f"filters_level_{level.application_level}", level.preceding_filters))
+    columns.append(("is_selected", []))
+    return columns
+
+
+def get_combination_counts(plan: plans.SelectionPlan, compiled: plans.Plans, df: pd.DataFrame, engine: str = 'native',
+                           workers: int = None, atoms: predicate_cache.AtomCache = None) -> pd.DataFrame:
+    """
+    Returns number of rows (rows column) of each combination of the flag columns of summary plan
+    (and as-of date of stacked input data)
+    """
+    keys = ([compiled.as_of_column] if compiled.as_of_column else []) + [c for c, _ in get_flag_columns(plan)]
+    if engine == 'native':
+        tasks = selection.get_selection_tasks(plan, compiled.universe_attributes, df.columns.tolist(),
+                                              window_functions.Partitions(), atoms)
+        # attribute columns are freed as soon as the filters reading them are computed
+        results, _ = scheduler.run_tasks(tasks, df, workers, keep=set(keys))
+        flags = pd.DataFrame({c: np.asarray(df[c] if c == compiled.as_of_column else results[c]) for c in keys})
+        return flags.value_counts(dropna=False, sort=False).reset_index(name='rows')
+    columns = ', '.join(keys)
+    sql = f"select {columns}, count(*) as n from ({plan.sql}) s group by {columns}"
+    return selection.SQL_BACKENDS[engine].run(sql, df).rename(columns={'n': 'rows'})
+
+
+def get_column_counts(output_id: str, plan: plans.SelectionPlan, counts: pd.DataFrame,
+                      as_of_column: str = None) -> pd.DataFrame:
+    """
+    Returns rows reaching the level of each flag column of plan (passing the preceding levels), those of them
+    passing it and their ratio, by as-of date of stacked input data
+    """
+    keys = [as_of_column] if as_of_column else []
+    records = []
+    for key, group in (counts.groupby(keys, sort=True, dropna=False) if keys else [((), counts)]):
+        rows = group['rows'].to_numpy()
+        for column, preceding_filters in get_flag_columns(plan):
+            reached_mask = (group[preceding_filters].to_numpy() == 1).all(axis=1)
+            reached = int(rows[reached_mask].sum())
+            passed = int(rows[reached_mask & (group[column].to_numpy() == 1)].sum())
+            records.append({'selection_id': output_id, **dict(zip(keys, key)), 'column': column, 'passed': passed,
+                            'reached': reached, 'pass_rate': passed / reached if reached else None})
+    return pd.DataFrame(records)
+
+
+def get_failed_filters_counts(output_id: str, plan: plans.SelectionPlan, counts: pd.DataFrame,
+                              as_of_column: str = None) -> pd.DataFrame:
+    """
+    Returns number of rows of each combination of failed filters (names joined by ';' as in failed_filters
+    outputs), most frequent first (ties by failed filters, so all engines list them alike), by as-of date
+    of stacked input data
+    """
+    keys = [as_of_column] if as_of_column else []
+    filter_columns = np.array([c for c, _ in get_flag_columns(plan) if c.startswith('filter_')])
+    failed = [';'.join(filter_columns[row]) for row in counts[filter_columns].to_numpy() != 1]
+    failed_counts = counts[keys + ['rows']].assign(failed_filters=failed) \
+        .groupby(keys + ['failed_filters'], sort=False, dropna=False)['rows'].sum().reset_index()
+    failed_counts = failed_counts.sort_values(keys + ['rows', 'failed_filters'],
+                                              ascending=[True] * len(keys) + [False, True], kind='stable')
+    return failed_counts.assign(selection_id=output_id)[['selection_id'] + keys + ['failed_filters', 'rows']]
+
+
+def summarize_selections(df: pd.DataFrame, compiled: plans.Plans, engine: str = 'native', workers: int = None,
+                         atoms: predicate_cache.AtomCache = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Counts compiled selection plans over loaded input data, see summarize
+    """
+    if engine not in selection.ENGINES:
+        raise ValueError(f"Unknown engine {engine}, expected one of {selection.ENGINES}")
+    selection.check_input_data(df, compiled)
+    if engine == 'native' and atoms is None:
+        atoms = predicate_cache.AtomCache(df)
+    column_counts, failed_counts = [], []
+    for plan in compiled.selections:
+        output_id = plan.selection.get_output_id()
+        summary_plan = get_summary_plan(plan, compiled)
+        counts = get_combination_counts(summary_plan, compiled, df, engine, workers, atoms)
+        column_counts.append(get_column_counts(output_id, summary_plan, counts, compiled.as_of_column))
+        failed_counts.append(get_failed_filters_counts(output_id, summary_plan, counts, compiled.as_of_column))
+    return pd.concat(column_counts, ignore_index=True), pd.concat(failed_counts, ignore_index=True)
+
+
+def summarize(client_input_folder: str, engine: str = 'native', workers: int = None,
+              cache_folder: str = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Counts all selections of client_input_folder: rows passed and reached each filter_<id>, filters_level_<n>
+    and is_selected column of each selection, and rows of each combination of failed filters
+    """
+    df, compiled = selection.get_inputs(client_input_folder, cache_folder)
+    return summarize_selections(df, compiled, engine, workers)
+
+
+def run(client_input_folder: str, client_output_folder: str, engine: str = 'native', workers: int = None,
+        cache_folder: str = None):
+    """
+    Writes counts of all selections of client_input_folder to summary.csv and failed_filters.csv
+    of client_output_folder instead of their outputs
+    """
+    column_counts, failed_counts = summarize(client_input_folder, engine, workers, cache_folder)
+    column_counts.to_csv(os.path.join(client_output_folder, SUMMARY_FILE_NAME), index=False)
+    failed_counts.to_csv(os.path.join(client_output_folder, FAILED_FILTERS_FILE_NAME), index=False)
+
+
+def main(args: List[str] = None):
+    parser = argparse.ArgumentParser(description='Counts rows passing filters of selections of a client folder')
+    parser.add_argument('client_input_folder')
+    parser.add_argument('--output-folder', help=f'folder to write {SUMMARY_FILE_NAME} and '
+                                                f'{FAILED_FILTERS_FILE_NAME} to instead of printing them')
+    parser.add_argument('--engine', choices=selection.ENGINES, default='native')
+    parser.add_argument('--workers', type=int, help='threads of the native engine per selection')
+    parser.add_argument('--cache-folder', help='column cache of input data')
+    options = parser.parse_args(args)
+    if options.output_folder:
+        os.makedirs(options.output_folder, exist_ok=True)
+        run(options.client_input_folder, options.output_folder, options.engine, options.workers,
+            options.cache_folder)
+        return 0
+    column_counts, failed_counts = summarize(options.client_input_folder, options.engine, options.workers,
+                                             options.cache_folder)
+    print(column_counts.to_string(index=False))
+    print()
+    print(failed_counts.to_string(index=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,18 @@
+import attributes
+
+
+def test_partition_by_as_of_leaves_universe_unchanged():
+    universe = attributes.get_universe_attributes([
+        {"attr_code": "X", "attr_type": "INPUT", "attr_data_type": "NUMBER"},
+        {"attr_code": "R_X", "attr_type": "RANK", "attr_data_type": "NUMBER", "partition_by": "P",
+         "rank_attrs": [{"attr_code": "X", "order": 1, "direction": "DESC"}]},
+        {"attr_code": "A_SUM_X", "attr_type": "AGGREGATE", "attr_data_type": "NUMBER", "aggregate_attr_code": "X",
+         "aggregate_function": "SUM", "aggregate_direction": None},
+    ])
+    first = attributes.partition_by_as_of(universe, 'D')
+    second = attributes.partition_by_as_of(universe, 'D')
+    assert [attr.partition_by for attr in universe[1:]] == [['P'], []]
+    for partitioned in (first, second):
+        assert [attr.code for attr in partitioned] == ['X', 'R_X', 'A_SUM_X', 'D']
+        assert [attr.partition_by for attr in partitioned[1:3]] == [['D', 'P'], ['D']]
+    assert attributes.partition_by_as_of(first, 'D')[1] is first[1]
@@ -0,0 +1,30 @@
+import batch
+import check_engines
+
+
+def test_inputs_cache_drops_least_recently_used_inputs(source_data, tmp_path):
+    synthetic = str(tmp_path / 'synthetic')
+    check_engines.write_synthetic_folder(synthetic, rows=100)
+    cache = batch.InputsCache(input_bytes=1, plan_count=1)
+    df, compiled, _, _ = cache.get_inputs(source_data)
+    assert cache.get_inputs(source_data)[0] is df and cache.get_inputs(source_data)[1] is compiled
+    cache.get_inputs(synthetic)
+    # over the limits only the last inputs are kept
+    assert len(cache._input_data) == 1 and len(cache._plans) == 1
+    assert cache.get_inputs(source_data)[0] is not df
+
+
+def test_inputs_cache_keeps_inputs_within_limits(source_data, tmp_path):
+    synthetic = str(tmp_path / 'synthetic')
+    check_engines.write_synthetic_folder(synthetic, rows=100)
+    cache = batch.InputsCache(input_bytes=1 << 30, plan_count=2)
+    df = cache.get_inputs(source_data)[0]
+    cache.get_inputs(synthetic)
+    assert cache.get_inputs(source_data)[0] is df
+    assert len(cache._input_data) == 2 and len(cache._plans) == 2
+
+
+def test_run_batch(source_data, tmp_path):
+    sessions = batch.get_sessions([source_data, source_data], str(tmp_path))
+    results, _ = batch.run_batch(sessions, processes=1)
+    assert [result.error for result in results] == ['', '']
@@ -0,0 +1,23 @@
+import os
+
+import pytest
+
+import check_engines
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='module', params=['source_data', 'synthetic'])
+def differences(request, tmp_path_factory):
+    work_folder = tmp_path_factory.mktemp(request.param)
+    if request.param == 'synthetic':
+        client_input_folder = str(work_folder / 'input')
+        check_engines.write_synthetic_folder(client_input_folder, rows=1000)
+    else:
+        client_input_folder = os.path.join(ROOT, request.param)
+    return check_engines.check_folder(client_input_folder, str(work_folder / 'output'))
+
+
+@pytest.mark.parametrize('run', list(check_engines.RUNS))
+def test_run_matches_sql_engine(differences, run):
+    assert [difference for difference in differences if difference.run == run] == []
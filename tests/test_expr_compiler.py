@@ -0,0 +1,10 @@
+import expr_compiler
+import sql_expr_parser
+
+
+def test_programs_cache_is_bounded():
+    assert expr_compiler.get_programs.cache_info().maxsize is not None
+    for i in range(expr_compiler.get_programs.cache_info().maxsize + 10):
+        expr_compiler.get_programs(sql_expr_parser.parse(f'x + {i} > y'))
+    info = expr_compiler.get_programs.cache_info()
+    assert info.currsize == info.maxsize
@@ -0,0 +1,34 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+import check_engines
+import selection
+
+
+@pytest.mark.parametrize('options', [dict(engine='sql', memory_budget=1 << 16),
+                                     dict(engine='duckdb', memory_budget=1 << 16),
+                                     dict(engine='sql', shard_processes=2),
+                                     dict(engine='native', memory_budget=1 << 16, shard_processes=2)])
+def test_unsupported_options_are_rejected(source_data, tmp_path, options):
+    with pytest.raises(ValueError):
+        selection.run(source_data, str(tmp_path), **options)
+    assert not os.listdir(tmp_path)
+
+
+def test_sweep_runs_within_memory_budget(tmp_path):
+    client_input_folder = str(tmp_path / 'input')
+    check_engines.write_synthetic_folder(client_input_folder, rows=500)
+    sweep = {"selection_id": 1, "output_attrs": check_engines.SYNTHETIC_OUTPUT_ATTRS,
+             "filters": [dict(f, expression="R_X_P <= {n}") if f['filter_id'] == 3 else f
+                         for f in check_engines.SYNTHETIC_FILTERS],
+             "parameters": {"n": [50, 300]},
+             "output_settings": {"show_all": 1, "add_attributes": 1, "add_filters": 1, "add_failed_filters": 0}}
+    with open(os.path.join(client_input_folder, selection.SELECTIONS_FILE_NAME), 'w') as file:
+        json.dump({"selections": [sweep]}, file)
+    runs = {'native': dict(engine='native'), 'native_memory_budget': dict(engine='native', memory_budget=1 << 12)}
+    assert check_engines.check_folder(client_input_folder, str(tmp_path / 'output'), runs) == []
+    memory = pd.read_csv(tmp_path / 'output' / 'native_memory_budget' / 'memory.csv')
+    assert memory['selection_id'].tolist() == [1] and memory['spilled_bytes'].iloc[0] > 0
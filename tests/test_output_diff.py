@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+import general
+import output_diff
+import selection
+import server
+
+
+def test_diff_only_run_is_not_a_reference(source_data, tmp_path):
+    full, diff_only, other = (tmp_path / name for name in ('full', 'diff_only', 'other'))
+    for folder in (full, diff_only, other):
+        folder.mkdir()
+    selection.run(source_data, str(full), engine='native')
+    selection.run(source_data, str(diff_only), engine='native', reference_folder=str(full))
+    assert not any(output_diff.OUTPUT_FILE_PATTERN.fullmatch(name) for name in os.listdir(diff_only))
+    with pytest.raises(output_diff.OutputDiffError):
+        selection.run(source_data, str(other), engine='native', reference_folder=str(diff_only))
+
+
+def test_duplicate_keys_are_rejected():
+    output = 'K,A\n1,x\n2,y\n'
+    with pytest.raises(output_diff.OutputDiffError, match='reference output'):
+        output_diff.get_diff(output, 'K,A\n1,x\n1,z\n', ['K'])
+    with pytest.raises(output_diff.OutputDiffError, match='in output'):
+        output_diff.get_diff('K,A\n2,x\n2,y\n', output, ['K'])
+
+
+def test_server_rejects_diff_only_reference_session(source_data, tmp_path, monkeypatch):
+    monkeypatch.setattr(general, 'sessions_root', general.sessions_root)
+    monkeypatch.setattr(general, 'input_folder', general.input_folder)
+    monkeypatch.setattr(general, 'output_folder', general.output_folder)
+    monkeypatch.setattr(general, 'cache_folder', general.cache_folder)
+    general.set_sessions_root(str(tmp_path))
+    client = server.app.test_client()
+
+    def upload(session_id, reference_session_id=None):
+        files = [(open(os.path.join(source_data, name), 'rb'), name) for name in
+                 (selection.UNIVERSE_FILE_NAME, selection.SELECTIONS_FILE_NAME, selection.INPUT_DATA_FILE_NAME)]
+        params = {'session_id': session_id, **({'reference_session_id': reference_session_id}
+                                               if reference_session_id else {})}
+        try:
+            return client.post('/', query_string=params, data={'source': files})
+        finally:
+            for file, _ in files:
+                file.close()
+
+    assert upload('full').status_code == 200
+    assert upload('diff', 'full').status_code == 200
+    response = upload('other', 'diff')
+    assert response.status_code == 409
+    assert b'no outputs' in response.data
@@ -0,0 +1,36 @@
+import os
+import pickle
+
+import pytest
+
+import plans
+import selection
+
+
+def _plans_file(source_data: str, cache_folder: str) -> str:
+    key = plans.get_key(os.path.join(source_data, selection.UNIVERSE_FILE_NAME),
+                        os.path.join(source_data, selection.SELECTIONS_FILE_NAME))
+    return plans._get_plans_file(cache_folder, key)
+
+
+class _Removed:
+    pass
+
+
+@pytest.mark.parametrize('content', [
+    lambda compiled: pickle.dumps(compiled)[:100],
+    lambda compiled: b'',
+    lambda compiled: b'not a pickle',
+    lambda compiled: pickle.dumps(_Removed()).replace(b'_Removed', b'_Renamed'),
+], ids=['truncated', 'empty', 'garbage', 'missing class'])
+def test_unreadable_plans_are_recompiled(source_data, tmp_path, content):
+    cache_folder = str(tmp_path)
+    compiled = selection.get_plans(source_data, cache_folder)
+    plans_file = _plans_file(source_data, cache_folder)
+    with open(plans_file, 'wb') as file:
+        file.write(content(compiled))
+    assert [plan.sql for plan in selection.get_plans(source_data, cache_folder).selections] == \
+        [plan.sql for plan in compiled.selections]
+    # the unreadable file is replaced by the recompiled plans
+    assert plans.read_plans(cache_folder, os.path.basename(plans_file)[len('plans_'):-len('.pickle')]) is not None
+    assert not [name for name in os.listdir(cache_folder) if name.endswith('.tmp')]
@@ -0,0 +1,73 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import attributes
+import selection
+import selections
+import sql_expr_evaluator
+import sql_expr_parser
+
+FILTERS = [
+    "x is not 1", "x is 1", "not (x is not 1)", "x is not 1 and x is not 2", "s is not 'a'", "x is not y",
+    "x is not 1 or y > 2", "1 is not x",
+]
+
+
+@pytest.fixture(scope='module')
+def df() -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    n = 100
+    return pd.DataFrame({'X': np.where(rng.random(n) < 0.3, np.nan, rng.integers(0, 4, n)),
+                         'Y': np.where(rng.random(n) < 0.3, np.nan, rng.integers(0, 4, n)),
+                         'S': rng.choice(np.array(['a', 'b', None], dtype=object), n)})
+
+
+def _sqlite_filter(expression: str, df: pd.DataFrame) -> list:
+    connection = sqlite3.connect(':memory:')
+    df.to_sql('df', connection, index=False)
+    return [row[0] for row in connection.execute(f'select case when {expression} then 1 else 0 end from df')]
+
+
+def test_is_not_keeps_null_semantics():
+    assert sql_expr_parser.simplify_filter('x is not 1') == 'X is not 1'
+    assert sql_expr_parser.simplify_filter('x is null or x is not null') == '1=1'
+
+
+@pytest.mark.parametrize('expression', FILTERS)
+def test_simplified_filter_selects_raw_filter_rows(df, expression):
+    expected = _sqlite_filter(expression, df)
+    simplified = sql_expr_parser.simplify_filter(expression)
+    assert _sqlite_filter(simplified, df) == expected
+    assert sql_expr_evaluator.evaluate_filter(simplified, df).tolist() == expected
+    duckdb = selection.SQL_BACKENDS['duckdb'].run(f'select case when {simplified} then 1 else 0 end as f from df', df)
+    assert duckdb['f'].tolist() == expected
+
+
+def test_ranges_of_text_are_not_merged():
+    df = pd.DataFrame({'S': ['2', '10', '95', '9', 'a', None]})
+    expression = 's > 9 and s > 10'
+    simplified = sql_expr_parser.simplify_filter(expression)
+    assert simplified == 'S > 9 and S > 10'
+    assert _sqlite_filter(simplified, df) == _sqlite_filter(expression, df) == [0, 0, 1, 0, 1, 0]
+
+
+def test_ranges_of_numeric_expressions_are_merged():
+    assert sql_expr_parser.simplify_filter('r > 9 and r > 10', frozenset({'R'})) == 'R > 10'
+    assert sql_expr_parser.simplify_filter('s * 2 > 9 and s * 2 > 10') == 'S * 2 > 10'
+
+
+def test_plans_merge_ranges_of_ranks_only():
+    universe = attributes.get_universe_attributes([
+        {"attr_code": "S", "attr_type": "INPUT", "attr_data_type": "VARCHAR(255)"},
+        {"attr_code": "R", "attr_type": "RANK", "attr_data_type": "NUMBER",
+         "rank_attrs": [{"attr_code": "S", "order": 1, "direction": "ASC"}]}])
+    sels = selections.get_selections([{
+        "selection_id": 1, "output_attrs": [],
+        "filters": [{"filter_id": 1, "expression": "r > 9 and r > 10", "application_level": 1},
+                    {"filter_id": 2, "expression": "s > 9 and s > 10", "application_level": 1}],
+        "output_settings": {"show_all": 1, "add_attributes": 0, "add_filters": 1, "add_failed_filters": 0}}])
+    compiled = selection.compile_plans(universe, 'S', sels)
+    assert compiled.selections[0].levels[0].filters == [(1, 'R > 10'), (2, 'S > 9 and S > 10')]
@@ -0,0 +1,11 @@
+import sql_expr_parser
+
+
+def test_parsed_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(sql_expr_parser, 'max_parsed', 10)
+    for i in range(20):
+        sql_expr_parser.parse(f'x > {i}')
+    sql_expr_parser.simplify_filter('x > 1 and x > 2')
+    sql_expr_parser.add_parsed({f'y = {i}': ('binop', '=', ('col', 'Y'), ('lit', i)) for i in range(5)})
+    assert len(sql_expr_parser._parsed) == 10
+    assert sql_expr_parser.parse('x > 0') == ('binop', '>', ('col', 'X'), ('lit', 0))
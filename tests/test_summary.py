@@ -0,0 +1,18 @@
+import pandas as pd
+import pytest
+
+import summary
+
+
+@pytest.mark.parametrize('engine', ['native', 'sql', 'duckdb'])
+def test_passed_counts_only_reached_rows(source_data, engine):
+    column_counts, _ = summary.summarize(source_data, engine)
+    assert (column_counts['passed'] <= column_counts['reached']).all()
+    filter_13 = column_counts[column_counts['column'] == 'filter_13'].iloc[0]
+    assert (filter_13['passed'], filter_13['reached']) == (269, 270)
+
+
+def test_engines_list_failed_filters_alike(source_data):
+    counts = [summary.summarize(source_data, engine)[1] for engine in ('native', 'sql', 'duckdb')]
+    for other in counts[1:]:
+        pd.testing.assert_frame_equal(other, counts[0])
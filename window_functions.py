@@ -0,0 +1,248 @@
+import threading
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Native implementations of the window functions generated by attributes.get_sql_expression.
+# Null ordering follows SQLite: NULL is the smallest value, so it comes first for ASC and last for DESC
+# unless NULLS LAST is requested explicitly.
+
+AGGREGATE_FUNCTIONS = ('SUM', 'AVG', 'MIN', 'MAX', 'COUNT')
+
+
+class Partitions:
+    """
+    Caches factorized partition keys, so that all window functions of a selection with the same
+    partition_by share one group-by. Safe to share between threads computing attributes concurrently
+    """
+
+    def __init__(self):
+        self._codes: Dict[Tuple[str, ...], Tuple[np.ndarray, int]] = {}
+        self._lock = threading.Lock()
+
+    def get_codes(self, df: pd.DataFrame, partition_by: List[str] = None) -> Tuple[np.ndarray, int]:
+        """
+        Returns group code of each row of df and number of groups of partition_by columns,
+        NULL keys form a group of their own
+        """
+        key = tuple(partition_by or ())
+        with self._lock:
+            if key not in self._codes:
+                codes, n_groups = np.zeros(len(df), dtype=np.int64), 1
+                for column in key:
+                    column_codes, uniques = pd.factorize(df[column], use_na_sentinel=False)
+                    # codes of the columns so far combined with the next column, refactorized to stay dense
+                    codes, combined = pd.factorize(codes * len(uniques) + column_codes)
+                    codes, n_groups = codes.astype(np.int64), len(combined)
+                self._codes[key] = codes, n_groups
+            return self._codes[key]
+
+
+def get_mask(df: pd.DataFrame, filter_columns: List[str]) -> np.ndarray:
+    """
+    Returns rows passed all filter_columns (0/1 flags) as a boolean array
+    """
+    mask = np.ones(len(df), dtype=bool)
+    for column in filter_columns:
+        mask &= df[column].to_numpy() == 1
+    return mask
+
+
+def is_numeric(values: pd.Series) -> bool:
+    return pd.api.types.is_numeric_dtype(values.dtype) and not pd.api.types.is_bool_dtype(values.dtype)
+
+
+def sort_key(values: pd.Series, direction: str = 'ASC', nulls_last: bool = None) -> np.ndarray:
+    """
+    Returns float array which sorts ascending in the order of 'order by values direction'
+    """
+    if is_numeric(values):
+        key = values.to_numpy(dtype=np.float64, na_value=np.nan)
+    else:
+        codes, _ = pd.factorize(values, sort=True)
+        key = np.where(codes < 0, np.nan, codes).astype(np.float64)
+    descending = direction.upper() == 'DESC'
+    if descending:
+        key = -key
+    if nulls_last is None:
+        nulls_last = descending
+    return np.where(np.isnan(key), np.inf if nulls_last else -np.inf, key)
+
+
+def _sort(codes: np.ndarray, keys: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Sorts rows by partition and keys, returns the order and flags of partition and peer group starts
+    """
+    order = np.lexsort([*reversed(keys), codes]) if keys else np.argsort(codes, kind='stable')
+    sorted_codes = codes[order]
+    new_partition = np.ones(len(order), dtype=bool)
+    new_partition[1:] = sorted_codes[1:] != sorted_codes[:-1]
+    new_peer = new_partition.copy()
+    for key in keys:
+        sorted_key = key[order]
+        new_peer[1:] |= sorted_key[1:] != sorted_key[:-1]
+    return order, new_partition, new_peer
+
+
+def _starts(flags: np.ndarray) -> np.ndarray:
+    """
+    Returns for each position the position where its run (partition or peer group) starts
+    """
+    positions = np.arange(len(flags))
+    return np.maximum.accumulate(np.where(flags, positions, 0)) if len(flags) else positions
+
+
+def _ends(flags: np.ndarray) -> np.ndarray:
+    """
+    Returns for each position the last position of its run (partition or peer group)
+    """
+    n = len(flags)
+    positions = np.arange(n)
+    last = np.zeros(n, dtype=bool)
+    last[:-1] = flags[1:]
+    if n:
+        last[-1] = True
+    return np.minimum.accumulate(np.where(last, positions, n)[::-1])[::-1]
+
+
+def rank(codes: np.ndarray, keys: List[np.ndarray]) -> np.ndarray:
+    """
+    sql: rank() over (partition by codes order by keys)
+    """
+    order, new_partition, new_peer = _sort(codes, keys)
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = _starts(new_peer) - _starts(new_partition) + 1
+    return ranks
+
+
+def _top_rows(keys: List[np.ndarray], rows: np.ndarray, limit: int) -> np.ndarray:
+    """
+    Returns rows of a partition which rank within limit: a partial selection (np.partition) of the limit-th
+    value of the first key, rows tied on it are narrowed down by the next keys
+    """
+    ahead = []
+    for key in keys:
+        if len(rows) <= limit:
+            break
+        values = key[rows]
+        kth = np.partition(values, limit - 1)[limit - 1]
+        before = values < kth
+        ahead.append(rows[before])
+        limit -= int(before.sum())
+        rows = rows[values == kth]
+    return np.concatenate(ahead + [rows])
+
+
+def top_rank(codes: np.ndarray, n_groups: int, keys: List[np.ndarray], limit: int) -> np.ndarray:
+    """
+    Same as rank(codes, keys) for rows ranked within limit, the other rows get limit + 1.
+    Only the rows within limit of each partition are sorted
+    """
+    ranks = np.full(len(codes), limit + 1, dtype=np.int64)
+    if limit < 1 or not len(codes):
+        return ranks
+    if n_groups == 1:
+        rows = _top_rows(keys, np.arange(len(codes)), limit)
+    elif len(codes) < 2 * limit * n_groups:
+        # partitions are too small for partial selection to pay off
+        return np.minimum(rank(codes, keys), limit + 1)
+    else:
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(n_groups + 1))
+        rows = np.concatenate([_top_rows(keys, order[start:end], limit)
+                               for start, end in zip(bounds[:-1], bounds[1:])])
+    # every row preceding a top row is a top row too, so ranks among them are the exact ranks
+    ranks[rows] = rank(codes[rows], [key[rows] for key in keys])
+    return ranks
+
+
+def _result_dtype(values: pd.Series, function: str, result: np.ndarray) -> np.ndarray:
+    if function == 'COUNT':
+        return result.astype(np.int64)
+    if function != 'AVG' and pd.api.types.is_integer_dtype(values.dtype) and not np.isnan(result).any():
+        return result.astype(np.int64)
+    return result
+
+
+def _text_codes(values: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns position of each value among the sorted distinct values (NaN for NULL) and the distinct values,
+    MIN and MAX of text compare the positions
+    """
+    codes, uniques = pd.factorize(values, sort=True)
+    return np.where(codes < 0, np.nan, codes).astype(np.float64), np.asarray(uniques, dtype=object)
+
+
+def _from_text_codes(result: np.ndarray, uniques: np.ndarray) -> np.ndarray:
+    text = np.full(len(result), None, dtype=object)
+    present = ~np.isnan(result)
+    text[present] = uniques[result[present].astype(np.int64)]
+    return text
+
+
+def aggregate(values: pd.Series, mask: np.ndarray, codes: np.ndarray, function: str) -> np.ndarray:
+    """
+    sql: function(case when mask then values end) over (partition by codes)
+    """
+    if function == 'COUNT':
+        present = pd.Series(values.notna().to_numpy() & mask)
+        return present.groupby(codes, sort=False).transform('sum').to_numpy(dtype=np.int64)
+    if function in ('MIN', 'MAX') and not is_numeric(values):
+        # text keeps its dtype and is compared as text, as by sql
+        grouped = values.reset_index(drop=True).where(mask).groupby(codes, sort=False)
+        result = grouped.transform(function.lower())
+        return np.where(result.isna(), None, result.to_numpy(dtype=object))
+    masked = pd.Series(values.to_numpy(dtype=np.float64, na_value=np.nan)).where(mask)
+    grouped = masked.groupby(codes, sort=False)
+    if function == 'SUM':
+        result = grouped.transform('sum', min_count=1)
+    elif function == 'AVG':
+        result = grouped.transform('mean')
+    elif function == 'MIN':
+        result = grouped.transform('min')
+    elif function == 'MAX':
+        result = grouped.transform('max')
+    else:
+        raise ValueError(f'Unsupported aggregate function: {function}')
+    return _result_dtype(values, function, result.to_numpy(dtype=np.float64))
+
+
+def running_aggregate(values: pd.Series, mask: np.ndarray, codes: np.ndarray, function: str,
+                      direction: str) -> np.ndarray:
+    """
+    sql: function(case when mask then values end) over (partition by codes order by values direction)
+    with the default frame, i.e. rows up to the current one and its peers
+    """
+    order, new_partition, new_peer = _sort(codes, [sort_key(values, direction)])
+    uniques = None
+    if function == 'COUNT':
+        # only whether values are NULL counts
+        numbers = np.where(values.notna().to_numpy(), 0.0, np.nan)
+    elif function in ('MIN', 'MAX') and not is_numeric(values):
+        numbers, uniques = _text_codes(values)
+    else:
+        numbers = values.to_numpy(dtype=np.float64, na_value=np.nan)
+    masked = numbers[order]
+    masked[~mask[order]] = np.nan
+    sorted_values = pd.Series(masked)
+    partition_ids = np.cumsum(new_partition)
+    grouped = sorted_values.groupby(partition_ids, sort=False)
+    counts = pd.Series(~np.isnan(masked)).groupby(partition_ids, sort=False).cumsum().to_numpy(dtype=np.float64)
+    if function in ('SUM', 'AVG'):
+        sums = grouped.cumsum().groupby(partition_ids, sort=False).ffill().fillna(0).to_numpy()
+        cumulative = sums if function == 'SUM' else sums / np.where(counts == 0, np.nan, counts)
+        cumulative = np.where(counts == 0, np.nan, cumulative)
+    elif function in ('MIN', 'MAX'):
+        cumulative = (grouped.cummin() if function == 'MIN' else grouped.cummax())
+        cumulative = cumulative.groupby(partition_ids, sort=False).ffill().to_numpy()
+    elif function == 'COUNT':
+        cumulative = counts
+    else:
+        raise ValueError(f'Unsupported aggregate function: {function}')
+    result = np.empty(len(order), dtype=np.float64)
+    # peers share the value of the last row of their peer group
+    result[order] = cumulative[_ends(new_peer)]
+    if uniques is not None:
+        return _from_text_codes(result, uniques)
+    return _result_dtype(values, function, result)